@@ -1,12 +1,33 @@
-from flask import Flask, render_template, request, redirect, session, flash, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, session, flash, jsonify, send_from_directory, g, has_app_context, has_request_context, Response
 import os
+import csv
+import gzip
+import json
+import queue
+import random
+import select
+import sys
+import time
+import threading
+import zlib
 from functools import wraps
 from hashlib import sha256
+from collections import OrderedDict
 from contextlib import contextmanager
 from datetime import date, datetime, timedelta
+from io import StringIO
 import locale
+import click
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "dev_secret")
@@ -47,6 +68,11 @@ def obtener_dia_semana(fecha_str):
     
     return f"{dia_nombre} {dia_mes}"
 
+def rango_fechas(desde, hasta):
+    """Rango semiabierto [desde 00:00, hasta+1 00:00) para filtrar fecha_hora sin DATE() y usar los índices"""
+    return (datetime.combine(desde, datetime.min.time()),
+            datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+
 # ========= DATABASE =========
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
@@ -58,22 +84,368 @@ if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
 
+# ========= MÉTRICAS =========
+# Latencia por ruta, consultas y tiempo de DB por request y espera de conexión, en /metrics (formato Prometheus).
+# Son por proceso: cada worker de gunicorn lleva las suyas y se distinguen por la etiqueta pid
+METRICAS_LENTO_MS = float(os.environ.get("METRICAS_LENTO_MS", 500))
+METRICAS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histograma:
+    def __init__(self, buckets=METRICAS_BUCKETS):
+        self.buckets = buckets
+        self.cuentas = [0] * len(buckets)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.cuentas[i] += 1
+                break
+        self.suma += valor
+        self.total += 1
+
+    def lineas(self, nombre, etiquetas):
+        acumulado = 0
+        for limite, cuenta in zip(self.buckets, self.cuentas):
+            acumulado += cuenta
+            yield f'{nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}'
+        yield f'{nombre}_bucket{{{etiquetas},le="+Inf"}} {self.total}'
+        yield f"{nombre}_sum{{{etiquetas}}} {self.suma:.6f}"
+        yield f"{nombre}_count{{{etiquetas}}} {self.total}"
+
+
+def _etiqueta(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencia = {}
+        self._consultas = {}
+        self._db = {}
+        self._errores = {}
+        self._espera_conexion = Histograma()
+
+    def consulta(self, sql, duracion):
+        """La llama CursorMedido en cada execute; fuera de un request no se atribuye a ninguna ruta"""
+        if not has_request_context():
+            return
+        g._met_consultas = g.get("_met_consultas", 0) + 1
+        g._met_db = g.get("_met_db", 0.0) + duracion
+        if duracion > g.get("_met_lenta", (0.0, None))[0]:
+            g._met_lenta = (duracion, sql)
+
+    def conexion(self, espera):
+        with self._lock:
+            self._espera_conexion.observar(espera)
+        if has_request_context():
+            g._met_conexion = g.get("_met_conexion", 0.0) + espera
+
+    def request(self, clave, duracion, consultas, tiempo_db, status):
+        with self._lock:
+            hist = self._latencia.get(clave)
+            if hist is None:
+                hist = self._latencia[clave] = Histograma()
+            hist.observar(duracion)
+            self._consultas[clave] = self._consultas.get(clave, 0) + consultas
+            self._db[clave] = self._db.get(clave, 0.0) + tiempo_db
+            if status >= 500:
+                self._errores[clave] = self._errores.get(clave, 0) + 1
+
+    def texto(self, pool=None, fragmentos=None):
+        pid = f'pid="{os.getpid()}"'
+        lineas = [
+            "# HELP facturador_request_duration_seconds Latencia de los requests por ruta",
+            "# TYPE facturador_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            claves = sorted(self._latencia)
+            for ruta, metodo in claves:
+                etiquetas = f'{pid},ruta="{_etiqueta(ruta)}",metodo="{metodo}"'
+                lineas.extend(self._latencia[(ruta, metodo)].lineas("facturador_request_duration_seconds", etiquetas))
+
+            lineas += ["# HELP facturador_db_queries_total Consultas SQL ejecutadas por ruta",
+                       "# TYPE facturador_db_queries_total counter"]
+            for ruta, metodo in claves:
+                lineas.append(f'facturador_db_queries_total{{{pid},ruta="{_etiqueta(ruta)}",metodo="{metodo}"}} '
+                              f'{self._consultas[(ruta, metodo)]}')
+
+            lineas += ["# HELP facturador_db_seconds_total Tiempo en la base por ruta",
+                       "# TYPE facturador_db_seconds_total counter"]
+            for ruta, metodo in claves:
+                lineas.append(f'facturador_db_seconds_total{{{pid},ruta="{_etiqueta(ruta)}",metodo="{metodo}"}} '
+                              f'{self._db[(ruta, metodo)]:.6f}')
+
+            lineas += ["# HELP facturador_request_errors_total Requests que terminaron en 5xx o excepción, por ruta",
+                       "# TYPE facturador_request_errors_total counter"]
+            for ruta, metodo in claves:
+                lineas.append(f'facturador_request_errors_total{{{pid},ruta="{_etiqueta(ruta)}",metodo="{metodo}"}} '
+                              f'{self._errores.get((ruta, metodo), 0)}')
+
+            lineas += ["# HELP facturador_db_acquire_seconds Espera para obtener una conexión del pool",
+                       "# TYPE facturador_db_acquire_seconds histogram"]
+            lineas.extend(self._espera_conexion.lineas("facturador_db_acquire_seconds", pid))
+
+        if pool is not None:
+            est = pool.estadisticas()
+            for clave, tipo in (("en_uso", "gauge"), ("esperando", "gauge"), ("max", "gauge"),
+                                ("checkouts", "counter"), ("timeouts", "counter"), ("descartadas", "counter")):
+                nombre = f"facturador_db_pool_{clave}" + ("_total" if tipo == "counter" else "")
+                lineas += [f"# TYPE {nombre} {tipo}", f"{nombre}{{{pid}}} {est[clave]}"]
+
+        if fragmentos is not None:
+            est = fragmentos.estadisticas()
+            for clave, tipo in (("aciertos", "counter"), ("fallos", "counter"), ("descartes", "counter"),
+                                ("fragmentos", "gauge"), ("bytes", "gauge"), ("max_bytes", "gauge")):
+                nombre = f"facturador_fragmentos_{clave}" + ("_total" if tipo == "counter" else "")
+                lineas += [f"# TYPE {nombre} {tipo}", f"{nombre}{{{pid}}} {est[clave]}"]
+        return "\n".join(lineas) + "\n"
+
+
+metricas = Metricas()
+
+
+class CursorMedido(RealDictCursor):
+    """Cursor del pool que cuenta y cronometra cada consulta del request"""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metricas.consulta(query, time.perf_counter() - inicio)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            metricas.consulta(query, time.perf_counter() - inicio)
+
+
+@app.before_request
+def _metricas_inicio():
+    g._met_inicio = time.perf_counter()
+
+
+@app.after_request
+def _metricas_status(response):
+    g._met_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def _metricas_fin(error=None):
+    """Se registra en el teardown y no en after_request, que no corre si la vista lanza una
+    excepción: esos requests cuentan con status 500"""
+    inicio = g.get("_met_inicio")
+    if inicio is None:
+        return
+    status = g.get("_met_status", 500)
+    duracion = time.perf_counter() - inicio
+    ruta = request.url_rule.rule if request.url_rule else "sin_ruta"
+    consultas = g.get("_met_consultas", 0)
+    tiempo_db = g.get("_met_db", 0.0)
+    metricas.request((ruta, request.method), duracion, consultas, tiempo_db, status)
+
+    if duracion * 1000 >= METRICAS_LENTO_MS:
+        lenta, sql = g.get("_met_lenta", (0.0, None))
+        if sql is not None and not isinstance(sql, str):
+            sql = sql.decode(errors="replace") if isinstance(sql, bytes) else str(sql)
+        app.logger.warning(
+            "Request lento: %s %s %.0f ms (status %s, %d consultas, %.0f ms en DB, %.0f ms esperando conexión). "
+            "Consulta más lenta (%.0f ms): %s",
+            request.method, ruta, duracion * 1000, status, consultas, tiempo_db * 1000,
+            g.get("_met_conexion", 0.0) * 1000, lenta * 1000,
+            " ".join(sql.split())[:500] if sql else "-")
+
+
+# ========= DB POOL =========
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+# Segundos de inactividad a partir de los cuales se verifica la conexión con SELECT 1
+DB_POOL_CHECK_IDLE = float(os.environ.get("DB_POOL_CHECK_IDLE", 30))
+
+
+class PoolDB:
+    """Pool de conexiones del proceso: espera acotada, health check y estadísticas"""
+
+    def __init__(self, dsn, minconn, maxconn, timeout, check_idle):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.pid = os.getpid()
+        self._pool = ThreadedConnectionPool(minconn, maxconn, dsn, cursor_factory=CursorMedido)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._ultimo_uso = {}
+        self._en_uso = 0
+        self._esperando = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._descartadas = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+
+    def _sana(self, con):
+        if con.closed:
+            return False
+        if time.monotonic() - self._ultimo_uso.get(id(con), 0) < self.check_idle:
+            return True
+        try:
+            with con.cursor() as cur:
+                cur.execute("SELECT 1")
+            con.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        inicio = time.perf_counter()
+        with self._lock:
+            self._esperando += 1
+        ok = self._slots.acquire(timeout=self.timeout)
+        with self._lock:
+            self._esperando -= 1
+            if not ok:
+                self._timeouts += 1
+        if not ok:
+            raise PoolError(f"Sin conexiones libres tras {self.timeout}s (max {self.maxconn})")
+
+        try:
+            con = self._pool.getconn()
+            while not self._sana(con):
+                self._descartar(con)
+                con = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        espera = time.perf_counter() - inicio
+        with self._lock:
+            self._en_uso += 1
+            self._checkouts += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+        return con
+
+    def _descartar(self, con):
+        self._ultimo_uso.pop(id(con), None)
+        with self._lock:
+            self._descartadas += 1
+        self._pool.putconn(con, close=True)
+
+    def putconn(self, con):
+        try:
+            if not con.closed and con.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                con.rollback()
+        except psycopg2.Error:
+            pass
+
+        if con.closed or con.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            self._descartar(con)
+        else:
+            self._ultimo_uso[id(con)] = time.monotonic()
+            self._pool.putconn(con)
+
+        with self._lock:
+            self._en_uso -= 1
+        self._slots.release()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "max": self.maxconn,
+                "en_uso": self._en_uso,
+                "esperando": self._esperando,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "descartadas": self._descartadas,
+                "espera_promedio_ms": round(self._espera_total / self._checkouts * 1000, 3) if self._checkouts else 0,
+                "espera_max_ms": round(self._espera_max * 1000, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# Pools heredados del proceso padre: se conservan sin cerrar para no cortar sus sockets
+_pools_heredados = []
+
+
+def obtener_pool():
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is not None and _pool.pid != os.getpid():
+                _pools_heredados.append(_pool)
+                _pool = None
+            if _pool is None:
+                _pool = PoolDB(DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_CHECK_IDLE)
+    return _pool
+
+
+def _reset_pool_en_hijo():
+    """Después del fork (workers de gunicorn) cada proceso arma su propio pool"""
+    global _pool, _pool_lock
+    if _pool is not None:
+        _pools_heredados.append(_pool)
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool_en_hijo)
+
+
 # ========= DB CONNECTION =========
 @contextmanager
 def get_db():
-    con = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    # Dentro de un request se reutiliza la conexión ya abierta (ej: turno_activo() dentro de ventas())
+    if has_app_context() and g.get("_db_con") is not None:
+        yield g._db_con
+        return
+
+    pool = obtener_pool()
+    inicio = time.perf_counter()
+    con = pool.getconn()
+    metricas.conexion(time.perf_counter() - inicio)
+    if has_app_context():
+        g._db_con = con
     try:
         yield con
         con.commit()
     except Exception:
-        con.rollback()
+        if not con.closed:
+            con.rollback()
+        raise
+    finally:
+        if has_app_context():
+            g.pop("_db_con", None)
+        pool.putconn(con)
+
+@contextmanager
+def conexion_directa(autocommit=False):
+    """Conexión fuera del pool, para tareas de arranque y scripts"""
+    con = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    con.autocommit = autocommit
+    try:
+        yield con
+        if not autocommit:
+            con.commit()
+    except Exception:
+        if not autocommit:
+            con.rollback()
         raise
     finally:
         con.close()
 
 # ========= INIT DB =========
 def init_db():
-    with get_db() as con:
+    with conexion_directa() as con:
         cur = con.cursor()
 
         cur.execute("""
@@ -162,10 +534,804 @@ def init_db():
         );
         """)
 
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalogo_version (
+            id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL
+        );
+        """)
+        cur.execute("INSERT INTO catalogo_version (id, version) VALUES (1, 1) ON CONFLICT (id) DO NOTHING")
+
+    migrar()
+
+# ========= MIGRACIONES =========
+# Clave del advisory lock: con varios procesos arrancando a la vez sólo uno migra
+MIGRACIONES_LOCK = 72410001
+# Segundos entre intentos de tomar el lock mientras otro proceso migra
+MIGRACIONES_ESPERA = 1.0
+
+
+def crear_indice(cur, nombre, definicion, unico=False):
+    """CREATE INDEX CONCURRENTLY idempotente: no bloquea escrituras y rehace índices que quedaron inválidos"""
+    cur.execute("""
+        SELECT i.indisvalid
+        FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = %s
+    """, (nombre,))
+    fila = cur.fetchone()
+    if fila and fila["indisvalid"]:
+        return
+    if fila:
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
+    cur.execute(f"CREATE {'UNIQUE ' if unico else ''}INDEX CONCURRENTLY {nombre} ON {definicion}")
+
+
+def _m001_notificar_pedidos(cur):
+    # Cada alta o cambio de estado de un pedido avisa a los workers (ver DifusorPedidos)
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION notificar_pedidos() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('pedidos', NEW.id::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS pedidos_notify ON pedidos")
+    cur.execute("""
+    CREATE TRIGGER pedidos_notify
+    AFTER INSERT OR UPDATE OF estado ON pedidos
+    FOR EACH ROW EXECUTE PROCEDURE notificar_pedidos();
+    """)
+
+
+def _m002_indices(cur):
+    crear_indice(cur, "ventas_turno_estado_idx", "ventas (turno_id, estado)")
+    crear_indice(cur, "ventas_delivery_idx", "ventas (estado_delivery, id) WHERE tipo_pedido = 'delivery'")
+    crear_indice(cur, "ventas_eliminadas_idx", "ventas (fecha_hora DESC) WHERE estado = 'ELIMINADA'")
+    crear_indice(cur, "detalle_venta_venta_idx", "detalle_venta (venta_id)")
+    crear_indice(cur, "pedido_detalle_pedido_idx", "pedido_detalle (pedido_id)")
+    crear_indice(cur, "pedidos_pendientes_idx", "pedidos (id) WHERE estado = 'PENDIENTE'")
+    crear_indice(cur, "turnos_abierto_idx", "turnos (id) WHERE estado = 'ABIERTO'")
+
+
+def _m003_claves_foraneas(cur):
+    # NOT VALID: se controlan las filas nuevas sin recorrer (ni bloquear) el historial existente
+    for tabla, columna, referencia, nombre in (
+        ("detalle_venta", "venta_id", "ventas", "detalle_venta_venta_fk"),
+        ("pedido_detalle", "pedido_id", "pedidos", "pedido_detalle_pedido_fk"),
+        ("ventas", "turno_id", "turnos", "ventas_turno_fk"),
+    ):
+        cur.execute("SELECT 1 FROM pg_constraint WHERE conname = %s", (nombre,))
+        if not cur.fetchone():
+            cur.execute(f"""
+                ALTER TABLE {tabla} ADD CONSTRAINT {nombre}
+                FOREIGN KEY ({columna}) REFERENCES {referencia} (id) NOT VALID
+            """)
+
+
+def _m004_indice_fecha(cur):
+    # Sirve a los filtros por rango semiabierto de fecha_hora (dashboard, delivery, reportes)
+    crear_indice(cur, "ventas_estado_fecha_idx", "ventas (estado, fecha_hora)")
+
+
+def _m005_resumen_diario(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ventas_diarias (
+        fecha DATE NOT NULL,
+        tipo_pedido TEXT NOT NULL,
+        medio_pago TEXT NOT NULL,
+        ventas INTEGER NOT NULL DEFAULT 0,
+        total BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (fecha, tipo_pedido, medio_pago)
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS productos_diarios (
+        fecha DATE NOT NULL,
+        producto_id INTEGER NOT NULL,
+        cantidad INTEGER NOT NULL DEFAULT 0,
+        total BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (fecha, producto_id)
+    );
+    """)
+    # Se llenan en la migración 12, cuando detalle_venta ya tiene producto_id
+
+
+def _m006_turno_unico(cur):
+    # Si quedaron turnos abiertos de más, se cierran todos menos el último antes de crear el índice único
+    cur.execute("""
+        UPDATE turnos t
+        SET estado='CERRADO',
+            total=COALESCE((SELECT SUM(v.total) FROM ventas v WHERE v.turno_id=t.id AND v.estado='OK'), 0)
+        WHERE t.estado='ABIERTO' AND t.id < (SELECT MAX(id) FROM turnos WHERE estado='ABIERTO')
+    """)
+    crear_indice(cur, "turnos_unico_abierto_idx", "turnos (estado) WHERE estado = 'ABIERTO'", unico=True)
+    cur.execute("DROP INDEX CONCURRENTLY IF EXISTS turnos_abierto_idx")
+
+
+def _m007_idempotencia_pedidos(cur):
+    cur.execute("SET lock_timeout = '5s'")
+    cur.execute("ALTER TABLE pedidos ADD COLUMN IF NOT EXISTS clave_idempotencia TEXT")
+    # Huella del cuerpo del pedido: la misma clave con otro pedido es un error, no un reintento
+    cur.execute("ALTER TABLE pedidos ADD COLUMN IF NOT EXISTS huella_idempotencia TEXT")
+    cur.execute("RESET lock_timeout")
+    crear_indice(cur, "pedidos_clave_idempotencia_idx",
+                 "pedidos (clave_idempotencia) WHERE clave_idempotencia IS NOT NULL", unico=True)
+
+
+def _m008_version_ventas(cur):
+    # version = xid de la transacción que tocó la fila por última vez (xid8 crece siempre).
+    # El tablero de delivery pide sólo las filas con version >= cursor, ver api_delivery()
+    cur.execute("SET lock_timeout = '5s'")
+    cur.execute("ALTER TABLE ventas ADD COLUMN IF NOT EXISTS version xid8")
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION ventas_version() RETURNS trigger AS $$
+    BEGIN
+        NEW.version := pg_current_xact_id();
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS ventas_version_trg ON ventas")
+    cur.execute("""
+    CREATE TRIGGER ventas_version_trg
+    BEFORE INSERT OR UPDATE ON ventas
+    FOR EACH ROW EXECUTE FUNCTION ventas_version();
+    """)
+    cur.execute("RESET lock_timeout")
+    crear_indice(cur, "ventas_version_idx", "ventas (version)")
+
+
+def _m009_turno_resumen(cur):
+    # Snapshot por producto de cada turno cerrado: ver o reimprimir un cierre es una lectura por clave.
+    # Se agrupa por producto_id y guarda el nombre al momento del cierre, que es lo que se reimprime
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS turno_resumen (
+        turno_id INTEGER NOT NULL REFERENCES turnos (id),
+        producto_id INTEGER NOT NULL,
+        producto TEXT NOT NULL,
+        cantidad INTEGER NOT NULL DEFAULT 0,
+        total BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (turno_id, producto_id)
+    );
+    """)
+    # Se llena en la migración 12, cuando detalle_venta ya tiene producto_id
+
+
+def _m010_eliminadas_keyset(cur):
+    # (fecha_hora, id): el cursor de la página de ventas eliminadas es único aunque coincidan las horas
+    crear_indice(cur, "ventas_eliminadas_fecha_id_idx",
+                 "ventas (fecha_hora DESC, id DESC) WHERE estado = 'ELIMINADA'")
+    cur.execute("DROP INDEX CONCURRENTLY IF EXISTS ventas_eliminadas_idx")
+
+
+def _m011_producto_id(cur):
+    # producto_dim: id -> último nombre conocido. Sobrevive al borrado del producto, así el historial
+    # sigue teniendo nombre; los ids salen de la secuencia de productos y nunca se repiten.
+    # El trigger sólo la mantiene al día: no cambia el id que se inserta (ver id_recuperado)
+    cur.execute("SET lock_timeout = '5s'")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS producto_dim (
+        id INTEGER PRIMARY KEY,
+        nombre TEXT NOT NULL
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS producto_dim_nombre_idx ON producto_dim (nombre)")
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION productos_dim() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO producto_dim (id, nombre) VALUES (NEW.id, NEW.nombre)
+        ON CONFLICT (id) DO UPDATE SET nombre = EXCLUDED.nombre;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS productos_dim_trg ON productos")
+    cur.execute("""
+    CREATE TRIGGER productos_dim_trg
+    BEFORE INSERT OR UPDATE OF nombre ON productos
+    FOR EACH ROW EXECUTE FUNCTION productos_dim();
+    """)
+    cur.execute("""
+        INSERT INTO producto_dim (id, nombre) SELECT id, nombre FROM productos
+        ON CONFLICT (id) DO UPDATE SET nombre = EXCLUDED.nombre
+    """)
+    cur.execute("ALTER TABLE detalle_venta ADD COLUMN IF NOT EXISTS producto_id INTEGER")
+    cur.execute("ALTER TABLE pedido_detalle ADD COLUMN IF NOT EXISTS producto_id INTEGER")
+    cur.execute("RESET lock_timeout")
+
+    # Nombres del historial que ya no están en el catálogo: id nuevo en la dimensión
+    cur.execute("""
+        INSERT INTO producto_dim (id, nombre)
+        SELECT nextval(pg_get_serial_sequence('productos', 'id')), n.nombre
+        FROM (SELECT DISTINCT COALESCE(producto, '') AS nombre FROM detalle_venta
+              UNION
+              SELECT DISTINCT COALESCE(producto, '') FROM pedido_detalle) n
+        WHERE NOT EXISTS (SELECT 1 FROM producto_dim d WHERE d.nombre = n.nombre)
+    """)
+    # Backfill en tandas cortas, cada una en su propia transacción, para no bloquear las ventas.
+    # La tanda se elige entre las líneas que tienen nombre en la dimensión: una tanda sólo con nombres
+    # desconocidos (escritos por workers viejos durante el deploy) actualizaría 0 filas y cortaría el bucle
+    for tabla in ("detalle_venta", "pedido_detalle"):
+        while True:
+            cur.execute(f"""
+                UPDATE {tabla} t SET producto_id = d.id
+                FROM (SELECT DISTINCT ON (nombre) nombre, id FROM producto_dim ORDER BY nombre, id) d
+                WHERE t.id IN (SELECT x.id FROM {tabla} x
+                               WHERE x.producto_id IS NULL
+                                 AND EXISTS (SELECT 1 FROM producto_dim pd WHERE pd.nombre = COALESCE(x.producto, ''))
+                               LIMIT 5000)
+                  AND d.nombre = COALESCE(t.producto, '')
+            """)
+            if cur.rowcount == 0:
+                break
+        cur.execute(f"SELECT COUNT(*) AS sin_id FROM {tabla} WHERE producto_id IS NULL")
+        sin_id = cur.fetchone()["sin_id"]
+        if sin_id:
+            print(f"⚠️ {tabla}: {sin_id} líneas quedaron sin producto_id (nombre fuera de producto_dim); "
+                  f"los resúmenes las agrupan como producto 0")
+    crear_indice(cur, "detalle_venta_producto_idx", "detalle_venta (producto_id)")
+
+
+def _m012_resumenes_por_producto_id(cur):
+    # Las tablas ya se crearon con producto_id (migraciones 5 y 9); acá se cargan desde el historial,
+    # ahora que detalle_venta tiene producto_id. Un renombre no parte el historial.
+    # No transaccional: se reconstruye de a un mes y de a un turno, cada tanda en su propia
+    # transacción, para no tener tomadas las tablas de resumen mientras se recorre todo el historial
+    con = cur.connection
+    cur.execute("""
+        SELECT MIN(fecha_hora)::date AS desde, MAX(fecha_hora)::date AS hasta
+        FROM ventas WHERE estado = 'OK'
+    """)
+    rango = cur.fetchone()
+    if rango["desde"] is not None:
+        inicio = rango["desde"].replace(day=1)
+        while inicio <= rango["hasta"]:
+            siguiente = (inicio + timedelta(days=32)).replace(day=1)
+            con.autocommit = False
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            reconstruir_resumen_diario(cur, inicio, siguiente - timedelta(days=1))
+            con.commit()
+            con.autocommit = True
+            inicio = siguiente
+
+    # guardar_resumen_turno es una sola sentencia: en autocommit cada turno es su propia transacción
+    cur.execute("SET lock_timeout = '5s'")
+    cur.execute("SELECT id FROM turnos WHERE estado = 'CERRADO' ORDER BY id")
+    for turno in cur.fetchall():
+        guardar_resumen_turno(cur, turno["id"])
+    cur.execute("RESET lock_timeout")
+
+
+def _m013_comanda_cocina(cur):
+    # Una fila por línea a preparar; listo NULL = todavía en la cola de su estación (ver ColaCocina)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS comanda_items (
+        id BIGSERIAL PRIMARY KEY,
+        venta_id INTEGER REFERENCES ventas (id),
+        pedido_id INTEGER REFERENCES pedidos (id),
+        origen TEXT NOT NULL,
+        producto_id INTEGER,
+        producto TEXT NOT NULL,
+        cantidad INTEGER NOT NULL,
+        extras TEXT NOT NULL DEFAULT '',
+        observaciones TEXT NOT NULL DEFAULT '',
+        creado TIMESTAMPTZ NOT NULL DEFAULT now(),
+        listo TIMESTAMPTZ
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS comanda_items_pendientes_idx ON comanda_items (id) WHERE listo IS NULL")
+
+    # Los pedidos QR, de la PWA e intake.py entran a la cocina en la misma sentencia que crea sus líneas
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION comanda_desde_pedido() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO comanda_items (pedido_id, origen, producto_id, producto, cantidad, extras, observaciones)
+        SELECT n.pedido_id, 'Mesa ' || p.mesa, n.producto_id, COALESCE(n.producto, ''), n.cantidad,
+               COALESCE(n.extras, ''), COALESCE(n.observaciones, '')
+        FROM nuevas n JOIN pedidos p ON p.id = n.pedido_id
+        ORDER BY n.id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS pedido_detalle_comanda ON pedido_detalle")
+    cur.execute("""
+    CREATE TRIGGER pedido_detalle_comanda
+    AFTER INSERT ON pedido_detalle REFERENCING NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION comanda_desde_pedido();
+    """)
+
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION notificar_cocina() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('cocina', '');
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS comanda_items_notify ON comanda_items")
+    cur.execute("""
+    CREATE TRIGGER comanda_items_notify
+    AFTER INSERT OR UPDATE OR DELETE ON comanda_items
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cocina();
+    """)
+
+
+# (version, descripción, paso, transaccional). Los pasos con CREATE INDEX CONCURRENTLY
+# no pueden correr dentro de una transacción.
+MIGRACIONES = [
+    (1, "trigger NOTIFY de pedidos", _m001_notificar_pedidos, True),
+    (2, "índices de consultas frecuentes", _m002_indices, False),
+    (3, "claves foráneas de detalle y ventas", _m003_claves_foraneas, True),
+    (4, "índice de ventas por estado y fecha", _m004_indice_fecha, False),
+    (5, "resumen diario de ventas y productos", _m005_resumen_diario, True),
+    (6, "un solo turno abierto", _m006_turno_unico, False),
+    (7, "clave de idempotencia en pedidos", _m007_idempotencia_pedidos, False),
+    (8, "versión de cambios en ventas", _m008_version_ventas, False),
+    (9, "resumen por producto de turnos cerrados", _m009_turno_resumen, True),
+    (10, "índice de paginación de ventas eliminadas", _m010_eliminadas_keyset, False),
+    (11, "producto_id en el detalle de ventas y pedidos", _m011_producto_id, False),
+    (12, "carga de los resúmenes por producto_id", _m012_resumenes_por_producto_id, False),
+    (13, "cola de comandas de cocina", _m013_comanda_cocina, True),
+]
+
+
+def migrar():
+    """Aplica en orden las migraciones que falten en schema_version"""
+    with conexion_directa(autocommit=True) as con:
+        cur = con.cursor()
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT,
+            aplicada TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        # pg_try_advisory_lock en un bucle y no pg_advisory_lock: el que espera bloqueado en la
+        # sentencia tiene un snapshot abierto, y el CREATE INDEX CONCURRENTLY del que migra espera
+        # a ese snapshot; Postgres lo detecta como deadlock y uno de los dos arranques se cae
+        while True:
+            cur.execute("SELECT pg_try_advisory_lock(%s) AS tomado", (MIGRACIONES_LOCK,))
+            if cur.fetchone()["tomado"]:
+                break
+            time.sleep(MIGRACIONES_ESPERA)
+        try:
+            cur.execute("SELECT version FROM schema_version")
+            aplicadas = {f["version"] for f in cur.fetchall()}
+
+            for version, descripcion, paso, transaccional in MIGRACIONES:
+                if version in aplicadas:
+                    continue
+                print(f"🛠️ Migración {version}: {descripcion}")
+                con.autocommit = not transaccional
+                if transaccional:
+                    # Si otra transacción tiene la tabla tomada, fallar rápido en lugar de encolar las ventas detrás
+                    cur.execute("SET LOCAL lock_timeout = '5s'")
+                paso(cur)
+                cur.execute("INSERT INTO schema_version (version, descripcion) VALUES (%s, %s)",
+                            (version, descripcion))
+                if transaccional:
+                    con.commit()
+                    con.autocommit = True
+        finally:
+            if not con.autocommit:
+                con.rollback()
+                con.autocommit = True
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRACIONES_LOCK,))
+
+
+@app.cli.command("reconstruir-resumen")
+@click.option("--desde", type=click.DateTime(formats=["%Y-%m-%d"]), help="Primer día (YYYY-MM-DD); sin fechas se recalcula todo")
+@click.option("--hasta", type=click.DateTime(formats=["%Y-%m-%d"]), help="Último día (YYYY-MM-DD)")
+def reconstruir_resumen_comando(desde, hasta):
+    """Recalcula ventas_diarias y productos_diarios desde las ventas para corregir desvíos"""
+    if desde is not None:
+        desde = desde.date()
+        hasta = hasta.date() if hasta is not None else date.today()
+    with conexion_directa() as con:
+        reconstruir_resumen_diario(con.cursor(), desde, hasta)
+    print("✅ Resumen diario reconstruido")
+
+
+@app.cli.command("importar-catalogo")
+@click.argument("archivo", type=click.Path(exists=True, dir_okay=False))
+@click.option("--sin-bajas", is_flag=True, help="No borrar los productos que no están en el archivo")
+@click.option("--simular", is_flag=True, help="Mostrar los cambios sin aplicarlos")
+def importar_catalogo_comando(archivo, sin_bajas, simular):
+    """Sincroniza productos con un menú CSV o JSON conservando los ids"""
+    try:
+        importar_catalogo(leer_menu(archivo), bajas=not sin_bajas, simular=simular)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@app.cli.command("init-db")
+def init_db_comando():
+    """Crea las tablas y aplica las migraciones pendientes"""
+    init_db()
+
 # ========= AUTO INIT =========
 if __name__ == "__main__":
     init_db()
 
+# ========= LISTEN / NOTIFY =========
+class EscuchaNotify:
+    """Hilo por proceso con LISTEN en Postgres que reparte cada NOTIFY a sus suscriptores"""
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self._suscriptores = {}
+        self._hilo = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._conectado = threading.Event()
+
+    def suscribir(self, canal, callback):
+        self._suscriptores.setdefault(canal, []).append(callback)
+
+    def iniciar(self):
+        if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+                return
+            self._pid = os.getpid()
+            self._conectado = threading.Event()
+            self._hilo = threading.Thread(target=self._loop, name="escucha-notify", daemon=True)
+            self._hilo.start()
+
+    def activo(self):
+        return self._pid == os.getpid() and self._conectado.is_set()
+
+    def _despachar(self, canal, payload):
+        for callback in self._suscriptores.get(canal, []):
+            try:
+                callback(payload)
+            except Exception:
+                app.logger.exception("Error procesando NOTIFY en %s", canal)
+
+    def _loop(self):
+        while True:
+            con = None
+            try:
+                con = psycopg2.connect(self.dsn)
+                con.autocommit = True
+                cur = con.cursor()
+                for canal in self._suscriptores:
+                    cur.execute(f'LISTEN "{canal}"')
+                self._conectado.set()
+                # Mientras no escuchábamos se pudo perder algún NOTIFY: payload None = resincronizar
+                for canal in self._suscriptores:
+                    self._despachar(canal, None)
+
+                while True:
+                    if select.select([con], [], [], 60) == ([], [], []):
+                        continue
+                    con.poll()
+                    while con.notifies:
+                        notify = con.notifies.pop(0)
+                        self._despachar(notify.channel, notify.payload)
+            except Exception:
+                app.logger.exception("LISTEN/NOTIFY desconectado, reintentando en 5s")
+            finally:
+                self._conectado.clear()
+                if con is not None and not con.closed:
+                    con.close()
+            time.sleep(5)
+
+
+escucha = EscuchaNotify(DATABASE_URL)
+
+# ========= CATALOGO =========
+# Sin LISTEN activo, cada cuántos segundos se vuelve a comparar la versión del catálogo
+CATALOGO_TTL = float(os.environ.get("CATALOGO_TTL", 30))
+
+
+def armar_catalogo(version, filas):
+    """Catálogo listo para las vistas: lista, índice por id y agrupado por categoría"""
+    productos = [dict(p) for p in filas]
+    categorias = {}
+    menu = {}
+    for p in productos:
+        categorias.setdefault(p["categoria"], []).append(p)
+        if p["precio"] > 0:
+            menu.setdefault(p["categoria"], []).append(p)
+
+    return {
+        "version": version,
+        "productos": productos,
+        "por_id": {p["id"]: p for p in productos},
+        "categorias": categorias,
+        "menu": menu,
+        "menu_productos": [p for p in productos if p["precio"] > 0],
+    }
+
+
+class CatalogoCache:
+    """Catálogo de productos en memoria, versionado en catalogo_version e invalidado por NOTIFY"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos = None
+        self._generacion = 0
+        self._verificado = 0.0
+
+    def invalidar(self, payload=None):
+        self._generacion += 1
+        self._datos = None
+
+    def obtener(self):
+        escucha.iniciar()
+        datos = self._datos
+        if datos is not None and (escucha.activo() or time.monotonic() - self._verificado < CATALOGO_TTL):
+            return datos
+
+        with self._lock:
+            generacion = self._generacion
+            with get_db() as con:
+                cur = con.cursor()
+                cur.execute("SELECT version FROM catalogo_version WHERE id=1")
+                version = cur.fetchone()["version"]
+                datos = self._datos
+                if datos is None or datos["version"] != version:
+                    cur.execute("SELECT * FROM productos ORDER BY categoria, nombre")
+                    datos = armar_catalogo(version, cur.fetchall())
+
+            # Si llegó un NOTIFY mientras leíamos, no guardamos un catálogo que puede estar viejo
+            if generacion == self._generacion:
+                self._datos = datos
+                self._verificado = time.monotonic()
+            return datos
+
+
+catalogo = CatalogoCache()
+escucha.suscribir("catalogo", catalogo.invalidar)
+
+
+def catalogo_modificado(cur):
+    """Sube la versión del catálogo; el NOTIFY llega a todos los workers al hacer commit. El que
+    llama invalida el cache de su worker recién después del commit: si lo hiciera antes, otro
+    request de este worker podría volver a cargar la versión vieja y guardarla hasta el próximo NOTIFY"""
+    cur.execute("""
+        WITH v AS (UPDATE catalogo_version SET version = version + 1 WHERE id=1 RETURNING version)
+        SELECT version, pg_notify('catalogo', version::text) FROM v
+    """)
+    return cur.fetchone()["version"]
+
+
+def validar_menu(filas):
+    """Filas de un menú (dicts con nombre, precio, categoria, tipo y opcionalmente id) como tuplas
+    (id, nombre, precio, categoria, tipo). ValueError con la fila si algo no cierra"""
+    if not isinstance(filas, list) or not filas:
+        raise ValueError("El menú debe ser una lista de productos no vacía")
+
+    productos = []
+    nombres = set()
+    ids = set()
+    for n, fila in enumerate(filas, 1):
+        if not isinstance(fila, dict):
+            raise ValueError(f"Fila {n}: se esperaba un producto")
+        nombre = str(fila.get("nombre") or "").strip()
+        categoria = str(fila.get("categoria") or "").strip()
+        tipo = str(fila.get("tipo") or "").strip() or "normal"
+        try:
+            precio = int(fila.get("precio"))
+            id = int(fila["id"]) if str(fila.get("id") or "").strip() else None
+        except (TypeError, ValueError):
+            raise ValueError(f"Fila {n}: precio o id inválido")
+        if not nombre or not categoria:
+            raise ValueError(f"Fila {n}: faltan el nombre o la categoría")
+        if precio < 0:
+            raise ValueError(f"Fila {n}: precio negativo para {nombre}")
+        if nombre in nombres:
+            raise ValueError(f"Fila {n}: {nombre} está repetido")
+        if id is not None and id in ids:
+            raise ValueError(f"Fila {n}: el id {id} está repetido")
+        nombres.add(nombre)
+        if id is not None:
+            ids.add(id)
+        productos.append((id, nombre, precio, categoria, tipo))
+    return productos
+
+
+def leer_menu(ruta):
+    """Menú desde un CSV con encabezado (nombre,precio,categoria,tipo[,id]) o un JSON con una lista de
+    productos (o {"productos": [...]}) con las mismas claves"""
+    with open(ruta, encoding="utf-8-sig", newline="") as f:
+        if ruta.lower().endswith(".json"):
+            try:
+                filas = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"JSON inválido: {e}")
+            if isinstance(filas, dict):
+                filas = filas.get("productos")
+        else:
+            filas = list(csv.DictReader(f))
+    return validar_menu(filas)
+
+
+def id_recuperado(cur, nombre):
+    """Id de un producto borrado con ese nombre (según producto_dim), o None. Un producto que se
+    vuelve a cargar con el mismo nombre recupera su id y con él su historial de ventas"""
+    cur.execute("""
+        SELECT d.id FROM producto_dim d
+        WHERE d.nombre = %s AND NOT EXISTS (SELECT 1 FROM productos p WHERE p.id = d.id)
+        ORDER BY d.id DESC LIMIT 1
+    """, (nombre,))
+    fila = cur.fetchone()
+    return fila["id"] if fila else None
+
+
+def sincronizar_catalogo(cur, productos, bajas=True):
+    """Lleva la tabla productos al menú dado sin cambiar ids: COPY a una tabla temporal y tres sentencias
+    por conjunto (bajas, cambios, altas). Cada producto del menú se reconoce por id si lo trae, si no por
+    nombre, también entre los borrados (producto_dim). Sube la versión del catálogo si algo cambió. Devuelve {altas, cambios, bajas, version}"""
+    cur.execute("LOCK TABLE productos IN SHARE ROW EXCLUSIVE MODE")
+    cur.execute("""
+        CREATE TEMP TABLE menu_import (
+            id INTEGER,
+            nombre TEXT NOT NULL,
+            precio INTEGER NOT NULL,
+            categoria TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            recuperado BOOLEAN NOT NULL DEFAULT FALSE
+        ) ON COMMIT DROP
+    """)
+    buffer = StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(productos)
+    buffer.seek(0)
+    cur.copy_expert("COPY menu_import (id, nombre, precio, categoria, tipo) FROM STDIN (FORMAT csv)", buffer)
+
+    cur.execute("""
+        SELECT s.id FROM menu_import s
+        WHERE s.id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM productos p WHERE p.id = s.id)
+    """)
+    inexistentes = [f["id"] for f in cur.fetchall()]
+    if inexistentes:
+        raise ValueError(f"Ids que no están en productos: {', '.join(map(str, inexistentes))}")
+
+    # Sin id: se toma el del producto con el mismo nombre, salvo que otra fila del menú ya lo use
+    cur.execute("""
+        UPDATE menu_import s SET id = p.id
+        FROM (SELECT DISTINCT ON (nombre) id, nombre FROM productos ORDER BY nombre, id) p
+        WHERE s.id IS NULL AND p.nombre = s.nombre
+          AND NOT EXISTS (SELECT 1 FROM menu_import o WHERE o.id = p.id)
+    """)
+    # Sigue sin id y hubo un producto borrado con ese nombre: vuelve con su id y su historial.
+    # (recuperado: se da de alta con ese id en lugar de uno nuevo de la secuencia)
+    cur.execute("""
+        UPDATE menu_import s SET id = d.id, recuperado = TRUE
+        FROM (SELECT DISTINCT ON (nombre) id, nombre FROM producto_dim d
+              WHERE NOT EXISTS (SELECT 1 FROM productos p WHERE p.id = d.id)
+              ORDER BY nombre, id DESC) d
+        WHERE s.id IS NULL AND d.nombre = s.nombre
+          AND NOT EXISTS (SELECT 1 FROM menu_import o WHERE o.id = d.id)
+    """)
+
+    resultado = {"altas": [], "cambios": [], "bajas": [], "version": None}
+    if bajas:
+        cur.execute("""
+            DELETE FROM productos p
+            WHERE NOT EXISTS (SELECT 1 FROM menu_import s WHERE s.id = p.id)
+            RETURNING p.id, p.nombre
+        """)
+        resultado["bajas"] = cur.fetchall()
+    cur.execute("""
+        UPDATE productos p
+        SET nombre = s.nombre, precio = s.precio, categoria = s.categoria, tipo = s.tipo
+        FROM menu_import s JOIN productos a ON a.id = s.id
+        WHERE p.id = s.id
+          AND (a.nombre, a.precio, a.categoria, a.tipo) IS DISTINCT FROM (s.nombre, s.precio, s.categoria, s.tipo)
+        RETURNING p.id, p.nombre, p.precio, p.categoria, p.tipo,
+                  a.nombre AS nombre_anterior, a.precio AS precio_anterior,
+                  a.categoria AS categoria_anterior, a.tipo AS tipo_anterior
+    """)
+    resultado["cambios"] = cur.fetchall()
+    cur.execute("""
+        INSERT INTO productos (id, nombre, precio, categoria, tipo)
+        SELECT COALESCE(id, nextval(pg_get_serial_sequence('productos', 'id'))), nombre, precio, categoria, tipo
+        FROM menu_import WHERE id IS NULL OR recuperado
+        ORDER BY categoria, nombre
+        RETURNING id, nombre
+    """)
+    resultado["altas"] = cur.fetchall()
+
+    if resultado["altas"] or resultado["cambios"] or resultado["bajas"]:
+        resultado["version"] = catalogo_modificado(cur)
+    return resultado
+
+
+def importar_catalogo(productos, bajas=True, simular=False):
+    """Sincroniza el catálogo en una transacción e imprime el informe; con simular se descarta al final"""
+    inicio = time.perf_counter()
+    with conexion_directa() as con:
+        resultado = sincronizar_catalogo(con.cursor(), productos, bajas)
+        if simular:
+            con.rollback()
+    if resultado["version"] is not None and not simular:
+        catalogo.invalidar()
+
+    for p in resultado["altas"]:
+        print(f"  + #{p['id']} {p['nombre']}")
+    for p in resultado["cambios"]:
+        diferencias = [f"{campo}: {p[campo + '_anterior']} → {p[campo]}"
+                       for campo in ("nombre", "precio", "categoria", "tipo") if p[campo] != p[campo + "_anterior"]]
+        print(f"  ~ #{p['id']} {p['nombre']} ({', '.join(diferencias)})")
+    for p in resultado["bajas"]:
+        print(f"  - #{p['id']} {p['nombre']}")
+
+    resumen = (f"{len(resultado['altas'])} altas, {len(resultado['cambios'])} cambios, "
+               f"{len(resultado['bajas'])} bajas en {time.perf_counter() - inicio:.2f}s")
+    if simular:
+        print(f"🔎 Simulación: {resumen} (no se aplicó nada)")
+    elif resultado["version"] is None:
+        print(f"✅ El catálogo ya estaba al día ({len(productos)} productos)")
+    else:
+        print(f"✅ Catálogo v{resultado['version']}: {resumen}")
+    return resultado
+
+
+
+# ========== FRAGMENTOS ==========
+# Tope de memoria del cache de fragmentos por worker; al pasarlo se descartan los menos usados
+FRAGMENTOS_MAX_BYTES = int(os.environ.get("FRAGMENTOS_MAX_BYTES", 4 * 1024 * 1024))
+
+
+class CacheFragmentos:
+    """LRU de fragmentos HTML ya renderizados, acotado en bytes. La clave lleva la versión del
+    catálogo, así que un cambio de catálogo no necesita invalidar: las versiones viejas envejecen solas"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._fragmentos = OrderedDict()
+        self._bytes = 0
+        self._aciertos = 0
+        self._fallos = 0
+        self._descartes = 0
+
+    def obtener(self, clave, renderizar):
+        with self._lock:
+            html = self._fragmentos.get(clave)
+            if html is not None:
+                self._fragmentos.move_to_end(clave)
+                self._aciertos += 1
+                return html
+            self._fallos += 1
+
+        html = Markup(renderizar())
+        tamanio = sys.getsizeof(html)
+        with self._lock:
+            if clave not in self._fragmentos and tamanio <= self.max_bytes:
+                self._fragmentos[clave] = html
+                self._bytes += tamanio
+                while self._bytes > self.max_bytes:
+                    _, viejo = self._fragmentos.popitem(last=False)
+                    self._bytes -= sys.getsizeof(viejo)
+                    self._descartes += 1
+        return html
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+                "descartes": self._descartes,
+                "fragmentos": len(self._fragmentos),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+fragmentos = CacheFragmentos(FRAGMENTOS_MAX_BYTES)
+
+
+def grilla_productos(plantilla, cat, categorias):
+    """Grilla de productos de ventas.html / mesa.html: se renderiza una vez por versión del catálogo
+    y en cada request sólo se pega el HTML"""
+    return fragmentos.obtener((plantilla, cat["version"]),
+                              lambda: render_template(plantilla, categorias=cat[categorias]))
 
 
 # ========== DECORADORES DE SEGURIDAD ==========
@@ -201,22 +1367,345 @@ def caja_or_admin_required(f):
     return decorated
 
 # ========== TURNO ==========
+# Sin LISTEN activo, cada cuántos segundos se vuelve a confirmar en la base el turno abierto
+TURNO_TTL = float(os.environ.get("TURNO_TTL", 10))
+_turno_cache = {"turno": None, "verificado": 0.0, "generacion": 0}
+
+
+def invalidar_turno(payload=None):
+    _turno_cache["generacion"] += 1
+    _turno_cache["turno"] = None
+
+
+escucha.suscribir("turnos", invalidar_turno)
+
+
+def turno_cerrado(cur, turno_id):
+    """Avisa a todos los workers (al hacer commit) que el turno en cache ya no está abierto"""
+    cur.execute("SELECT pg_notify('turnos', %s)", (str(turno_id),))
+    invalidar_turno()
+
+
 def turno_activo():
+    escucha.iniciar()
+    turno = _turno_cache["turno"]
+    if turno is not None and (escucha.activo() or time.monotonic() - _turno_cache["verificado"] < TURNO_TTL):
+        return turno
+    
+    generacion = _turno_cache["generacion"]
     with get_db() as con:
         cur = con.cursor()
         cur.execute("SELECT * FROM turnos WHERE estado='ABIERTO'")
         turno = cur.fetchone()
         
-        if not turno:
-            cur.execute(
-                "INSERT INTO turnos (fecha, estado, usuario_apertura) VALUES (%s, 'ABIERTO', %s)",
-                (date.today().isoformat(), session.get('username', 'Sistema'))
-            )
-            con.commit()
-            cur.execute("SELECT * FROM turnos WHERE estado='ABIERTO'")
+    if not turno:
+        # Se abre en una conexión propia: un commit acá confirmaría lo que el request ya escribió
+        # en la suya. El índice único parcial garantiza un solo turno ABIERTO: si otro proceso
+        # lo abrió al mismo tiempo, el conflicto devuelve ese turno en vez de crear otro
+        with conexion_directa() as con:
+            cur = con.cursor()
+            cur.execute("""
+                INSERT INTO turnos (fecha, estado, usuario_apertura) VALUES (%s, 'ABIERTO', %s)
+                ON CONFLICT (estado) WHERE estado = 'ABIERTO'
+                DO UPDATE SET estado = turnos.estado
+                RETURNING *
+            """, (date.today().isoformat(), session.get('username', 'Sistema')))
             turno = cur.fetchone()
-        
-        return turno
+    
+    turno = dict(turno)
+    if generacion == _turno_cache["generacion"]:
+        _turno_cache["turno"] = turno
+        _turno_cache["verificado"] = time.monotonic()
+    return turno
+
+
+def turno_para_venta(cur):
+    """Id del turno abierto, confirmado y con FOR KEY SHARE dentro de la transacción que va a
+    guardar la venta. cerrar_turno (FOR UPDATE) espera a que esa venta termine; si el cierre
+    ganó, el turno en cache ya no está ABIERTO: se descarta y se toma el nuevo"""
+    for _ in range(3):
+        turno_id = turno_activo()["id"]
+        cur.execute("SELECT id FROM turnos WHERE id=%s AND estado='ABIERTO' FOR KEY SHARE", (turno_id,))
+        if cur.fetchone():
+            return turno_id
+        invalidar_turno()
+    raise RuntimeError("No se pudo tomar un turno abierto")
+
+# ========== PERSISTENCIA DE PEDIDOS ==========
+# producto_id identifica el producto; producto es el nombre al momento de la venta (para el ticket)
+DETALLE_COLUMNAS = "producto_id, producto, cantidad, precio, extras, observaciones"
+PEDIDO_MAX_LINEAS = 100
+PEDIDO_MAX_CANTIDAD = 99
+PEDIDO_MAX_TEXTO = 500
+PEDIDO_MAX_MESA = 20
+
+
+def items_desde_form(productos):
+    """Líneas pedidas en el form (prod_<id>, extras_<id>, obs_<id>) como tuplas en orden de DETALLE_COLUMNAS"""
+    items = []
+    for p in productos:
+        cant = int(request.form.get(f"prod_{p['id']}", 0))
+        if cant > 0:
+            extras = request.form.get(f"extras_{p['id']}", "")
+            observaciones = request.form.get(f"obs_{p['id']}", "")
+            items.append((p["id"], p["nombre"], cant, p["precio"], extras, observaciones))
+    return items
+
+
+def items_desde_carrito(cat, carrito):
+    """Valida un carrito JSON [{producto_id, cantidad, extras, obs}] contra el catálogo (precios del servidor)"""
+    if not isinstance(carrito, list) or not carrito:
+        raise ValueError("El pedido está vacío")
+    if len(carrito) > PEDIDO_MAX_LINEAS:
+        raise ValueError("El pedido tiene demasiadas líneas")
+
+    items = []
+    for linea in carrito:
+        if not isinstance(linea, dict):
+            raise ValueError("Línea de pedido inválida")
+        try:
+            producto = cat["por_id"].get(int(linea.get("producto_id")))
+            cant = int(linea.get("cantidad", 0))
+        except (TypeError, ValueError):
+            raise ValueError("Línea de pedido inválida")
+        if producto is None or producto["precio"] <= 0:
+            raise ValueError(f"Producto {linea.get('producto_id')} inexistente")
+        if not 0 < cant <= PEDIDO_MAX_CANTIDAD:
+            raise ValueError(f"Cantidad inválida para {producto['nombre']}")
+
+        extras = linea.get("extras") or ""
+        if isinstance(extras, list):
+            extras = ", ".join(str(e) for e in extras)
+        observaciones = str(linea.get("obs") or "")[:PEDIDO_MAX_TEXTO]
+        items.append((producto["id"], producto["nombre"], cant, producto["precio"],
+                      str(extras)[:PEDIDO_MAX_TEXTO], observaciones))
+    return items
+
+
+def validar_mesa(mesa):
+    """Mesa de un pedido QR (viene en la URL): sin espacios a los costados, no vacía, corta y
+    sin caracteres de control. ValueError si no sirve"""
+    mesa = str(mesa or "").strip()
+    if not mesa:
+        raise ValueError("Falta la mesa")
+    if len(mesa) > PEDIDO_MAX_MESA or not mesa.isprintable():
+        raise ValueError("Mesa inválida")
+    return mesa
+
+
+def total_items(items):
+    return sum(cant * precio for _, _, cant, precio, _, _ in items)
+
+
+def _detalle_cte(detalle_tabla, fk, items, params):
+    """CTE que inserta todas las líneas en un único INSERT multi-fila tomando el id de 'cab'"""
+    filas = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(items))
+    for item in items:
+        params.extend(item)
+    return f"""
+        det AS (
+            INSERT INTO {detalle_tabla} ({fk}, {DETALLE_COLUMNAS})
+            SELECT cab.id, d.producto_id::integer, d.producto, d.cantidad, d.precio, d.extras, d.observaciones
+            FROM cab, (VALUES {filas}) AS d({DETALLE_COLUMNAS})
+        )"""
+
+
+def guardar_con_detalle(cur, tabla, campos, detalle_tabla, fk, items, conflicto=""):
+    """Inserta la cabecera con su total final y todas sus líneas en un solo round-trip. Devuelve el id,
+    o None si 'conflicto' (un ON CONFLICT ... DO NOTHING) descartó la cabecera"""
+    params = list(campos.values())
+    marcas = ", ".join(["%s"] * len(campos))
+    sql = f"INSERT INTO {tabla} ({', '.join(campos)}) VALUES ({marcas}) {conflicto} RETURNING id"
+    if items:
+        sql = f"WITH cab AS ({sql}),{_detalle_cte(detalle_tabla, fk, items, params)} SELECT id FROM cab"
+    cur.execute(sql, params)
+    fila = cur.fetchone()
+    return fila["id"] if fila else None
+
+
+def reemplazar_detalle_venta(cur, venta_id, items):
+    """Reemplaza las líneas de una venta y actualiza su total en un solo round-trip"""
+    params = [venta_id, total_items(items), venta_id]
+    sql = """
+        WITH borrado AS (DELETE FROM detalle_venta WHERE venta_id=%s),
+        cab AS (UPDATE ventas SET total=%s WHERE id=%s RETURNING id)"""
+    if items:
+        sql += "," + _detalle_cte("detalle_venta", "venta_id", items, params)
+    cur.execute(sql + " SELECT id FROM cab", params)
+
+
+def confirmar_pedido_en_venta(cur, pedido_id, turno_id, usuario):
+    """Pasa el pedido de PENDIENTE a CONFIRMADO y crea su venta copiando pedido_detalle del lado del
+    servidor, todo en una sentencia. Si otro ya lo confirmó o canceló, el UPDATE no toma la fila
+    (esperando su commit si hace falta) y no se crea nada: devuelve (None, None)"""
+    cur.execute(f"""
+        WITH ped AS (
+            UPDATE pedidos SET estado='CONFIRMADO' WHERE id=%s AND estado='PENDIENTE'
+            RETURNING id, mesa, total
+        ),
+        cab AS (
+            INSERT INTO ventas (turno_id, medio_pago, total, estado, usuario, fecha_hora,
+                               tipo_pedido, estado_delivery, pago_recibido, vuelto, reposicion)
+            SELECT %s, 'Mesa', total, 'OK', %s, %s, 'mesa', 'no_aplica', 0, 0, FALSE
+            FROM ped
+            RETURNING id
+        ),
+        det AS (
+            INSERT INTO detalle_venta (venta_id, {DETALLE_COLUMNAS})
+            SELECT cab.id, {DETALLE_COLUMNAS}
+            FROM cab, pedido_detalle
+            WHERE pedido_detalle.pedido_id=%s
+        ),
+        -- Las comandas del pedido pasan a ser de la venta: editarla o eliminarla actualiza la cocina
+        com AS (
+            UPDATE comanda_items SET venta_id = cab.id
+            FROM cab
+            WHERE comanda_items.pedido_id=%s
+        )
+        SELECT cab.id, ped.mesa FROM cab, ped
+    """, (pedido_id, turno_id, usuario, datetime.now(), pedido_id, pedido_id))
+    fila = cur.fetchone()
+    return (fila["id"], fila["mesa"]) if fila else (None, None)
+
+
+def responder_transicion(aplicada, destino, mensaje, categoria, sin_cambio):
+    """Respuesta de un cambio de estado hecho con UPDATE ... WHERE estado=<esperado>. Con
+    Accept: application/json (fetch) va un JSON chico en lugar del redirect y la página completa;
+    si otro ya hizo el cambio, 409 y nada más"""
+    if request.accept_mimetypes.best == "application/json":
+        if aplicada:
+            return jsonify({"ok": True, "mensaje": mensaje})
+        return jsonify({"ok": False, "mensaje": sin_cambio}), 409
+    if aplicada:
+        flash(mensaje, categoria)
+    else:
+        flash(sin_cambio, "warning")
+    return redirect(destino)
+
+# ========== RESUMEN DIARIO ==========
+def acumular_venta(cur, venta_id, signo=1):
+    """Suma (signo=1) o resta (signo=-1) una venta y sus líneas en ventas_diarias/productos_diarios.
+    Las filas se bloquean siempre en el mismo orden (primero la del día, después los productos por
+    producto_id) para que dos ventas simultáneas con productos en común no se traben entre sí"""
+    cur.execute("""
+        WITH v AS (
+            SELECT id, fecha_hora::date AS fecha, COALESCE(tipo_pedido, '') AS tipo_pedido,
+                   COALESCE(medio_pago, '') AS medio_pago, COALESCE(total, 0) AS total
+            FROM ventas WHERE id=%(id)s
+        ),
+        vd AS (
+            INSERT INTO ventas_diarias (fecha, tipo_pedido, medio_pago, ventas, total)
+            SELECT fecha, tipo_pedido, medio_pago, %(signo)s, %(signo)s * total FROM v
+            ON CONFLICT (fecha, tipo_pedido, medio_pago) DO UPDATE
+            SET ventas = ventas_diarias.ventas + EXCLUDED.ventas,
+                total = ventas_diarias.total + EXCLUDED.total
+            RETURNING 1
+        )
+        -- Leer vd obliga a que la fila del día se tome antes que cualquier producto
+        INSERT INTO productos_diarios (fecha, producto_id, cantidad, total)
+        SELECT v.fecha, COALESCE(dv.producto_id, 0), %(signo)s * SUM(dv.cantidad), %(signo)s * SUM(dv.cantidad * dv.precio)
+        FROM vd, v JOIN detalle_venta dv ON dv.venta_id = v.id
+        GROUP BY 1, 2
+        ORDER BY 2
+        ON CONFLICT (fecha, producto_id) DO UPDATE
+        SET cantidad = productos_diarios.cantidad + EXCLUDED.cantidad,
+            total = productos_diarios.total + EXCLUDED.total
+    """, {"id": venta_id, "signo": signo})
+
+
+def reconstruir_resumen_diario(cur, desde=None, hasta=None):
+    """Recalcula el resumen diario desde ventas/detalle_venta: todo, o sólo los días entre desde y hasta"""
+    params = {}
+    cond_resumen = cond_ventas = "TRUE"
+    if desde is not None:
+        params["desde"], params["hasta"] = rango_fechas(desde, hasta)
+        cond_resumen = "fecha >= %(desde)s AND fecha < %(hasta)s"
+        cond_ventas = "v.fecha_hora >= %(desde)s AND v.fecha_hora < %(hasta)s"
+
+    cur.execute(f"DELETE FROM ventas_diarias WHERE {cond_resumen}", params)
+    cur.execute(f"DELETE FROM productos_diarios WHERE {cond_resumen}", params)
+    # ON CONFLICT: una venta confirmada mientras tanto pudo volver a crear la fila del día.
+    # ORDER BY: mismo orden de bloqueo que acumular_venta()
+    cur.execute(f"""
+        INSERT INTO ventas_diarias (fecha, tipo_pedido, medio_pago, ventas, total)
+        SELECT v.fecha_hora::date, COALESCE(v.tipo_pedido, ''), COALESCE(v.medio_pago, ''),
+               COUNT(*), COALESCE(SUM(v.total), 0)
+        FROM ventas v
+        WHERE v.estado='OK' AND v.fecha_hora IS NOT NULL AND {cond_ventas}
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (fecha, tipo_pedido, medio_pago) DO UPDATE
+        SET ventas = EXCLUDED.ventas, total = EXCLUDED.total
+    """, params)
+    cur.execute(f"""
+        INSERT INTO productos_diarios (fecha, producto_id, cantidad, total)
+        SELECT v.fecha_hora::date, COALESCE(dv.producto_id, 0), SUM(dv.cantidad), SUM(dv.cantidad * dv.precio)
+        FROM ventas v JOIN detalle_venta dv ON dv.venta_id = v.id
+        WHERE v.estado='OK' AND v.fecha_hora IS NOT NULL AND {cond_ventas}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (fecha, producto_id) DO UPDATE
+        SET cantidad = EXCLUDED.cantidad, total = EXCLUDED.total
+    """, params)
+
+
+def reconstruir_resumen_turno(cur, turno_id):
+    """Recalcula los días que abarcan las ventas del turno (al cerrarlo se corrige cualquier desvío)"""
+    cur.execute("""
+        SELECT MIN(fecha_hora)::date AS desde, MAX(fecha_hora)::date AS hasta
+        FROM ventas WHERE turno_id=%s
+    """, (turno_id,))
+    dias = cur.fetchone()
+    if dias["desde"] is not None:
+        reconstruir_resumen_diario(cur, dias["desde"], dias["hasta"])
+
+
+def guardar_resumen_turno(cur, turno_id):
+    """Total y snapshot por producto del turno en una sola sentencia (un join ventas-detalle por
+    turno_id/venta_id indexados, agrupado por producto_id). Devuelve el total"""
+    cur.execute("""
+        WITH lineas AS (
+            SELECT COALESCE(dv.producto_id, 0) AS producto_id, SUM(dv.cantidad) AS cantidad,
+                   SUM(dv.cantidad * dv.precio) AS total, MAX(dv.producto) AS producto
+            FROM ventas v
+            JOIN detalle_venta dv ON dv.venta_id = v.id
+            WHERE v.turno_id = %(turno)s AND v.estado = 'OK'
+            GROUP BY 1
+        ), guardado AS (
+            INSERT INTO turno_resumen (turno_id, producto_id, producto, cantidad, total)
+            SELECT %(turno)s, l.producto_id, COALESCE(d.nombre, l.producto, ''), l.cantidad, l.total
+            FROM lineas l LEFT JOIN producto_dim d ON d.id = l.producto_id
+            ON CONFLICT (turno_id, producto_id) DO UPDATE
+            SET producto = EXCLUDED.producto, cantidad = EXCLUDED.cantidad, total = EXCLUDED.total
+        ), sobrantes AS (
+            DELETE FROM turno_resumen
+            WHERE turno_id = %(turno)s AND producto_id NOT IN (SELECT producto_id FROM lineas)
+        )
+        UPDATE turnos
+        SET total = (SELECT COALESCE(SUM(total), 0) FROM ventas WHERE turno_id = %(turno)s AND estado = 'OK')
+        WHERE id = %(turno)s
+        RETURNING total
+    """, {"turno": turno_id})
+    return cur.fetchone()["total"]
+
+
+def actualizar_resumen_turno(cur, turno_id):
+    """Si se tocó una venta de un turno ya cerrado, rehace su snapshot para que el cierre siga cuadrando"""
+    cur.execute("SELECT estado FROM turnos WHERE id=%s", (turno_id,))
+    turno = cur.fetchone()
+    if turno and turno["estado"] == "CERRADO":
+        guardar_resumen_turno(cur, turno_id)
+
+
+def detalle_por_padre(cur, tabla, fk, ids, columnas="*"):
+    """Detalle de varios pedidos/ventas en una sola consulta, agrupado por id del padre"""
+    agrupado = {i: [] for i in ids}
+    if ids:
+        cur.execute(f"SELECT {fk} AS _padre, {columnas} FROM {tabla} WHERE {fk} = ANY(%s) ORDER BY id",
+                    (list(agrupado),))
+        for fila in cur.fetchall():
+            agrupado[fila.pop("_padre")].append(fila)
+    return agrupado
 
 # ========== LOGIN ==========
 @app.route("/login", methods=["GET", "POST"])
@@ -262,18 +1751,16 @@ def dashboard():
             turno_dict['dia_semana'] = obtener_dia_semana(turno['fecha'])
             turno = turno_dict
         
-        cur.execute(
-            "SELECT COUNT(*) as total FROM ventas WHERE DATE(fecha_hora) = CURRENT_DATE AND estado='OK'"
-        )
-        ventas_hoy = cur.fetchone()['total']
-        
-        cur.execute(
-            "SELECT COALESCE(SUM(total),0) as total FROM ventas WHERE DATE(fecha_hora) = CURRENT_DATE AND estado='OK'"
-        )
-        total_hoy = cur.fetchone()['total']
+        cur.execute("""
+            SELECT COALESCE(SUM(ventas),0) as ventas, COALESCE(SUM(total),0) as total
+            FROM ventas_diarias
+            WHERE fecha = CURRENT_DATE
+        """)
+        hoy = cur.fetchone()
+        ventas_hoy = hoy['ventas']
+        total_hoy = hoy['total']
         
-        cur.execute("SELECT COUNT(*) as total FROM productos")
-        productos_activos = cur.fetchone()['total']
+        productos_activos = len(catalogo.obtener()["productos"])
     
     stats = {
         'turno': turno,
@@ -290,8 +1777,8 @@ def dashboard():
 def ventas():
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("SELECT * FROM productos ORDER BY categoria, nombre")
-        productos = cur.fetchall()
+        cat = catalogo.obtener()
+        productos = cat["productos"]
         turno = turno_activo()
         
         # Agregar día de la semana al turno
@@ -313,34 +1800,27 @@ def ventas():
             else:
                 estado_delivery = 'no_aplica'
             
-            total = 0
-            
-            cur.execute("""
-                INSERT INTO ventas (turno_id, medio_pago, total, estado, usuario, fecha_hora, 
-                                   tipo_pedido, direccion_entrega, estado_pago, estado_delivery,
-                                   pago_recibido, vuelto, reposicion)
-                VALUES (%s, %s, 0, 'OK', %s, %s, %s, %s, %s, %s, 0, 0, FALSE)
-                RETURNING id
-            """, (turno["id"], medio, session['username'], datetime.now(), 
-                  tipo_pedido, direccion, estado_pago, estado_delivery))
-            venta_id = cur.fetchone()['id']
-            
-            for p in productos:
-                cant = int(request.form.get(f"prod_{p['id']}", 0))
-                if cant > 0:
-                    total += cant * p["precio"]
-                    
-                    extras = request.form.get(f"extras_{p['id']}", "")
-                    observaciones = request.form.get(f"obs_{p['id']}", "")
-                    
-                    cur.execute("""
-                        INSERT INTO detalle_venta (venta_id, producto, cantidad, precio, extras, observaciones)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (venta_id, p["nombre"], cant, p["precio"], extras, observaciones))
-            
+            items = items_desde_form(productos)
+            total = total_items(items)
             vuelto = max(0, pago_recibido - total)
             
-            cur.execute("UPDATE ventas SET total=%s, vuelto=%s WHERE id=%s", (total, vuelto, venta_id))
+            venta_id = guardar_con_detalle(cur, "ventas", {
+                "turno_id": turno_para_venta(cur),
+                "medio_pago": medio,
+                "total": total,
+                "estado": "OK",
+                "usuario": session['username'],
+                "fecha_hora": datetime.now(),
+                "tipo_pedido": tipo_pedido,
+                "direccion_entrega": direccion,
+                "estado_pago": estado_pago,
+                "estado_delivery": estado_delivery,
+                "pago_recibido": 0,
+                "vuelto": vuelto,
+                "reposicion": False,
+            }, "detalle_venta", "venta_id", items)
+            acumular_venta(cur, venta_id)
+            comanda_venta(cur, venta_id)
             con.commit()
             
             flash(f'Venta #{venta_id} registrada - ${total} - {tipo_pedido.upper()} - Vuelto: ${vuelto}', 'success')
@@ -350,12 +1830,9 @@ def ventas():
             SELECT * FROM ventas WHERE turno_id=%s AND estado='OK' ORDER BY id DESC
         """, (turno["id"],))
         ventas = cur.fetchall()
-        
-        categorias = {}
-        for p in productos:
-            categorias.setdefault(p["categoria"], []).append(p)
     
-    return render_template("ventas.html", categorias=categorias, ventas=ventas, turno=turno)
+    return render_template("ventas.html", grilla=grilla_productos("fragmentos/productos_ventas.html", cat, "categorias"),
+                           ventas=ventas, turno=turno)
 
 # ========== EDITAR VENTA ==========
 @app.route("/editar/<int:id>", methods=["GET", "POST"])
@@ -363,7 +1840,9 @@ def ventas():
 def editar_venta(id):
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("SELECT * FROM ventas WHERE id=%s", (id,))
+        # Al guardar se bloquea la venta: el resumen diario resta lo viejo y suma lo nuevo
+        bloqueo = " FOR UPDATE" if request.method == "POST" else ""
+        cur.execute("SELECT * FROM ventas WHERE id=%s" + bloqueo, (id,))
         venta = cur.fetchone()
         
         if not venta:
@@ -372,26 +1851,19 @@ def editar_venta(id):
         
         cur.execute("SELECT * FROM detalle_venta WHERE venta_id=%s", (id,))
         detalle = cur.fetchall()
-        cur.execute("SELECT * FROM productos")
-        productos = cur.fetchall()
+        productos = catalogo.obtener()["productos"]
         
         if request.method == "POST":
-            cur.execute("DELETE FROM detalle_venta WHERE venta_id=%s", (id,))
-            
-            total = 0
-            for p in productos:
-                cant = int(request.form.get(f"prod_{p['id']}", 0))
-                if cant > 0:
-                    total += cant * p["precio"]
-                    extras = request.form.get(f"extras_{p['id']}", "")
-                    observaciones = request.form.get(f"obs_{p['id']}", "")
-                    
-                    cur.execute("""
-                        INSERT INTO detalle_venta (venta_id, producto, cantidad, precio, extras, observaciones)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (id, p["nombre"], cant, p["precio"], extras, observaciones))
-            
-            cur.execute("UPDATE ventas SET total=%s WHERE id=%s", (total, id))
+            en_resumen = venta['estado'] == 'OK'
+            if en_resumen:
+                acumular_venta(cur, id, -1)
+            reemplazar_detalle_venta(cur, id, items_desde_form(productos))
+            if en_resumen:
+                acumular_venta(cur, id)
+                actualizar_resumen_turno(cur, venta["turno_id"])
+                # La cola de cocina sigue al detalle nuevo: sale lo pendiente y entra lo que falta preparar
+                quitar_de_cocina(cur, "venta_id", id)
+                comanda_venta(cur, id)
             con.commit()
             flash(f'Venta #{id} actualizada', 'success')
             return redirect("/")
@@ -404,18 +1876,16 @@ def editar_venta(id):
 def eliminar_venta(id):
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("SELECT * FROM ventas WHERE id=%s", (id,))
+        cur.execute("UPDATE ventas SET estado='ELIMINADA' WHERE id=%s AND estado='OK' RETURNING turno_id", (id,))
         venta = cur.fetchone()
-
-        if not venta:
-            flash("La venta no existe", "danger")
-            return redirect("/")
-
-        cur.execute("UPDATE ventas SET estado='ELIMINADA' WHERE id=%s", (id,))
+        if venta:
+            acumular_venta(cur, id, -1)
+            actualizar_resumen_turno(cur, venta["turno_id"])
+            quitar_de_cocina(cur, "venta_id", id)
         con.commit()
 
-    flash(f"Venta #{id} eliminada correctamente", "warning")
-    return redirect("/")
+    return responder_transicion(venta is not None, "/", f"Venta #{id} eliminada correctamente", "warning",
+                                f"La venta #{id} no existe o ya estaba eliminada")
 
 # ========== REPONER VENTA ==========
 @app.route("/ventas/reponer/<int:id>", methods=["GET", "POST"])
@@ -444,12 +1914,17 @@ def reponer_venta(id):
                     fecha_reposicion=%s, 
                     usuario_reposicion=%s,
                     motivo_reposicion=%s
-                WHERE id=%s
+                WHERE id=%s AND estado='ELIMINADA'
+                RETURNING id
             """, (datetime.now(), session['username'], motivo, id))
+            repuesta = cur.fetchone() is not None
+            if repuesta:
+                acumular_venta(cur, id)
+                actualizar_resumen_turno(cur, venta["turno_id"])
             
             con.commit()
-            flash(f"✅ Venta #{id} repuesta correctamente", "success")
-            return redirect("/turnos")
+            return responder_transicion(repuesta, "/turnos", f"✅ Venta #{id} repuesta correctamente", "success",
+                                        f"La venta #{id} ya había sido repuesta")
     
         cur.execute("SELECT * FROM detalle_venta WHERE venta_id=%s", (id,))
         detalle = cur.fetchall()
@@ -459,42 +1934,47 @@ def reponer_venta(id):
 # ========== PEDIDOS QR ==========
 @app.route("/mesa/<mesa>", methods=["GET", "POST"])
 def mesa(mesa):
-    with get_db() as con:
-        cur = con.cursor()
-        cur.execute("SELECT * FROM productos WHERE precio > 0 ORDER BY categoria, nombre")
-        productos = cur.fetchall()
-        
-        categorias = {}
-        for p in productos:
-            categorias.setdefault(p["categoria"], []).append(p)
+    cat = catalogo.obtener()
+    
+    if request.method == "POST":
+        items = items_desde_form(cat["menu_productos"])
+        total = total_items(items)
         
-        if request.method == "POST":
-            total = 0
-            
-            cur.execute(
-                "INSERT INTO pedidos (mesa, fecha_hora, estado, total) VALUES (%s, %s, 'PENDIENTE', 0) RETURNING id",
-                (mesa, datetime.now())
-            )
-            pedido_id = cur.fetchone()['id']
-            
-            for p in productos:
-                cant = int(request.form.get(f"prod_{p['id']}", 0))
-                if cant > 0:
-                    total += cant * p["precio"]
-                    extras = request.form.get(f"extras_{p['id']}", "")
-                    observaciones = request.form.get(f"obs_{p['id']}", "")
-                    
-                    cur.execute("""
-                        INSERT INTO pedido_detalle (pedido_id, producto, cantidad, precio, extras, observaciones)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (pedido_id, p["nombre"], cant, p["precio"], extras, observaciones))
-            
-            cur.execute("UPDATE pedidos SET total=%s WHERE id=%s", (total, pedido_id))
+        with get_db() as con:
+            cur = con.cursor()
+            guardar_con_detalle(cur, "pedidos", {
+                "mesa": mesa,
+                "fecha_hora": datetime.now(),
+                "estado": "PENDIENTE",
+                "total": total,
+            }, "pedido_detalle", "pedido_id", items)
             con.commit()
-            
-            return render_template("pedido_confirmado.html", mesa=mesa, total=total)
+        
+        return render_template("pedido_confirmado.html", mesa=mesa, total=total)
     
-    return render_template("mesa.html", categorias=categorias, mesa=mesa)
+    return render_template("mesa.html", grilla=grilla_productos("fragmentos/productos_mesa.html", cat, "menu"), mesa=mesa)
+
+@app.route("/mesa/<mesa>/pedido", methods=["POST"])
+def mesa_pedido(mesa):
+    """Pedido QR en JSON. En producción lo atiende intake.py (ASGI); esta ruta es el respaldo síncrono"""
+    try:
+        mesa = validar_mesa(mesa)
+        items = items_desde_carrito(catalogo.obtener(), (request.get_json(silent=True) or {}).get("items"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    total = total_items(items)
+    
+    with get_db() as con:
+        cur = con.cursor()
+        pedido_id = guardar_con_detalle(cur, "pedidos", {
+            "mesa": mesa,
+            "fecha_hora": datetime.now(),
+            "estado": "PENDIENTE",
+            "total": total,
+        }, "pedido_detalle", "pedido_id", items)
+        con.commit()
+    
+    return jsonify({"pedido_id": pedido_id, "total": total}), 201
 
 # ========== COMANDA ==========
 @app.route("/comanda/<int:venta_id>")
@@ -521,16 +2001,15 @@ def pedidos():
         cur = con.cursor()
         cur.execute("SELECT * FROM pedidos WHERE estado='PENDIENTE' ORDER BY id ASC")
         pedidos_db = cur.fetchall()
+        detalles = detalle_por_padre(cur, "pedido_detalle", "pedido_id", [p["id"] for p in pedidos_db])
         pedidos_lista = []
         for p in pedidos_db:
-            cur.execute("SELECT * FROM pedido_detalle WHERE pedido_id=%s", (p["id"],))
-            detalle = cur.fetchall()
             pedidos_lista.append({
                 "id": p["id"],
                 "mesa": p["mesa"],
                 "total": p["total"],
                 "fecha_hora": p["fecha_hora"],
-                "detalle": detalle
+                "detalle": detalles[p["id"]]
             })
     
     return render_template("pedidos.html", pedidos=pedidos_lista)
@@ -540,125 +2019,180 @@ def pedidos():
 def confirmar_pedido(id):
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("SELECT * FROM pedidos WHERE id=%s", (id,))
-        pedido = cur.fetchone()
-        if pedido:
-            turno = turno_activo()
-            cur.execute("""
-                INSERT INTO ventas (turno_id, medio_pago, total, estado, usuario, fecha_hora,
-                                   tipo_pedido, estado_delivery, pago_recibido, vuelto, reposicion)
-                VALUES (%s, 'Mesa', %s, 'OK', %s, %s, 'mesa', 'no_aplica', 0, 0, FALSE)
-                RETURNING id
-            """, (turno["id"], pedido["total"], session['username'], datetime.now()))
-            venta_id = cur.fetchone()['id']
-            
-            cur.execute("SELECT * FROM pedido_detalle WHERE pedido_id=%s", (id,))
-            detalle = cur.fetchall()
-            for d in detalle:
-                cur.execute("""
-                    INSERT INTO detalle_venta (venta_id, producto, cantidad, precio, extras, observaciones)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (venta_id, d["producto"], d["cantidad"], d["precio"], d["extras"], d["observaciones"]))
-            
-            cur.execute("UPDATE pedidos SET estado='CONFIRMADO' WHERE id=%s", (id,))
-            con.commit()
-            flash(f'Pedido Mesa {pedido["mesa"]} confirmado como Venta #{venta_id}', 'success')
+        venta_id, mesa = confirmar_pedido_en_venta(cur, id, turno_para_venta(cur), session['username'])
+        if venta_id:
+            acumular_venta(cur, venta_id)
+        con.commit()
     
-    return redirect("/pedidos")
+    return responder_transicion(venta_id is not None, "/pedidos",
+                                f'Pedido Mesa {mesa} confirmado como Venta #{venta_id}', 'success',
+                                f'El pedido #{id} ya no está pendiente (otro lo confirmó o canceló)')
 
 @app.route("/pedidos/cancelar/<int:id>")
 @login_required
 def cancelar_pedido(id):
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("UPDATE pedidos SET estado='CANCELADO' WHERE id=%s", (id,))
+        cur.execute("UPDATE pedidos SET estado='CANCELADO' WHERE id=%s AND estado='PENDIENTE' RETURNING id", (id,))
+        cancelado = cur.fetchone() is not None
+        if cancelado:
+            quitar_de_cocina(cur, "pedido_id", id)
         con.commit()
     
-    flash('Pedido cancelado', 'warning')
-    return redirect("/pedidos")
+    return responder_transicion(cancelado, "/pedidos", 'Pedido cancelado', 'warning',
+                                f'El pedido #{id} ya no está pendiente (otro lo confirmó o canceló)')
 
 # ========== DELIVERY ==========
+DELIVERY_ACTIVOS = ("listo", "enviado")
+# Columnas que usan delivery_tarjetas() y el filtro de activos
+DELIVERY_COLUMNAS = "id, estado, estado_delivery, fecha_hora, direccion_entrega, medio_pago, estado_pago, total"
+
+
+def delivery_cursor(cur):
+    """Cursor para api_delivery(): el xid más viejo todavía en curso. Toda transacción que
+    confirme más adelante tiene xid >= cursor, así que ningún cambio queda afuera
+    (a lo sumo una fila se manda dos veces)"""
+    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS cursor")
+    return cur.fetchone()["cursor"]
+
+
+def _hora(fecha_hora):
+    return fecha_hora.strftime("%H:%M") if fecha_hora else ""
+
+
+def delivery_tarjetas(cur, ventas_delivery):
+    detalles = detalle_por_padre(cur, "detalle_venta", "venta_id", [v["id"] for v in ventas_delivery],
+                                 "cantidad, producto, extras, observaciones")
+    return [{
+        "id": v["id"],
+        "hora": _hora(v["fecha_hora"]),
+        "direccion_entrega": v["direccion_entrega"],
+        "medio_pago": v["medio_pago"],
+        "estado_pago": v["estado_pago"],
+        "estado_delivery": v["estado_delivery"],
+        "total": v["total"],
+        "detalle": detalles[v["id"]]
+    } for v in ventas_delivery]
+
+
+def delivery_resumen(cur):
+    """Entregados de hoy y contadores del día para el tablero"""
+    cur.execute("""
+        SELECT id, fecha_hora, direccion_entrega, total
+        FROM ventas
+        WHERE tipo_pedido = 'delivery'
+          AND estado_delivery = 'finalizado'
+          AND fecha_hora >= CURRENT_DATE AND fecha_hora < CURRENT_DATE + 1
+        ORDER BY id DESC
+        LIMIT 10
+    """)
+    entregados = [{"id": v["id"], "hora": _hora(v["fecha_hora"]),
+                   "direccion_entrega": v["direccion_entrega"], "total": v["total"]}
+                  for v in cur.fetchall()]
+
+    cur.execute("""
+        SELECT
+            COUNT(*) AS total_pedidos,
+            COALESCE(SUM(total), 0) AS total_facturado,
+            COALESCE(SUM(CASE WHEN estado_delivery = 'listo' THEN 1 ELSE 0 END), 0) AS listos_enviar,
+            COALESCE(SUM(CASE WHEN estado_delivery = 'enviado' THEN 1 ELSE 0 END), 0) AS salio,
+            COALESCE(SUM(CASE WHEN estado_delivery = 'finalizado' THEN 1 ELSE 0 END), 0) AS entregados
+        FROM ventas
+        WHERE tipo_pedido = 'delivery'
+          AND estado = 'OK'
+          AND fecha_hora >= CURRENT_DATE AND fecha_hora < CURRENT_DATE + 1
+    """)
+    return entregados, cur.fetchone()
+
+
+def delivery_activos(cur):
+    cur.execute(f"""
+        SELECT {DELIVERY_COLUMNAS}
+        FROM ventas
+        WHERE tipo_pedido = 'delivery'
+          AND estado = 'OK'
+          AND estado_delivery IN %s
+        ORDER BY id ASC
+    """, (DELIVERY_ACTIVOS,))
+    return delivery_tarjetas(cur, cur.fetchall())
+
+
 @app.route("/delivery")
 @login_required
 def delivery():
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("""
-            SELECT *
-            FROM ventas
-            WHERE tipo_pedido = 'delivery'
-              AND estado = 'OK'
-              AND estado_delivery IN ('listo', 'enviado')
-            ORDER BY id ASC
-        """)
-        ventas_delivery = cur.fetchall()
+        # El cursor se toma antes de leer: lo que cambie en el medio vuelve en el primer delta
+        cursor = delivery_cursor(cur)
+        deliveries = delivery_activos(cur)
+        entregados, stats = delivery_resumen(cur)
 
-        deliveries = []
-        for v in ventas_delivery:
-            cur.execute("""
-                SELECT cantidad, producto, extras, observaciones
-                FROM detalle_venta
-                WHERE venta_id = %s
-            """, (v["id"],))
-            detalle = cur.fetchall()
-
-            deliveries.append({
-                "id": v["id"],
-                "fecha_hora": v["fecha_hora"],
-                "direccion_entrega": v["direccion_entrega"],
-                "medio_pago": v["medio_pago"],
-                "estado_pago": v["estado_pago"],
-                "estado_delivery": v["estado_delivery"],
-                "total": v["total"],
-                "detalle": detalle
-            })
+    return render_template("delivery.html", deliveries=deliveries, entregados=entregados,
+                           stats=stats, cursor=cursor)
 
-        cur.execute("""
-            SELECT *
-            FROM ventas
-            WHERE tipo_pedido = 'delivery'
-              AND estado_delivery = 'finalizado'
-              AND DATE(fecha_hora) = CURRENT_DATE
-            ORDER BY id DESC
-            LIMIT 10
-        """)
-        entregados = cur.fetchall()
-
-        cur.execute("""
-            SELECT
-                COUNT(*) AS total_pedidos,
-                COALESCE(SUM(total), 0) AS total_facturado,
-                SUM(CASE WHEN estado_delivery = 'listo' THEN 1 ELSE 0 END) AS listos_enviar,
-                SUM(CASE WHEN estado_delivery = 'enviado' THEN 1 ELSE 0 END) AS salio,
-                SUM(CASE WHEN estado_delivery = 'finalizado' THEN 1 ELSE 0 END) AS entregados
+@app.route("/api/delivery")
+@login_required
+def api_delivery():
+    """Cambios del tablero de delivery desde ?since=<cursor>. Sin cursor válido devuelve
+    el tablero completo. Si nada cambió, la respuesta es sólo el cursor"""
+    desde = request.args.get("since", "")
+    with get_db() as con:
+        cur = con.cursor()
+        cursor = delivery_cursor(cur)
+        if not desde.isdigit():
+            entregados, stats = delivery_resumen(cur)
+            return jsonify({"cursor": cursor, "completo": True, "deliveries": delivery_activos(cur),
+                            "quitar": [], "entregados": entregados, "stats": stats})
+
+        # Sólo deliveries y las columnas de la tarjeta: las ventas de mostrador y mesa también
+        # cambian de version y no tienen nada que hacer en el tablero
+        cur.execute(f"""
+            SELECT {DELIVERY_COLUMNAS}
             FROM ventas
-            WHERE tipo_pedido = 'delivery'
-              AND estado = 'OK'
-              AND DATE(fecha_hora) = CURRENT_DATE
-        """)
-        stats = cur.fetchone()
-
-    return render_template("delivery.html", deliveries=deliveries, entregados=entregados, stats=stats)
+            WHERE version >= %s::xid8
+              AND tipo_pedido = 'delivery'
+            ORDER BY id ASC
+        """, (desde,))
+        cambios = cur.fetchall()
+        if not cambios:
+            return jsonify({"cursor": cursor})
+
+        activos = [v for v in cambios if v["estado"] == "OK" and v["estado_delivery"] in DELIVERY_ACTIVOS]
+        ids_activos = {v["id"] for v in activos}
+        entregados, stats = delivery_resumen(cur)
+        return jsonify({"cursor": cursor, "completo": False, "deliveries": delivery_tarjetas(cur, activos),
+                        "quitar": [v["id"] for v in cambios if v["id"] not in ids_activos],
+                        "entregados": entregados, "stats": stats})
 
 @app.route("/delivery/salio/<int:venta_id>")
 @login_required
 def delivery_salio(venta_id):
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("UPDATE ventas SET estado_delivery='enviado' WHERE id=%s", (venta_id,))
+        cur.execute("""
+            UPDATE ventas SET estado_delivery='enviado'
+            WHERE id=%s AND estado='OK' AND estado_delivery='listo'
+            RETURNING id
+        """, (venta_id,))
+        aplicada = cur.fetchone() is not None
         con.commit()
-    flash(f'Venta #{venta_id} marcada como Salió', 'info')
-    return redirect("/delivery")
+    return responder_transicion(aplicada, "/delivery", f'Venta #{venta_id} marcada como Salió', 'info',
+                                f'La venta #{venta_id} ya no estaba lista para salir')
 
 @app.route("/delivery/finalizado/<int:venta_id>")
 @login_required
 def delivery_finalizado(venta_id):
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("UPDATE ventas SET estado_delivery='finalizado' WHERE id=%s", (venta_id,))
+        cur.execute("""
+            UPDATE ventas SET estado_delivery='finalizado'
+            WHERE id=%s AND estado='OK' AND estado_delivery='enviado'
+            RETURNING id
+        """, (venta_id,))
+        aplicada = cur.fetchone() is not None
         con.commit()
-    flash(f'Venta #{venta_id} marcada como Finalizada', 'success')
-    return redirect("/delivery")
+    return responder_transicion(aplicada, "/delivery", f'Venta #{venta_id} marcada como Finalizada', 'success',
+                                f'La venta #{venta_id} no estaba en camino (¿ya se marcó como entregada?)')
 
 # ========== API ==========
 @app.route("/api/pedidos/nuevos")
@@ -671,64 +2205,473 @@ def api_pedidos_nuevos():
     
     return jsonify({"count": count})
 
-@app.route("/api/pedidos/nuevos/detalle")
-@login_required
-def api_pedidos_nuevos_detalle():
+def pedidos_pendientes_detalle():
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("SELECT id, mesa, total FROM pedidos WHERE estado='PENDIENTE' ORDER BY id ASC")
+        cur.execute("SELECT id, mesa, total, fecha_hora FROM pedidos WHERE estado='PENDIENTE' ORDER BY id ASC")
         pedidos_db = cur.fetchall()
+        detalles = detalle_por_padre(cur, "pedido_detalle", "pedido_id", [p["id"] for p in pedidos_db],
+                                     "producto, cantidad, precio, extras, observaciones")
         pedidos_lista = []
         for p in pedidos_db:
-            cur.execute("SELECT producto, cantidad, precio, extras, observaciones FROM pedido_detalle WHERE pedido_id=%s", (p["id"],))
-            detalle = cur.fetchall()
             pedidos_lista.append({
                 "id": p["id"],
                 "mesa": p["mesa"],
                 "total": p["total"],
+                "hora": _hora(p["fecha_hora"]),
                 "detalle": [{"producto": d["producto"], "cantidad": d["cantidad"], "precio": d["precio"], 
-                            "extras": d["extras"], "observaciones": d["observaciones"]} for d in detalle]
+                            "extras": d["extras"], "observaciones": d["observaciones"]} for d in detalles[p["id"]]]
             })
+    return pedidos_lista
+
+@app.route("/api/pedidos/nuevos/detalle")
+@login_required
+def api_pedidos_nuevos_detalle():
+    return jsonify({"pedidos": pedidos_pendientes_detalle()})
+
+@app.route("/api/pedidos", methods=["POST"])
+def api_crear_pedido():
+    """Pedido de la PWA de mozos: {mesa, items: [{producto_id, cantidad, extras, obs}]}.
+    Con el header Idempotency-Key, un reintento devuelve el pedido ya creado en lugar de duplicarlo;
+    la misma clave con otro pedido (otra mesa o líneas) es 422"""
+    datos = request.get_json(silent=True) or {}
+    mesa = str(datos.get("mesa") or "").strip()
+    clave = (request.headers.get("Idempotency-Key") or "").strip()[:100] or None
+    if not mesa:
+        return jsonify({"error": "Falta la mesa"}), 400
+    try:
+        items = items_desde_carrito(catalogo.obtener(), datos.get("items"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    total = total_items(items)
+    # Sobre lo pedido (mesa, producto, cantidad, extras, obs) y no los precios: un reintento después
+    # de un cambio de precio sigue siendo el mismo pedido
+    huella = sha256(json.dumps([mesa, [(i[0], i[2], i[4], i[5]) for i in items]]).encode()).hexdigest()
     
-    return jsonify({"pedidos": pedidos_lista})
+    with get_db() as con:
+        cur = con.cursor()
+        pedido_id = guardar_con_detalle(cur, "pedidos", {
+            "mesa": mesa,
+            "fecha_hora": datetime.now(),
+            "estado": "PENDIENTE",
+            "total": total,
+            "clave_idempotencia": clave,
+            "huella_idempotencia": huella if clave else None,
+        }, "pedido_detalle", "pedido_id", items,
+            conflicto="ON CONFLICT (clave_idempotencia) WHERE clave_idempotencia IS NOT NULL DO NOTHING")
+        
+        if pedido_id is None:
+            cur.execute("SELECT id, total, huella_idempotencia FROM pedidos WHERE clave_idempotencia=%s", (clave,))
+            previo = cur.fetchone()
+            if previo["huella_idempotencia"] != huella:
+                return jsonify({"error": "La clave de idempotencia ya se usó para otro pedido",
+                                "pedido_id": previo["id"]}), 422
+            return jsonify({"pedido_id": previo["id"], "total": previo["total"], "repetido": True}), 200
+        con.commit()
+    
+    return jsonify({"pedido_id": pedido_id, "total": total}), 201
+
+# ========== PEDIDOS EN VIVO (SSE) ==========
+# Cada conexión SSE ocupa un hilo: correr gunicorn con --worker-class gthread --threads N
+SSE_DURACION = float(os.environ.get("SSE_DURACION", 300))
+SSE_PING = 15
+# Tope de streams abiertos por worker (pedidos + cocina). Sin tope, unas pocas pantallas dejan al
+# worker sin hilos para los requests comunes; por defecto la mitad de GUNICORN_THREADS. El que no
+# entra recibe un stream vacío con "retry:" largo: no es un error HTTP (un 503 hace que el EventSource
+# no reconecte nunca más), la página sigue por polling y el navegador reintenta solo más tarde
+SSE_MAX_CLIENTES = int(os.environ.get("SSE_MAX_CLIENTES", max(1, int(os.environ.get("GUNICORN_THREADS", 16)) // 2)))
+SSE_REINTENTO_LLENO = 30000
+_cupos_sse = threading.BoundedSemaphore(SSE_MAX_CLIENTES)
+
+
+def con_cupo_sse(f):
+    """Ocupa un cupo de SSE_MAX_CLIENTES mientras dure la respuesta y lo libera al cerrarla"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not _cupos_sse.acquire(blocking=False):
+            # Con un poco de azar para que las pantallas rechazadas no vuelvan todas juntas
+            reintento = SSE_REINTENTO_LLENO + random.randint(0, SSE_REINTENTO_LLENO)
+            return Response(f"retry: {reintento}\n\n", mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache"})
+        try:
+            respuesta = app.make_response(f(*args, **kwargs))
+        except Exception:
+            _cupos_sse.release()
+            raise
+        respuesta.call_on_close(_cupos_sse.release)
+        return respuesta
+    return decorated
+
+
+def encolar_ultimo(cola, datos):
+    try:
+        cola.put_nowait(datos)
+    except queue.Full:
+        # Cliente lento: sólo importa el último estado
+        try:
+            cola.get_nowait()
+        except queue.Empty:
+            pass
+        cola.put_nowait(datos)
+
+
+def respuesta_sse(evento, inicial, cola, al_cerrar):
+    """Stream SSE: el estado inicial y después cada mensaje de la cola, con pings y duración máxima"""
+    def generar():
+        try:
+            yield "retry: 3000\n\n"
+            yield f"event: {evento}\ndata: {inicial}\n\n"
+            fin = time.monotonic() + SSE_DURACION
+            while time.monotonic() < fin:
+                try:
+                    datos = cola.get(timeout=SSE_PING)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {evento}\ndata: {datos}\n\n"
+        finally:
+            al_cerrar()
+
+    return Response(generar(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+class DifusorPedidos:
+    """Con cada NOTIFY 'pedidos' consulta una sola vez los pendientes y los reparte a los clientes SSE del worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clientes = set()
+        self._ultimo = None
+
+    def suscribir(self):
+        cola = queue.Queue(maxsize=5)
+        with self._lock:
+            self._clientes.add(cola)
+        return cola
+
+    def desuscribir(self, cola):
+        with self._lock:
+            self._clientes.discard(cola)
+
+    def snapshot(self):
+        ultimo = self._ultimo
+        if ultimo is not None and escucha.activo():
+            return ultimo
+        ultimo = app.json.dumps({"pedidos": pedidos_pendientes_detalle()})
+        self._ultimo = ultimo
+        return ultimo
+
+    def notificar(self, payload=None):
+        with self._lock:
+            clientes = list(self._clientes)
+        if not clientes:
+            self._ultimo = None
+            return
+
+        datos = app.json.dumps({"pedidos": pedidos_pendientes_detalle()})
+        self._ultimo = datos
+        for cola in clientes:
+            encolar_ultimo(cola, datos)
+
+
+difusor_pedidos = DifusorPedidos()
+escucha.suscribir("pedidos", difusor_pedidos.notificar)
+
+
+@app.route("/api/pedidos/stream")
+@login_required
+@con_cupo_sse
+def api_pedidos_stream():
+    escucha.iniciar()
+    cola = difusor_pedidos.suscribir()
+    try:
+        inicial = difusor_pedidos.snapshot()
+    except Exception:
+        difusor_pedidos.desuscribir(cola)
+        raise
+
+    return respuesta_sse("pedidos", inicial, cola, lambda: difusor_pedidos.desuscribir(cola))
+
+@app.route("/api/db/pool")
+@admin_required
+def api_db_pool():
+    return jsonify(obtener_pool().estadisticas())
+
+@app.route("/metrics")
+@admin_required
+def metrics():
+    return Response(metricas.texto(obtener_pool(), fragmentos), mimetype="text/plain; version=0.0.4")
+
+# ========== COCINA ==========
+# (categoría, tipo, estación): gana la primera regla que coincide; None vale para cualquiera
+COCINA_RUTAS = [
+    ("Sandwiches", None, "plancha"),
+    ("Pizzas", None, "horno"),
+    ("Bebidas", None, "barra"),
+]
+COCINA_GENERAL = "cocina"
+COCINA_ESTACIONES = list(dict.fromkeys([estacion for _, _, estacion in COCINA_RUTAS] + [COCINA_GENERAL]))
+# Estaciones con pantalla (COCINA_PANTALLAS=plancha,horno): lo de las demás no se encola
+COCINA_PANTALLAS = [e for e in os.environ.get("COCINA_PANTALLAS", ",".join(COCINA_ESTACIONES)).split(",")
+                    if e in COCINA_ESTACIONES]
+# Minutos tras los cuales un ítem que nadie marcó deja de mostrarse; al cerrar el turno se vacía la cola
+COCINA_MAX_ESPERA = int(os.environ.get("COCINA_MAX_ESPERA", 240))
+
+
+def estacion_de(producto):
+    """Estación que prepara un producto del catálogo; lo que no tiene regla (o ya no existe) va a la general"""
+    if producto is not None:
+        for categoria, tipo, estacion in COCINA_RUTAS:
+            if categoria in (None, producto["categoria"]) and tipo in (None, producto["tipo"]):
+                return estacion
+    return COCINA_GENERAL
+
+
+def comanda_venta(cur, venta_id):
+    """Manda a la cocina las líneas de una venta cargada en caja (las de pedidos las carga un trigger).
+    Si alguna estación no tiene pantalla, sólo van los productos de las que sí. Lo que la cocina ya
+    marcó listo para esta venta se descuenta, así al reenviar una venta editada no se prepara dos veces"""
+    filtro, params = "", {"venta": venta_id}
+    if len(COCINA_PANTALLAS) < len(COCINA_ESTACIONES):
+        filtro = "AND dv.producto_id = ANY(%(productos)s)"
+        params["productos"] = [p["id"] for p in catalogo.obtener()["productos"]
+                               if estacion_de(p) in COCINA_PANTALLAS]
+    cur.execute(f"""
+        WITH lineas AS (
+            SELECT dv.id, dv.producto_id, COALESCE(dv.producto, '') AS producto, dv.cantidad,
+                   COALESCE(dv.extras, '') AS extras, COALESCE(dv.observaciones, '') AS observaciones
+            FROM detalle_venta dv
+            WHERE dv.venta_id = %(venta)s {filtro}
+        ), listos AS (
+            SELECT producto_id, producto, extras, observaciones, SUM(cantidad) AS cantidad
+            FROM comanda_items
+            WHERE venta_id = %(venta)s AND listo IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+        ), faltantes AS (
+            -- Lo ya preparado se descuenta de las primeras líneas iguales (mismo producto, extras y observaciones)
+            SELECT l.*, LEAST(l.cantidad, SUM(l.cantidad) OVER (
+                       PARTITION BY l.producto_id, l.producto, l.extras, l.observaciones ORDER BY l.id
+                   ) - COALESCE(h.cantidad, 0)) AS pendiente
+            FROM lineas l
+            LEFT JOIN listos h ON h.producto_id IS NOT DISTINCT FROM l.producto_id AND h.producto = l.producto
+                              AND h.extras = l.extras AND h.observaciones = l.observaciones
+        )
+        INSERT INTO comanda_items (venta_id, origen, producto_id, producto, cantidad, extras, observaciones)
+        SELECT v.id, 'Venta #' || v.id || ' · ' || initcap(COALESCE(v.tipo_pedido, 'mesa')),
+               f.producto_id, f.producto, f.pendiente, f.extras, f.observaciones
+        FROM ventas v JOIN faltantes f ON v.id = %(venta)s
+        WHERE f.pendiente > 0
+        ORDER BY f.id
+    """, params)
+
+
+def quitar_de_cocina(cur, columna, id):
+    """Saca de la cola lo que todavía no se preparó de una venta eliminada o editada, o de un pedido cancelado"""
+    cur.execute(f"DELETE FROM comanda_items WHERE {columna}=%s AND listo IS NULL", (id,))
+
+
+def vaciar_cocina(cur):
+    """Al cerrar el turno, lo que nadie marcó se da por listo: la cola no arrastra pendientes de turno en turno"""
+    cur.execute("UPDATE comanda_items SET listo=now() WHERE listo IS NULL")
+
+
+class ColaCocina:
+    """Comandas pendientes por estación, en memoria en cada worker. Con cada NOTIFY 'cocina' se
+    consulta una sola vez y sólo reciben la cola nueva las estaciones que cambiaron"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clientes = {}
+        self._colas = None
+
+    def suscribir(self, estacion):
+        cola = queue.Queue(maxsize=5)
+        with self._lock:
+            self._clientes.setdefault(estacion, set()).add(cola)
+        return cola
+
+    def desuscribir(self, estacion, cola):
+        with self._lock:
+            self._clientes.get(estacion, set()).discard(cola)
+
+    def leer(self):
+        """Pendientes agrupados en tickets (venta o pedido) por estación, en orden de llegada, como JSON"""
+        por_id = catalogo.obtener()["por_id"]
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("""
+                SELECT id, venta_id, pedido_id, origen, producto_id, producto, cantidad, extras, observaciones, creado
+                FROM comanda_items
+                WHERE listo IS NULL AND creado > now() - make_interval(mins => %s)
+                ORDER BY id
+            """, (COCINA_MAX_ESPERA,))
+            filas = cur.fetchall()
+
+        tickets = {estacion: {} for estacion in COCINA_PANTALLAS}
+        for f in filas:
+            estacion = estacion_de(por_id.get(f["producto_id"]))
+            if estacion not in tickets:
+                # Pedidos QR de una estación sin pantalla: se ignoran y se vacían con el cierre del turno
+                continue
+            clave = f"v{f['venta_id']}" if f["venta_id"] else f"p{f['pedido_id']}"
+            ticket = tickets[estacion].setdefault(clave, {
+                "clave": clave,
+                "origen": f["origen"],
+                "hora": _hora(f["creado"]),
+                "creado": int(f["creado"].timestamp()),
+                "items": [],
+            })
+            ticket["items"].append({"id": f["id"], "producto": f["producto"], "cantidad": f["cantidad"],
+                                    "extras": f["extras"], "observaciones": f["observaciones"]})
+        return {estacion: app.json.dumps({"estacion": estacion, "tickets": list(t.values())})
+                for estacion, t in tickets.items()}
+
+    def snapshot(self, estacion):
+        colas = self._colas
+        if colas is None or not escucha.activo():
+            colas = self._colas = self.leer()
+        return colas[estacion]
+
+    def notificar(self, payload=None):
+        with self._lock:
+            clientes = {estacion: list(c) for estacion, c in self._clientes.items() if c}
+        if not clientes:
+            self._colas = None
+            return
+
+        anteriores = self._colas or {}
+        colas = self._colas = self.leer()
+        for estacion, colas_sse in clientes.items():
+            if colas[estacion] == anteriores.get(estacion):
+                continue
+            for cola in colas_sse:
+                encolar_ultimo(cola, colas[estacion])
+
+
+cola_cocina = ColaCocina()
+escucha.suscribir("cocina", cola_cocina.notificar)
+
+
+@app.route("/cocina")
+@app.route("/cocina/<estacion>")
+@login_required
+def cocina(estacion=None):
+    if not COCINA_PANTALLAS:
+        flash("No hay estaciones de cocina con pantalla (ver COCINA_PANTALLAS)", "warning")
+        return redirect("/")
+    if estacion is None:
+        return redirect(f"/cocina/{COCINA_PANTALLAS[0]}")
+    if estacion not in COCINA_PANTALLAS:
+        flash(f"La estación {estacion} no existe", "danger")
+        return redirect("/cocina")
+    return render_template("cocina.html", estacion=estacion, estaciones=COCINA_PANTALLAS)
+
+@app.route("/api/cocina/<estacion>")
+@login_required
+def api_cocina(estacion):
+    if estacion not in COCINA_PANTALLAS:
+        return jsonify({"error": "Estación inexistente"}), 404
+    return Response(cola_cocina.snapshot(estacion), mimetype="application/json")
+
+@app.route("/api/cocina/<estacion>/stream")
+@login_required
+@con_cupo_sse
+def api_cocina_stream(estacion):
+    if estacion not in COCINA_PANTALLAS:
+        return jsonify({"error": "Estación inexistente"}), 404
+    escucha.iniciar()
+    cola = cola_cocina.suscribir(estacion)
+    try:
+        inicial = cola_cocina.snapshot(estacion)
+    except Exception:
+        cola_cocina.desuscribir(estacion, cola)
+        raise
+
+    return respuesta_sse("cocina", inicial, cola, lambda: cola_cocina.desuscribir(estacion, cola))
+
+@app.route("/api/cocina/listo", methods=["POST"])
+@login_required
+def api_cocina_listo():
+    """Marca ítems como preparados: {ids: [...]}. Los que ya marcó otra pantalla (o un doble toque) no cambian"""
+    ids = (request.get_json(silent=True) or {}).get("ids")
+    try:
+        if not isinstance(ids, list):
+            raise ValueError
+        ids = [int(i) for i in ids][:PEDIDO_MAX_LINEAS]
+    except (TypeError, ValueError):
+        return jsonify({"error": "ids inválidos"}), 400
+
+    with get_db() as con:
+        cur = con.cursor()
+        cur.execute("UPDATE comanda_items SET listo=now() WHERE id = ANY(%s) AND listo IS NULL RETURNING id", (ids,))
+        listos = [f["id"] for f in cur.fetchall()]
+        con.commit()
+    return jsonify({"listos": listos})
 
 # ========== PRODUCTOS ==========
+_api_productos_cache = {"version": None}
+
+
+def api_productos_cuerpos(cat):
+    """JSON de /api/productos armado y comprimido una sola vez por versión del catálogo"""
+    global _api_productos_cache
+    cache = _api_productos_cache
+    if cache["version"] == cat["version"]:
+        return cache
+
+    productos_lista = [{
+        "id": str(p["id"]),
+        "nombre": p["nombre"],
+        "precio": p["precio"],
+        "categoria": p["categoria"],
+        "tipo": p.get("tipo", "normal") or "normal"
+    } for p in cat["menu_productos"]]
+    cuerpo = app.json.dumps({
+        "productos": productos_lista,
+        "categorias": sorted(cat["menu"])
+    }).encode("utf-8")
+
+    cache = {
+        "version": cat["version"],
+        "etag": f"productos-{cat['version']}",
+        "identity": cuerpo,
+        "gzip": gzip.compress(cuerpo, compresslevel=9),
+    }
+    if brotli is not None:
+        cache["br"] = brotli.compress(cuerpo)
+    _api_productos_cache = cache
+    return cache
+
+
 @app.route("/api/productos")
 def api_productos():
     try:
-        with get_db() as con:
-            cur = con.cursor()
-            cur.execute("SELECT * FROM productos WHERE precio > 0 ORDER BY categoria, nombre")
-            productos_db = cur.fetchall()
-            
-            productos_lista = []
-            categorias_set = set()
-            
-            for p in productos_db:
-                producto_dict = {
-                    "id": str(p["id"]),
-                    "nombre": p["nombre"],
-                    "precio": p["precio"],
-                    "categoria": p["categoria"],
-                    "tipo": p.get("tipo", "normal") or "normal"
-                }
-                
-                productos_lista.append(producto_dict)
-                categorias_set.add(p["categoria"])
+        cache = api_productos_cuerpos(catalogo.obtener())
+        
+        if request.if_none_match.contains_weak(cache["etag"]):
+            respuesta = Response(status=304)
+        else:
+            encoding = "identity"
+            for candidato in ("br", "gzip"):
+                if candidato in cache and request.accept_encodings.quality(candidato) > 0:
+                    encoding = candidato
+                    break
             
-            categorias_lista = sorted(list(categorias_set))
+            respuesta = Response(cache[encoding], mimetype="application/json")
+            if encoding != "identity":
+                respuesta.headers["Content-Encoding"] = encoding
         
-        return jsonify({
-            "productos": productos_lista,
-            "categorias": categorias_lista
-        })
+        respuesta.set_etag(cache["etag"], weak=True)
+        respuesta.headers["Cache-Control"] = "no-cache"
+        respuesta.headers["Vary"] = "Accept-Encoding"
+        return respuesta
     
     except Exception as e:
-        print(f"❌ Error en /api/productos: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("Error en /api/productos")
         return jsonify({"error": str(e)}), 500
 
+
 @app.route("/productos", methods=["GET", "POST"])
 @admin_required
 def productos():
@@ -745,11 +2688,13 @@ def productos():
                 return redirect("/productos")
 
             cur.execute("""
-                INSERT INTO productos (nombre, precio, categoria, tipo)
-                VALUES (%s, %s, %s, %s)
-            """, (nombre, int(precio), categoria, tipo))
+                INSERT INTO productos (id, nombre, precio, categoria, tipo)
+                VALUES (COALESCE(%s, nextval(pg_get_serial_sequence('productos', 'id'))), %s, %s, %s, %s)
+            """, (id_recuperado(cur, nombre), nombre, int(precio), categoria, tipo))
+            catalogo_modificado(cur)
 
             con.commit()
+            catalogo.invalidar()
             flash("Producto agregado", "success")
             return redirect("/productos")
 
@@ -773,7 +2718,9 @@ def editar_producto(id):
             tipo = request.form.get("tipo", "normal")
             cur.execute("UPDATE productos SET nombre=%s, precio=%s, categoria=%s, tipo=%s WHERE id=%s",
                         (request.form["nombre"], request.form["precio"], request.form["categoria"], tipo, id))
+            catalogo_modificado(cur)
             con.commit()
+            catalogo.invalidar()
             flash('Producto actualizado', 'success')
             return redirect("/productos")
     
@@ -785,19 +2732,53 @@ def eliminar_producto(id):
     with get_db() as con:
         cur = con.cursor()
         cur.execute("DELETE FROM productos WHERE id=%s", (id,))
+        eliminado = cur.rowcount > 0
+        if eliminado:
+            catalogo_modificado(cur)
         con.commit()
-    
+
+    if not eliminado:
+        flash('Producto no encontrado', 'danger')
+        return redirect("/productos")
+    catalogo.invalidar()
     flash('Producto eliminado', 'warning')
     return redirect("/productos")
 
 # ========== TURNOS ==========
+TURNOS_POR_PAGINA = 30
+ELIMINADAS_POR_PAGINA = 20
+MESES_HISTORIAL = 12
+
+
+def _arg_entero(nombre):
+    valor = request.args.get(nombre, "")
+    return int(valor) if valor.isdigit() else None
+
+
 @app.route("/turnos")
 @caja_or_admin_required
 def turnos():
+    """Historial paginado por clave: ?antes=<id> / ?despues=<id> para turnos y
+    ?elim_fecha=<fecha_hora>&elim_id=<id> para ventas eliminadas (nunca OFFSET)"""
+    antes = _arg_entero("antes")
+    despues = _arg_entero("despues")
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("SELECT * FROM turnos ORDER BY id DESC LIMIT 30")
-        turnos_db = cur.fetchall()
+        if despues is not None:
+            cur.execute("SELECT * FROM turnos WHERE id > %s ORDER BY id ASC LIMIT %s",
+                        (despues, TURNOS_POR_PAGINA + 1))
+            turnos_db = cur.fetchall()
+            mas_recientes = len(turnos_db) > TURNOS_POR_PAGINA
+            turnos_db = turnos_db[:TURNOS_POR_PAGINA][::-1]
+            mas_antiguos = True
+        else:
+            cur.execute("""
+                SELECT * FROM turnos WHERE (%(antes)s IS NULL OR id < %(antes)s) ORDER BY id DESC LIMIT %(limite)s
+            """, {"antes": antes, "limite": TURNOS_POR_PAGINA + 1})
+            turnos_db = cur.fetchall()
+            mas_antiguos = len(turnos_db) > TURNOS_POR_PAGINA
+            turnos_db = turnos_db[:TURNOS_POR_PAGINA]
+            mas_recientes = antes is not None
         
         # Procesar turnos para agregar día de la semana
         turnos = []
@@ -806,44 +2787,88 @@ def turnos():
             turno_dict['dia_semana'] = obtener_dia_semana(t['fecha'])
             turnos.append(turno_dict)
         
-        cur.execute("SELECT COALESCE(SUM(total),0) total FROM turnos WHERE estado='CERRADO'")
-        mensual = cur.fetchone()["total"]
+        # Totales por mes desde el resumen diario: a lo sumo ~MESES_HISTORIAL * 31 días de filas, haya los años que haya
+        cur.execute("""
+            SELECT date_trunc('month', fecha)::date AS mes, SUM(ventas) AS ventas, SUM(total) AS total
+            FROM ventas_diarias
+            WHERE fecha >= (date_trunc('month', CURRENT_DATE) - %s * INTERVAL '1 month')::date
+            GROUP BY 1
+            ORDER BY 1 DESC
+        """, (MESES_HISTORIAL - 1,))
+        meses = cur.fetchall()
+        mes_actual = date.today().replace(day=1)
+        mensual = next((m["total"] for m in meses if m["mes"] == mes_actual), 0)
         
         ventas_eliminadas = []
+        eliminadas_siguiente = None
         if session.get('rol') == 'ADMIN':
+            try:
+                elim_fecha = datetime.fromisoformat(request.args.get("elim_fecha", ""))
+                elim_id = int(request.args.get("elim_id", ""))
+            except ValueError:
+                elim_fecha = elim_id = None
             cur.execute("""
                 SELECT v.*, t.fecha as turno_fecha
                 FROM ventas v
                 LEFT JOIN turnos t ON v.turno_id = t.id
-                WHERE v.estado='ELIMINADA'
-                ORDER BY v.fecha_hora DESC
-                LIMIT 20
-            """)
+                WHERE v.estado='ELIMINADA' AND v.fecha_hora IS NOT NULL
+                  AND (%(fecha)s::timestamp IS NULL OR (v.fecha_hora, v.id) < (%(fecha)s, %(id)s))
+                ORDER BY v.fecha_hora DESC, v.id DESC
+                LIMIT %(limite)s
+            """, {"fecha": elim_fecha, "id": elim_id, "limite": ELIMINADAS_POR_PAGINA + 1})
             ventas_eliminadas = cur.fetchall()
+            if len(ventas_eliminadas) > ELIMINADAS_POR_PAGINA:
+                ventas_eliminadas = ventas_eliminadas[:ELIMINADAS_POR_PAGINA]
+                ultima = ventas_eliminadas[-1]
+                eliminadas_siguiente = {"elim_fecha": ultima["fecha_hora"].isoformat(), "elim_id": ultima["id"]}
     
-    return render_template("turnos.html", turnos=turnos, mensual=mensual, ventas_eliminadas=ventas_eliminadas)
+    return render_template("turnos.html", turnos=turnos, mensual=mensual, meses=meses,
+                           mas_recientes=mas_recientes, mas_antiguos=mas_antiguos,
+                           ventas_eliminadas=ventas_eliminadas, eliminadas_siguiente=eliminadas_siguiente,
+                           eliminadas_paginado="elim_id" in request.args)
 
 @app.route("/cerrar_turno")
 @caja_or_admin_required
 def cerrar_turno():
     with get_db() as con:
-        turno = con.execute("SELECT * FROM turnos WHERE estado='ABIERTO'").fetchone()
+        cur = con.cursor()
+        # FOR UPDATE: un segundo cierre simultáneo espera y encuentra el turno ya cerrado, y las
+        # ventas en curso (FOR KEY SHARE en turno_para_venta) terminan antes de sumar. Las que
+        # llegan después esperan este commit, ven el turno CERRADO y van al turno nuevo
+        cur.execute("SELECT * FROM turnos WHERE estado='ABIERTO' FOR UPDATE")
+        turno = cur.fetchone()
         if turno:
-            total = con.execute("SELECT IFNULL(SUM(total),0) total FROM ventas WHERE turno_id=? AND estado='OK'", (turno["id"],)).fetchone()["total"]
-            detalle_productos = con.execute("""
-                SELECT producto, SUM(cantidad) as cantidad, SUM(cantidad * precio) as total
-                FROM detalle_venta
-                WHERE venta_id IN (SELECT id FROM ventas WHERE turno_id=? AND estado='OK')
-                GROUP BY producto
-                ORDER BY cantidad DESC
-            """, (turno["id"],)).fetchall()
-            con.execute("UPDATE turnos SET estado='CERRADO', total=? WHERE id=?", (total, turno["id"]))
+            cur.execute("UPDATE turnos SET estado='CERRADO' WHERE id=%s", (turno["id"],))
+            guardar_resumen_turno(cur, turno["id"])
+            reconstruir_resumen_turno(cur, turno["id"])
+            vaciar_cocina(cur)
+            turno_cerrado(cur, turno["id"])
             con.commit()
-            return render_template("cierre_turno.html", turno=turno, total=total, detalle=detalle_productos)
+            return redirect(f"/turnos/{turno['id']}/cierre")
         
         flash('No hay turno abierto', 'warning')
         return redirect("/turnos")
 
+@app.route("/turnos/<int:id>/cierre")
+@caja_or_admin_required
+def cierre_turno(id):
+    """Ver o reimprimir el cierre: lee el snapshot guardado en turno_resumen, no recalcula"""
+    with get_db() as con:
+        cur = con.cursor()
+        cur.execute("SELECT * FROM turnos WHERE id=%s", (id,))
+        turno = cur.fetchone()
+        if not turno or turno["estado"] != "CERRADO":
+            flash("El turno no existe o todavía está abierto", "warning")
+            return redirect("/turnos")
+        cur.execute("""
+            SELECT producto, cantidad, total FROM turno_resumen
+            WHERE turno_id=%s
+            ORDER BY cantidad DESC
+        """, (id,))
+        detalle = cur.fetchall()
+    
+    return render_template("cierre_turno.html", turno=turno, total=turno["total"], detalle=detalle)
+
 @app.route("/turnos/editar/<int:id>", methods=["GET", "POST"])
 @admin_required
 def editar_turno(id):
@@ -880,156 +2905,108 @@ def editar_turno(id):
 from datetime import timedelta
 
 # ========== REPORTES ==========
+def _agrupar_ventas(filas, desde, hasta, clave, etiqueta_cantidad="cantidad"):
+    """Suma por 'clave' las filas (fecha, tipo, medio) que caen entre desde y hasta (inclusive)"""
+    grupos = {}
+    for f in filas:
+        if desde <= f["fecha"] <= hasta:
+            grupo = grupos.setdefault(f[clave], {clave: f[clave], etiqueta_cantidad: 0, "total": 0})
+            grupo[etiqueta_cantidad] += f["ventas"]
+            grupo["total"] += f["total"]
+    return list(grupos.values())
+
+
+def _totales(filas, desde, hasta):
+    ventas = total = 0
+    for f in filas:
+        if desde <= f["fecha"] <= hasta:
+            ventas += f["ventas"]
+            total += f["total"]
+    return ventas, total
+
+
+def _top(filas, sufijo, limite):
+    top = [{"producto": f["producto"], "cantidad": f["cantidad_" + sufijo], "total": f["total_" + sufijo]}
+           for f in filas if f["cantidad_" + sufijo]]
+    top.sort(key=lambda p: p["cantidad"], reverse=True)
+    return top[:limite]
+
+
 @app.route("/reportes")
 @login_required
 def reportes():
     """Panel de reportes semanales y mensuales"""
+    hoy = date.today()
+    
+    # REPORTE SEMANAL
+    inicio_semana = hoy - timedelta(days=hoy.weekday())
+    fin_semana = inicio_semana + timedelta(days=6)
+    
+    # REPORTE MENSUAL
+    inicio_mes = hoy.replace(day=1)
+    if hoy.month == 12:
+        fin_mes = hoy.replace(year=hoy.year + 1, month=1, day=1) - timedelta(days=1)
+    else:
+        fin_mes = hoy.replace(month=hoy.month + 1, day=1) - timedelta(days=1)
+    
+    # COMPARATIVAS
+    inicio_semana_ant = inicio_semana - timedelta(days=7)
+    fin_semana_ant = inicio_semana_ant + timedelta(days=6)
+    
+    if inicio_mes.month == 1:
+        inicio_mes_ant = inicio_mes.replace(year=inicio_mes.year - 1, month=12)
+    else:
+        inicio_mes_ant = inicio_mes.replace(month=inicio_mes.month - 1)
+    fin_mes_ant = inicio_mes - timedelta(days=1)
+    
+    # Todo sale del resumen diario (una fila por día, tipo y medio): los cortes por
+    # período se arman en Python sobre unas pocas cientos de filas
+    semana = (inicio_semana, fin_semana)
+    mes = (inicio_mes, fin_mes)
+    
     with get_db() as con:
-        hoy = date.today()
-        
-        # REPORTE SEMANAL
-        inicio_semana = hoy - timedelta(days=hoy.weekday())
-        fin_semana = inicio_semana + timedelta(days=6)
-        
-        ventas_semana = con.execute("""
-            SELECT COUNT(*) as total
-            FROM ventas 
-            WHERE DATE(fecha_hora) BETWEEN ? AND ? 
-            AND estado='OK'
-        """, (inicio_semana.isoformat(), fin_semana.isoformat())).fetchone()['total']
-        
-        total_semana = con.execute("""
-            SELECT IFNULL(SUM(total), 0) as total
-            FROM ventas 
-            WHERE DATE(fecha_hora) BETWEEN ? AND ? 
-            AND estado='OK'
-        """, (inicio_semana.isoformat(), fin_semana.isoformat())).fetchone()['total']
-        
-        top_semana = con.execute("""
-            SELECT 
-                dv.producto, 
-                SUM(dv.cantidad) as cantidad,
-                SUM(dv.cantidad * dv.precio) as total
-            FROM detalle_venta dv
-            INNER JOIN ventas v ON dv.venta_id = v.id
-            WHERE DATE(v.fecha_hora) BETWEEN ? AND ? 
-            AND v.estado='OK'
-            GROUP BY dv.producto
-            ORDER BY cantidad DESC
-            LIMIT 10
-        """, (inicio_semana.isoformat(), fin_semana.isoformat())).fetchall()
-        
-        ventas_por_dia_semana = con.execute("""
-            SELECT 
-                DATE(fecha_hora) as fecha,
-                COUNT(*) as ventas,
-                SUM(total) as total
-            FROM ventas
-            WHERE DATE(fecha_hora) BETWEEN ? AND ?
-            AND estado='OK'
-            GROUP BY DATE(fecha_hora)
-            ORDER BY fecha
-        """, (inicio_semana.isoformat(), fin_semana.isoformat())).fetchall()
-        
-        # REPORTE MENSUAL
-        inicio_mes = hoy.replace(day=1)
-        if hoy.month == 12:
-            fin_mes = hoy.replace(year=hoy.year + 1, month=1, day=1) - timedelta(days=1)
-        else:
-            fin_mes = hoy.replace(month=hoy.month + 1, day=1) - timedelta(days=1)
-        
-        ventas_mes = con.execute("""
-            SELECT COUNT(*) as total
-            FROM ventas 
-            WHERE DATE(fecha_hora) BETWEEN ? AND ? 
-            AND estado='OK'
-        """, (inicio_mes.isoformat(), fin_mes.isoformat())).fetchone()['total']
-        
-        total_mes = con.execute("""
-            SELECT IFNULL(SUM(total), 0) as total
-            FROM ventas 
-            WHERE DATE(fecha_hora) BETWEEN ? AND ? 
-            AND estado='OK'
-        """, (inicio_mes.isoformat(), fin_mes.isoformat())).fetchone()['total']
-        
-        top_mes = con.execute("""
-            SELECT 
-                dv.producto, 
-                SUM(dv.cantidad) as cantidad,
-                SUM(dv.cantidad * dv.precio) as total
-            FROM detalle_venta dv
-            INNER JOIN ventas v ON dv.venta_id = v.id
-            WHERE DATE(v.fecha_hora) BETWEEN ? AND ? 
-            AND v.estado='OK'
-            GROUP BY dv.producto
-            ORDER BY cantidad DESC
-            LIMIT 15
-        """, (inicio_mes.isoformat(), fin_mes.isoformat())).fetchall()
-        
-        ventas_por_dia_mes = con.execute("""
-            SELECT 
-                DATE(fecha_hora) as fecha,
-                COUNT(*) as ventas,
-                SUM(total) as total
-            FROM ventas
-            WHERE DATE(fecha_hora) BETWEEN ? AND ?
-            AND estado='OK'
-            GROUP BY DATE(fecha_hora)
-            ORDER BY fecha
-        """, (inicio_mes.isoformat(), fin_mes.isoformat())).fetchall()
-        
-        ventas_por_tipo = con.execute("""
-            SELECT 
-                tipo_pedido,
-                COUNT(*) as cantidad,
-                SUM(total) as total
-            FROM ventas
-            WHERE DATE(fecha_hora) BETWEEN ? AND ?
-            AND estado='OK'
-            GROUP BY tipo_pedido
-        """, (inicio_mes.isoformat(), fin_mes.isoformat())).fetchall()
-        
-        ventas_por_medio = con.execute("""
-            SELECT 
-                medio_pago,
-                COUNT(*) as cantidad,
-                SUM(total) as total
-            FROM ventas
-            WHERE DATE(fecha_hora) BETWEEN ? AND ?
-            AND estado='OK'
-            GROUP BY medio_pago
-        """, (inicio_mes.isoformat(), fin_mes.isoformat())).fetchall()
-        
-        # COMPARATIVAS
-        inicio_semana_ant = inicio_semana - timedelta(days=7)
-        fin_semana_ant = inicio_semana_ant + timedelta(days=6)
-        
-        total_semana_ant = con.execute("""
-            SELECT IFNULL(SUM(total), 0) as total
-            FROM ventas 
-            WHERE DATE(fecha_hora) BETWEEN ? AND ? 
-            AND estado='OK'
-        """, (inicio_semana_ant.isoformat(), fin_semana_ant.isoformat())).fetchone()['total']
-        
-        if inicio_mes.month == 1:
-            inicio_mes_ant = inicio_mes.replace(year=inicio_mes.year - 1, month=12)
-        else:
-            inicio_mes_ant = inicio_mes.replace(month=inicio_mes.month - 1)
-        
-        if inicio_mes_ant.month == 12:
-            fin_mes_ant = inicio_mes_ant.replace(year=inicio_mes_ant.year + 1, month=1, day=1) - timedelta(days=1)
-        else:
-            fin_mes_ant = inicio_mes_ant.replace(month=inicio_mes_ant.month + 1, day=1) - timedelta(days=1)
-        
-        total_mes_ant = con.execute("""
-            SELECT IFNULL(SUM(total), 0) as total
-            FROM ventas 
-            WHERE DATE(fecha_hora) BETWEEN ? AND ? 
-            AND estado='OK'
-        """, (inicio_mes_ant.isoformat(), fin_mes_ant.isoformat())).fetchone()['total']
+        cur = con.cursor()
+        cur.execute("""
+            SELECT fecha, tipo_pedido, medio_pago, ventas, total
+            FROM ventas_diarias
+            WHERE fecha BETWEEN %s AND %s AND ventas > 0
+        """, (min(inicio_mes_ant, inicio_semana_ant), max(fin_mes, fin_semana)))
+        filas = cur.fetchall()
         
-        var_semana = ((total_semana - total_semana_ant) / total_semana_ant * 100) if total_semana_ant > 0 else 0
-        var_mes = ((total_mes - total_mes_ant) / total_mes_ant * 100) if total_mes_ant > 0 else 0
+        cur.execute("""
+            WITH p AS (
+                SELECT 
+                    producto_id,
+                    COALESCE(SUM(cantidad) FILTER (WHERE fecha BETWEEN %s AND %s), 0) AS cantidad_semana,
+                    COALESCE(SUM(total) FILTER (WHERE fecha BETWEEN %s AND %s), 0) AS total_semana,
+                    COALESCE(SUM(cantidad) FILTER (WHERE fecha BETWEEN %s AND %s), 0) AS cantidad_mes,
+                    COALESCE(SUM(total) FILTER (WHERE fecha BETWEEN %s AND %s), 0) AS total_mes
+                FROM productos_diarios
+                WHERE fecha BETWEEN %s AND %s
+                GROUP BY producto_id
+            )
+            SELECT p.*, COALESCE(d.nombre, 'Sin identificar') AS producto
+            FROM p LEFT JOIN producto_dim d ON d.id = p.producto_id
+        """, (*semana, *semana, *mes, *mes, min(inicio_mes, inicio_semana), max(fin_mes, fin_semana)))
+        productos_periodo = cur.fetchall()
+    
+    ventas_semana, total_semana = _totales(filas, inicio_semana, fin_semana)
+    ventas_mes, total_mes = _totales(filas, inicio_mes, fin_mes)
+    total_semana_ant = _totales(filas, inicio_semana_ant, fin_semana_ant)[1]
+    total_mes_ant = _totales(filas, inicio_mes_ant, fin_mes_ant)[1]
+    
+    ventas_por_dia_semana = sorted(_agrupar_ventas(filas, inicio_semana, fin_semana, "fecha", "ventas"),
+                                   key=lambda d: d["fecha"])
+    ventas_por_dia_mes = sorted(_agrupar_ventas(filas, inicio_mes, fin_mes, "fecha", "ventas"),
+                                key=lambda d: d["fecha"])
+    ventas_por_tipo = _agrupar_ventas(filas, inicio_mes, fin_mes, "tipo_pedido")
+    ventas_por_medio = _agrupar_ventas(filas, inicio_mes, fin_mes, "medio_pago")
+    
+    top_semana = _top(productos_periodo, "semana", 10)
+    top_mes = _top(productos_periodo, "mes", 15)
+    
+    var_semana = ((total_semana - total_semana_ant) / total_semana_ant * 100) if total_semana_ant > 0 else 0
+    var_mes = ((total_mes - total_mes_ant) / total_mes_ant * 100) if total_mes_ant > 0 else 0
     
     return render_template('reportes.html',
         inicio_semana=inicio_semana,
@@ -1053,17 +3030,27 @@ def reportes():
     )
 
 # ========== EXPORTAR REPORTE A CSV ==========
+EXPORTAR_FILAS_POR_BLOQUE = 2000
+
+
 @app.route("/reportes/exportar/<tipo>")
 @login_required
 def exportar_reporte(tipo):
-    """Exportar reporte a CSV"""
-    from io import StringIO
-    import csv
-    from flask import make_response
-    
+    """Exportar reporte a CSV (semana, mes o rango con ?desde=YYYY-MM-DD&hasta=YYYY-MM-DD; ?gzip=1 comprime)"""
     hoy = date.today()
     
-    if tipo == 'semana':
+    if request.args.get("desde") or request.args.get("hasta"):
+        try:
+            inicio = date.fromisoformat(request.args.get("desde", ""))
+            fin = date.fromisoformat(request.args.get("hasta") or hoy.isoformat())
+        except ValueError:
+            flash("Fechas inválidas para exportar", "danger")
+            return redirect("/reportes")
+        if fin < inicio:
+            flash("La fecha 'hasta' es anterior a 'desde'", "danger")
+            return redirect("/reportes")
+        nombre = f"reporte_{inicio.isoformat()}_{fin.isoformat()}.csv"
+    elif tipo == 'semana':
         inicio = hoy - timedelta(days=hoy.weekday())
         fin = inicio + timedelta(days=6)
         nombre = f"reporte_semanal_{inicio.isoformat()}.csv"
@@ -1075,42 +3062,58 @@ def exportar_reporte(tipo):
             fin = hoy.replace(month=hoy.month + 1, day=1) - timedelta(days=1)
         nombre = f"reporte_mensual_{inicio.strftime('%Y-%m')}.csv"
     
-    with get_db() as con:
-        ventas = con.execute("""
-            SELECT 
-                v.id,
-                v.fecha_hora,
-                v.usuario,
-                v.tipo_pedido,
-                v.medio_pago,
-                v.total,
-                GROUP_CONCAT(dv.cantidad || 'x ' || dv.producto, ', ') as productos
-            FROM ventas v
-            LEFT JOIN detalle_venta dv ON v.id = dv.venta_id
-            WHERE DATE(v.fecha_hora) BETWEEN ? AND ?
-            AND v.estado='OK'
-            GROUP BY v.id
-            ORDER BY v.fecha_hora DESC
-        """, (inicio.isoformat(), fin.isoformat())).fetchall()
+    comprimir = request.args.get("gzip") == "1"
+    rango = rango_fechas(inicio, fin)
     
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['ID', 'Fecha/Hora', 'Usuario', 'Tipo', 'Medio Pago', 'Total', 'Productos'])
+    def filas_csv():
+        """CSV en bloques leídos de un cursor del lado del servidor: la memoria no crece con el rango"""
+        si = StringIO()
+        writer = csv.writer(si)
+        writer.writerow(['ID', 'Fecha/Hora', 'Usuario', 'Tipo', 'Medio Pago', 'Total', 'Productos'])
+        
+        with get_db() as con:
+            cur = con.cursor(name="exportar_ventas", cursor_factory=psycopg2.extensions.cursor)
+            cur.itersize = EXPORTAR_FILAS_POR_BLOQUE
+            cur.execute("""
+                SELECT 
+                    v.id,
+                    v.fecha_hora,
+                    v.usuario,
+                    v.tipo_pedido,
+                    v.medio_pago,
+                    v.total,
+                    (SELECT string_agg(dv.cantidad || 'x ' || dv.producto, ', ' ORDER BY dv.id)
+                     FROM detalle_venta dv WHERE dv.venta_id = v.id) as productos
+                FROM ventas v
+                WHERE v.estado='OK' AND v.fecha_hora >= %s AND v.fecha_hora < %s
+                ORDER BY v.fecha_hora DESC
+            """, rango)
+            
+            for i, v in enumerate(cur, 1):
+                writer.writerow([v[0], v[1], v[2], v[3], v[4], v[5], v[6] or ''])
+                if i % EXPORTAR_FILAS_POR_BLOQUE == 0:
+                    yield si.getvalue()
+                    si.seek(0)
+                    si.truncate()
+            cur.close()
+        
+        yield si.getvalue()
     
-    for v in ventas:
-        writer.writerow([
-            v['id'],
-            v['fecha_hora'],
-            v['usuario'],
-            v['tipo_pedido'],
-            v['medio_pago'],
-            v['total'],
-            v['productos'] or ''
-        ])
+    def gzip_csv():
+        compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for bloque in filas_csv():
+            datos = compresor.compress(bloque.encode("utf-8"))
+            if datos:
+                yield datos
+        yield compresor.flush()
     
-    output = make_response(si.getvalue())
+    if comprimir:
+        output = Response(gzip_csv(), mimetype="application/gzip")
+        nombre += ".gz"
+    else:
+        output = Response(filas_csv(), mimetype="text/csv")
     output.headers["Content-Disposition"] = f"attachment; filename={nombre}"
-    output.headers["Content-type"] = "text/csv"
+    output.headers["X-Accel-Buffering"] = "no"
     return output
 
 
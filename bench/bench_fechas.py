@@ -0,0 +1,89 @@
+"""Benchmark de filtros por fecha: DATE(fecha_hora) contra rango semiabierto sobre años de ventas.
+
+Uso:
+    DATABASE_URL=postgresql://... python bench/bench_fechas.py [--anios 3] [--ventas-por-dia 300]
+
+Trabaja sobre una tabla temporal con la misma estructura que ventas, así no toca los datos reales.
+"""
+import argparse
+import os
+import re
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+CONSULTAS = {
+    "hoy": (
+        "SELECT COUNT(*), COALESCE(SUM(total),0) FROM ventas_bench WHERE DATE(fecha_hora) = CURRENT_DATE AND estado='OK'",
+        "SELECT COUNT(*), COALESCE(SUM(total),0) FROM ventas_bench "
+        "WHERE estado='OK' AND fecha_hora >= CURRENT_DATE AND fecha_hora < CURRENT_DATE + 1",
+        None,
+    ),
+    "mes": (
+        "SELECT COUNT(*), COALESCE(SUM(total),0) FROM ventas_bench "
+        "WHERE DATE(fecha_hora) BETWEEN %s AND %s AND estado='OK'",
+        "SELECT COUNT(*), COALESCE(SUM(total),0) FROM ventas_bench "
+        "WHERE estado='OK' AND fecha_hora >= %s AND fecha_hora < %s",
+        "mes",
+    ),
+}
+
+
+def sembrar(cur, anios, por_dia):
+    cur.execute("CREATE TEMP TABLE ventas_bench (LIKE ventas INCLUDING DEFAULTS)")
+    cur.execute("""
+        INSERT INTO ventas_bench (turno_id, medio_pago, total, estado, usuario, fecha_hora, tipo_pedido)
+        SELECT (n / %s)::int,
+               (ARRAY['Efectivo','Transferencia','Tarjeta'])[1 + n %% 3],
+               2000 + (n * 37) %% 20000,
+               CASE WHEN n %% 50 = 0 THEN 'ELIMINADA' ELSE 'OK' END,
+               'bench',
+               CURRENT_DATE - (n / %s) * INTERVAL '1 day' + (n %% %s) * INTERVAL '2 minutes' + INTERVAL '18 hours',
+               (ARRAY['mesa','delivery','llevar'])[1 + n %% 3]
+        FROM generate_series(0, %s) AS n
+    """, (por_dia, por_dia, por_dia, anios * 365 * por_dia - 1))
+    cur.execute("CREATE INDEX ON ventas_bench (estado, fecha_hora)")
+    cur.execute("ANALYZE ventas_bench")
+
+
+def explicar(cur, sql, params):
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+    plan = [list(fila.values())[0] for fila in cur.fetchall()]
+    tiempo = next(float(re.search(r"([\d.]+) ms", l).group(1)) for l in plan if l.startswith("Execution Time"))
+    return plan, tiempo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--anios", type=int, default=3)
+    parser.add_argument("--ventas-por-dia", type=int, default=300)
+    args = parser.parse_args()
+
+    app.init_db()
+    with app.conexion_directa() as con:
+        cur = con.cursor()
+        sembrar(cur, args.anios, args.ventas_por_dia)
+        hoy = date.today()
+        inicio_mes = hoy.replace(day=1)
+
+        for nombre, (antes, despues, rango) in CONSULTAS.items():
+            print(f"===== {nombre} =====")
+            for etiqueta, sql in (("DATE(fecha_hora)", antes), ("rango semiabierto", despues)):
+                if rango is None:
+                    params = None
+                elif sql is antes:
+                    params = (inicio_mes, hoy)
+                else:
+                    params = app.rango_fechas(inicio_mes, hoy)
+                explicar(cur, sql, params)
+                plan, tiempo = explicar(cur, sql, params)
+                print(f"--- {etiqueta}: {tiempo:.2f} ms")
+                print("\n".join(plan))
+        con.rollback()
+
+
+if __name__ == "__main__":
+    main()
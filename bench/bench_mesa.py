@@ -0,0 +1,87 @@
+"""Prueba de carga de pedidos QR: muchos teléfonos a la vez enviando pedidos JSON.
+
+Uso (comparar el respaldo síncrono con el intake ASGI, ambos en un solo core):
+    gunicorn -w 1 app:app -b 127.0.0.1:8000
+    uvicorn intake:app --port 8001
+    python bench/bench_mesa.py http://127.0.0.1:8000 --telefonos 200 --pedidos 5
+    python bench/bench_mesa.py http://127.0.0.1:8001 --catalogo http://127.0.0.1:8000 --telefonos 200 --pedidos 5
+
+Los pedidos quedan en la base como PENDIENTE de la mesa "bench".
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+async def post_json(lector, escritor, host, ruta, datos):
+    """POST HTTP/1.1 keep-alive mínimo; devuelve el código de estado"""
+    cuerpo = json.dumps(datos).encode("utf-8")
+    escritor.write(
+        f"POST {ruta} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(cuerpo)}\r\n\r\n".encode() + cuerpo
+    )
+    await escritor.drain()
+
+    estado = int((await lector.readline()).split()[1])
+    largo = 0
+    while True:
+        linea = await lector.readline()
+        if linea in (b"\r\n", b""):
+            break
+        nombre, _, valor = linea.decode("latin-1").partition(":")
+        if nombre.lower() == "content-length":
+            largo = int(valor)
+    await lector.readexactly(largo)
+    return estado
+
+
+async def telefono(url, productos, pedidos, latencias, errores):
+    partes = urlsplit(url)
+    lector, escritor = await asyncio.open_connection(partes.hostname, partes.port or 80)
+    try:
+        for _ in range(pedidos):
+            items = [{"producto_id": pid, "cantidad": random.randint(1, 3), "extras": "", "obs": ""}
+                     for pid in random.sample(productos, min(len(productos), random.randint(1, 6)))]
+            inicio = time.perf_counter()
+            estado = await post_json(lector, escritor, partes.netloc, "/mesa/bench/pedido", {"items": items})
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            if estado != 201:
+                errores.append(estado)
+    finally:
+        escritor.close()
+
+
+async def correr(args, productos):
+    latencias, errores = [], []
+    inicio = time.perf_counter()
+    await asyncio.gather(*(telefono(args.url, productos, args.pedidos, latencias, errores)
+                           for _ in range(args.telefonos)))
+    duracion = time.perf_counter() - inicio
+
+    percentiles = statistics.quantiles(latencias, n=100)
+    print(f"{len(latencias)} pedidos en {duracion:.2f}s → {len(latencias) / duracion:.1f} pedidos/s")
+    print(f"p50 {percentiles[49]:.1f} ms  p95 {percentiles[94]:.1f} ms  p99 {percentiles[98]:.1f} ms")
+    if errores:
+        print(f"⚠️ {len(errores)} respuestas con error: {sorted(set(errores))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url", help="Base del servicio que recibe /mesa/<mesa>/pedido")
+    parser.add_argument("--catalogo", help="Base de la app Flask para leer /api/productos (por defecto url)")
+    parser.add_argument("--telefonos", type=int, default=200)
+    parser.add_argument("--pedidos", type=int, default=5, help="Pedidos por teléfono")
+    args = parser.parse_args()
+
+    with urllib.request.urlopen(f"{args.catalogo or args.url}/api/productos") as r:
+        productos = [int(p["id"]) for p in json.load(r)["productos"]]
+    asyncio.run(correr(args, productos))
+
+
+if __name__ == "__main__":
+    main()
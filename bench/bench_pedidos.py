@@ -0,0 +1,99 @@
+"""Benchmark de persistencia de pedidos: round-trips y latencia antes/después.
+
+Uso:
+    DATABASE_URL=postgresql://... python bench/bench_pedidos.py [--items 15] [--repeticiones 200]
+
+Cada corrida se hace dentro de una transacción que se descarta con ROLLBACK,
+así no deja datos en la base.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import app
+
+
+class CursorContador(RealDictCursor):
+    """Cuenta cada execute() como un round-trip al servidor"""
+    round_trips = 0
+
+    def execute(self, query, vars=None):
+        CursorContador.round_trips += 1
+        return super().execute(query, vars)
+
+
+def items_de_prueba(n):
+    return [(i, f"Producto {i}", 1 + i % 3, 1000 + i * 250, "lechuga, tomate" if i % 2 else "", "")
+            for i in range(n)]
+
+
+def antes(cur, items):
+    """Camino original: cabecera, una fila por INSERT y UPDATE del total"""
+    cur.execute(
+        "INSERT INTO pedidos (mesa, fecha_hora, estado, total) VALUES (%s, %s, 'PENDIENTE', 0) RETURNING id",
+        ("bench", datetime.now())
+    )
+    pedido_id = cur.fetchone()["id"]
+    total = 0
+    for producto_id, producto, cant, precio, extras, obs in items:
+        total += cant * precio
+        cur.execute("""
+            INSERT INTO pedido_detalle (pedido_id, producto_id, producto, cantidad, precio, extras, observaciones)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (pedido_id, producto_id, producto, cant, precio, extras, obs))
+    cur.execute("UPDATE pedidos SET total=%s WHERE id=%s", (total, pedido_id))
+
+
+def despues(cur, items):
+    """Camino compartido: cabecera con total final y líneas en un solo statement"""
+    app.guardar_con_detalle(cur, "pedidos", {
+        "mesa": "bench",
+        "fecha_hora": datetime.now(),
+        "estado": "PENDIENTE",
+        "total": app.total_items(items),
+    }, "pedido_detalle", "pedido_id", items)
+
+
+def medir(con, fn, items, repeticiones):
+    tiempos = []
+    CursorContador.round_trips = 0
+    for _ in range(repeticiones):
+        cur = con.cursor()
+        inicio = time.perf_counter()
+        fn(cur, items)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        con.rollback()
+    return CursorContador.round_trips / repeticiones, tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=15)
+    parser.add_argument("--repeticiones", type=int, default=200)
+    args = parser.parse_args()
+
+    app.init_db()
+    con = psycopg2.connect(app.DATABASE_URL, cursor_factory=CursorContador)
+    items = items_de_prueba(args.items)
+
+    print(f"Pedido de {args.items} líneas, {args.repeticiones} repeticiones")
+    print(f"{'camino':<8} {'round-trips':>11} {'p50 ms':>8} {'p95 ms':>8}")
+    for nombre, fn in (("antes", antes), ("despues", despues)):
+        medir(con, fn, items, 10)
+        rts, tiempos = medir(con, fn, items, args.repeticiones)
+        p95 = statistics.quantiles(tiempos, n=20)[-1]
+        print(f"{nombre:<8} {rts:>11.0f} {statistics.median(tiempos):>8.2f} {p95:>8.2f}")
+
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
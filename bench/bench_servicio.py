@@ -0,0 +1,189 @@
+"""Prueba de carga de una noche de sábado: cajeros, mozos y clientes QR a la vez contra la app.
+
+Uso (sobre una base sembrada con bench/sembrar.py, todo en la máquina local):
+    DATABASE_URL=postgresql://localhost/facturador_bench gunicorn -c gunicorn.conf.py app:app -b 127.0.0.1:8000
+    python bench/bench_servicio.py http://127.0.0.1:8000 [--cajeros 2] [--mozos 4] [--clientes 30] [--duracion 60]
+
+Cada rol corre en su propio hilo con una conexión keep-alive y una pausa aleatoria entre acciones:
+  - cajero: ventas (GET y POST), pedidos pendientes, confirma el más viejo y revisa el delivery
+  - mozo: abre la carta de una mesa y manda el pedido por formulario
+  - cliente QR: manda el carrito JSON a /mesa/<mesa>/pedido
+  - admin: reportes y exportación CSV del mes
+Al final imprime, por ruta, cantidad, throughput, p50/p95/p99 y errores.
+"""
+import argparse
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+CLAVE = "bench"
+
+
+class Cliente:
+    """Conexión HTTP/1.1 keep-alive con la cookie de sesión de Flask"""
+
+    def __init__(self, url, registro):
+        partes = urlsplit(url)
+        self.host = partes.hostname
+        self.puerto = partes.port or 80
+        self.registro = registro
+        self.cookie = None
+        self.con = http.client.HTTPConnection(self.host, self.puerto, timeout=30)
+
+    def pedir(self, metodo, ruta, etiqueta, cuerpo=None, tipo=None):
+        cabeceras = {}
+        if self.cookie:
+            cabeceras["Cookie"] = self.cookie
+        if tipo:
+            cabeceras["Content-Type"] = tipo
+        inicio = time.perf_counter()
+        try:
+            self.con.request(metodo, ruta, body=cuerpo, headers=cabeceras)
+            resp = self.con.getresponse()
+            datos = resp.read()
+            estado = resp.status
+        except (OSError, http.client.HTTPException):
+            self.con.close()
+            self.con = http.client.HTTPConnection(self.host, self.puerto, timeout=30)
+            datos, estado = b"", 0
+        else:
+            cookie = resp.getheader("Set-Cookie")
+            if cookie:
+                self.cookie = cookie.split(";", 1)[0]
+        self.registro.anotar(f"{metodo} {etiqueta}", time.perf_counter() - inicio, estado)
+        return estado, datos
+
+    def form(self, ruta, etiqueta, campos):
+        return self.pedir("POST", ruta, etiqueta, urlencode(campos), "application/x-www-form-urlencoded")
+
+    def json(self, ruta, etiqueta, datos):
+        return self.pedir("POST", ruta, etiqueta, json.dumps(datos), "application/json")
+
+    def login(self, usuario):
+        estado, _ = self.form("/login", "/login", {"username": usuario, "password": CLAVE})
+        if estado != 302:
+            raise SystemExit(f"❌ No se pudo entrar como {usuario} (¿se corrió bench/sembrar.py?)")
+
+
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.errores = defaultdict(int)
+
+    def anotar(self, ruta, duracion, estado):
+        with self._lock:
+            self.latencias[ruta].append(duracion * 1000)
+            if not 200 <= estado < 400:
+                self.errores[ruta] += 1
+
+    def informe(self, duracion):
+        print(f"{'ruta':<38}{'n':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'err':>6}")
+        total = 0
+        for ruta in sorted(self.latencias):
+            lat = self.latencias[ruta]
+            total += len(lat)
+            p = statistics.quantiles(lat, n=100) if len(lat) > 1 else lat * 99
+            print(f"{ruta:<38}{len(lat):>7}{len(lat) / duracion:>8.1f}"
+                  f"{p[49]:>9.1f}{p[94]:>9.1f}{p[98]:>9.1f}{self.errores[ruta]:>6}")
+        print(f"{total} requests en {duracion:.1f}s → {total / duracion:.1f} req/s (latencias en ms)")
+
+
+def items_form(productos):
+    campos = {}
+    for p in random.sample(productos, min(len(productos), random.randint(1, 5))):
+        campos[f"prod_{p}"] = random.randint(1, 3)
+    return campos
+
+
+def cajero(cli, productos, args, fin):
+    while time.monotonic() < fin:
+        cli.pedir("GET", "/", "/")
+        delivery = random.random() < 0.2
+        campos = items_form(productos)
+        campos.update({"medio_pago": random.choice(["Efectivo", "Transferencia", "Débito"]),
+                       "tipo_pedido": "delivery" if delivery else "mesa",
+                       "direccion_entrega": "Calle 123" if delivery else "",
+                       "estado_pago": "pagado"})
+        cli.form("/", "/", campos)
+
+        estado, datos = cli.pedir("GET", "/api/pedidos/nuevos/detalle", "/api/pedidos/nuevos/detalle")
+        if estado == 200:
+            pendientes = json.loads(datos)["pedidos"]
+            if pendientes:
+                cli.pedir("GET", "/pedidos", "/pedidos")
+                cli.pedir("GET", f"/pedidos/confirmar/{pendientes[0]['id']}", "/pedidos/confirmar/<id>")
+        if random.random() < 0.3:
+            cli.pedir("GET", "/delivery", "/delivery")
+        time.sleep(random.uniform(0, args.pausa))
+
+
+def mozo(cli, productos, args, fin):
+    while time.monotonic() < fin:
+        mesa = random.randint(1, 20)
+        cli.pedir("GET", f"/mesa/{mesa}", "/mesa/<mesa>")
+        cli.form(f"/mesa/{mesa}", "/mesa/<mesa>", items_form(productos))
+        time.sleep(random.uniform(0, args.pausa))
+
+
+def cliente_qr(cli, productos, args, fin):
+    while time.monotonic() < fin:
+        items = [{"producto_id": p, "cantidad": random.randint(1, 3), "extras": "", "obs": ""}
+                 for p in random.sample(productos, min(len(productos), random.randint(1, 6)))]
+        cli.json(f"/mesa/{random.randint(1, 20)}/pedido", "/mesa/<mesa>/pedido", {"items": items})
+        time.sleep(random.uniform(0, args.pausa * 3))
+
+
+def admin(cli, productos, args, fin):
+    while time.monotonic() < fin:
+        cli.pedir("GET", "/reportes", "/reportes")
+        cli.pedir("GET", "/reportes/exportar/mes", "/reportes/exportar/<tipo>")
+        time.sleep(random.uniform(0, args.pausa * 5))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url", help="Base de la app Flask, ej: http://127.0.0.1:8000")
+    parser.add_argument("--cajeros", type=int, default=2)
+    parser.add_argument("--mozos", type=int, default=4)
+    parser.add_argument("--clientes", type=int, default=30, help="Teléfonos pidiendo por QR")
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--duracion", type=float, default=60, help="Segundos de carga")
+    parser.add_argument("--pausa", type=float, default=1.0, help="Pausa máxima entre acciones (s)")
+    args = parser.parse_args()
+
+    registro = Registro()
+    estado, datos = Cliente(args.url, Registro()).pedir("GET", "/api/productos", "/api/productos")
+    productos = [int(p["id"]) for p in json.loads(datos)["productos"] if p["precio"] > 0] if estado == 200 else []
+    if not productos:
+        raise SystemExit("❌ El catálogo está vacío (¿se corrió bench/sembrar.py?)")
+
+    # Los logins se hacen antes de arrancar el reloj y no cuentan en el informe
+    roles = []
+    for rol, cantidad, usuario in ((cajero, args.cajeros, "bench_caja"), (mozo, args.mozos, None),
+                                   (cliente_qr, args.clientes, None), (admin, args.admins, "bench_admin")):
+        for _ in range(cantidad):
+            cli = Cliente(args.url, Registro())
+            if usuario:
+                cli.login(usuario)
+            cli.registro = registro
+            roles.append((rol, cli))
+
+    fin = time.monotonic() + args.duracion
+    hilos = [threading.Thread(target=rol, args=(cli, productos, args, fin)) for rol, cli in roles]
+
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    registro.informe(time.perf_counter() - inicio)
+
+
+if __name__ == "__main__":
+    main()
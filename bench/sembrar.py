@@ -0,0 +1,157 @@
+"""Siembra una base local con un historial realista para las pruebas de carga.
+
+Uso:
+    createdb facturador_bench
+    DATABASE_URL=postgresql://localhost/facturador_bench python bench/sembrar.py [--meses 6] [--ventas-por-dia 250]
+
+Crea el esquema con init_db(), carga el catálogo de cargar_productos_pg.py, un turno cerrado
+por día con sus ventas y detalle (noches de 19 a 2 hs), el turno de hoy abierto y los usuarios
+bench_caja / bench_admin (contraseña "bench"). Todo se genera del lado del servidor con
+generate_series: no hace falta red, sólo un Postgres local.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from hashlib import sha256
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import app
+
+USUARIOS = (("bench_caja", "caja"), ("bench_admin", "admin"))
+CLAVE = "bench"
+TABLAS = ("comanda_items", "detalle_venta", "ventas", "pedido_detalle", "pedidos", "turno_resumen",
+          "turnos", "ventas_diarias", "productos_diarios")
+
+
+def paso(texto):
+    print(f"⏱️ {texto}...", end=" ", flush=True)
+    return time.perf_counter()
+
+
+def listo(inicio):
+    print(f"{time.perf_counter() - inicio:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--meses", type=int, default=6, help="Meses de historial (un turno por día)")
+    parser.add_argument("--ventas-por-dia", type=int, default=250)
+    parser.add_argument("--limpiar", action="store_true",
+                        help="Vaciar ventas, pedidos, turnos y resúmenes si la base ya tiene datos")
+    args = parser.parse_args()
+
+    app.init_db()
+
+    with app.conexion_directa() as con:
+        cur = con.cursor()
+        cur.execute("SELECT EXISTS (SELECT 1 FROM ventas) OR EXISTS (SELECT 1 FROM turnos) AS hay")
+        if cur.fetchone()["hay"]:
+            if not args.limpiar:
+                sys.exit("❌ La base ya tiene ventas o turnos. Usar --limpiar para vaciarla (sólo en una base de prueba)")
+            cur.execute(f"TRUNCATE {', '.join(TABLAS)} RESTART IDENTITY")
+
+        inicio = paso("Catálogo")
+        subprocess.run([sys.executable, os.path.join(RAIZ, "cargar_productos_pg.py")], check=True,
+                       stdout=subprocess.DEVNULL)
+        listo(inicio)
+
+        for usuario, rol in USUARIOS:
+            cur.execute("""
+                INSERT INTO usuarios (username, password, rol, activo) VALUES (%s, %s, %s, TRUE)
+                ON CONFLICT (username) DO UPDATE SET password = EXCLUDED.password, rol = EXCLUDED.rol, activo = TRUE
+            """, (usuario, sha256(CLAVE.encode()).hexdigest(), rol))
+
+        dias = args.meses * 30
+        inicio = paso(f"{dias} turnos")
+        cur.execute("""
+            INSERT INTO turnos (fecha, estado, total, usuario_apertura)
+            SELECT CURRENT_DATE - d, CASE WHEN d = 0 THEN 'ABIERTO' ELSE 'CERRADO' END, 0, 'bench_caja'
+            FROM generate_series(%s, 0, -1) AS d
+        """, (dias,))
+        listo(inicio)
+
+        # Sábados con el doble de movimiento; ~15% delivery y ~3% eliminadas
+        inicio = paso(f"~{dias * args.ventas_por_dia} ventas")
+        cur.execute("""
+            INSERT INTO ventas (turno_id, medio_pago, total, estado, usuario, fecha_hora, tipo_pedido,
+                                direccion_entrega, estado_pago, estado_delivery, pago_recibido, vuelto, reposicion)
+            SELECT t.id,
+                   (ARRAY['Efectivo', 'Transferencia', 'Débito', 'Crédito'])[1 + floor(random() * 4)::int],
+                   0,
+                   CASE WHEN random() < 0.03 THEN 'ELIMINADA' ELSE 'OK' END,
+                   'bench_caja',
+                   t.fecha + TIME '19:00' + random() * INTERVAL '7 hours',
+                   x.tipo,
+                   CASE WHEN x.tipo = 'delivery' THEN 'Calle ' || (1 + floor(random() * 3000))::int ELSE '' END,
+                   'pagado',
+                   CASE WHEN x.tipo <> 'delivery' THEN 'no_aplica'
+                        WHEN t.estado = 'ABIERTO' THEN (ARRAY['listo', 'enviado', 'finalizado'])[1 + floor(random() * 3)::int]
+                        ELSE 'finalizado' END,
+                   0, 0, FALSE
+            FROM turnos t
+            CROSS JOIN LATERAL generate_series(1, %s * CASE WHEN extract(isodow FROM t.fecha) = 6 THEN 2 ELSE 1 END) AS n
+            CROSS JOIN LATERAL (SELECT CASE WHEN random() < 0.15 THEN 'delivery'
+                                            WHEN random() < 0.2 THEN 'retiro' ELSE 'mesa' END AS tipo
+                                WHERE n > 0) AS x
+            ORDER BY 6
+        """, (args.ventas_por_dia,))
+        listo(inicio)
+
+        inicio = paso("Detalle de ventas")
+        cur.execute("""
+            INSERT INTO detalle_venta (venta_id, producto_id, producto, cantidad, precio, extras, observaciones)
+            SELECT v.id, p.id, p.nombre, 1 + floor(random() * 3)::int, p.precio, '', ''
+            FROM ventas v
+            CROSS JOIN LATERAL (
+                SELECT id, nombre, precio FROM productos
+                WHERE v.id IS NOT NULL
+                ORDER BY random()
+                LIMIT 1 + v.id % 4
+            ) AS p
+        """)
+        cur.execute("""
+            UPDATE ventas v SET total = d.total
+            FROM (SELECT venta_id, SUM(cantidad * precio) AS total FROM detalle_venta GROUP BY venta_id) d
+            WHERE d.venta_id = v.id
+        """)
+        cur.execute("""
+            UPDATE turnos t SET total = s.total
+            FROM (SELECT turno_id, SUM(total) AS total FROM ventas WHERE estado = 'OK' GROUP BY turno_id) s
+            WHERE s.turno_id = t.id AND t.estado = 'CERRADO'
+        """)
+        listo(inicio)
+
+        inicio = paso("Resumen diario")
+        app.reconstruir_resumen_diario(cur)
+        listo(inicio)
+
+        # El mismo snapshot que guarda cerrar_turno (guardar_resumen_turno), para todos los turnos
+        # cerrados en una sentencia: /turnos/<id>/cierre lee de acá
+        inicio = paso("Resumen de turnos cerrados")
+        cur.execute("""
+            INSERT INTO turno_resumen (turno_id, producto_id, producto, cantidad, total)
+            SELECT v.turno_id, COALESCE(dv.producto_id, 0), COALESCE(MAX(d.nombre), MAX(dv.producto), ''),
+                   SUM(dv.cantidad), SUM(dv.cantidad * dv.precio)
+            FROM ventas v
+            JOIN turnos t ON t.id = v.turno_id AND t.estado = 'CERRADO'
+            JOIN detalle_venta dv ON dv.venta_id = v.id
+            LEFT JOIN producto_dim d ON d.id = dv.producto_id
+            WHERE v.estado = 'OK'
+            GROUP BY v.turno_id, COALESCE(dv.producto_id, 0)
+        """)
+        listo(inicio)
+
+    with app.conexion_directa(autocommit=True) as con:
+        inicio = paso("ANALYZE")
+        con.cursor().execute("ANALYZE")
+        listo(inicio)
+
+    print(f"✅ Base sembrada. Usuarios: {', '.join(u for u, _ in USUARIOS)} / {CLAVE}")
+
+
+if __name__ == "__main__":
+    main()
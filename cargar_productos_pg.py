@@ -1,13 +1,21 @@
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+"""Sincroniza la tabla productos con el menú de la casa (o con un CSV/JSON) sin cambiar ids.
+
+Uso:
+    DATABASE_URL=... python cargar_productos_pg.py [menu.csv | menu.json] [--sin-bajas] [--simular]
 
-DATABASE_URL = os.environ.get("DATABASE_URL")
+Sin archivo se carga MENU. Es lo mismo que `flask --app app importar-catalogo <archivo>`: altas, cambios
+y bajas en una sola transacción, y los productos que siguen en el menú conservan su id (carritos de la
+PWA y formularios abiertos siguen siendo válidos).
+"""
+import argparse
+import os
 
-if not DATABASE_URL:
+if not os.environ.get("DATABASE_URL"):
     raise RuntimeError("DATABASE_URL no definida")
 
-productos = [
+import app
+
+MENU = [
 
     # ================= SÁNDWICHES =================
     ("Milanesa de Carne Común", 6500, "Sandwiches", "sanguche"),
@@ -37,19 +45,23 @@ productos = [
     ("Agua", 2500, "Bebidas", "normal"),
 ]
 
-con = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-cur = con.cursor()
 
-print("🗑️ Borrando productos...")
-cur.execute("DELETE FROM productos")
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("archivo", nargs="?", help="Menú en CSV (nombre,precio,categoria,tipo[,id]) o JSON")
+    parser.add_argument("--sin-bajas", action="store_true", help="No borrar los productos que no están en el menú")
+    parser.add_argument("--simular", action="store_true", help="Mostrar los cambios sin aplicarlos")
+    args = parser.parse_args()
 
-print("📦 Cargando productos...")
-cur.executemany("""
-    INSERT INTO productos (nombre, precio, categoria, tipo)
-    VALUES (%s, %s, %s, %s)
-""", productos)
+    try:
+        if args.archivo:
+            productos = app.leer_menu(args.archivo)
+        else:
+            productos = app.validar_menu([dict(zip(("nombre", "precio", "categoria", "tipo"), p)) for p in MENU])
+        app.importar_catalogo(productos, bajas=not args.sin_bajas, simular=args.simular)
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
 
-con.commit()
-con.close()
 
-print("✅ Productos cargados correctamente")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# Configuración de gunicorn (se carga sola al correr gunicorn desde este directorio)
+import os
+
+# Hilos por worker: cada stream SSE (/api/pedidos/stream, /api/cocina/<estacion>/stream) ocupa uno
+# mientras está abierto. app.py deja entrar hasta SSE_MAX_CLIENTES streams por worker (por defecto
+# la mitad de GUNICORN_THREADS) y el resto queda para los requests comunes. Con más pantallas en
+# vivo que eso, subir GUNICORN_THREADS o la cantidad de workers
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+
+
+def on_starting(server):
+    """Crea tablas y aplica migraciones una sola vez, en el master, antes de levantar los workers"""
+    from app import init_db
+    init_db()
@@ -0,0 +1,174 @@
+"""Recepción asíncrona de pedidos QR: POST /mesa/<mesa>/pedido con un carrito JSON.
+
+Aplicación ASGI sin framework, con pool asyncpg. Un solo proceso atiende cientos de
+teléfonos a la vez sin ocupar un worker de gunicorn por pedido. Correr con:
+
+    uvicorn intake:app --host 0.0.0.0 --port 8001
+
+y enrutar en el proxy /mesa/*/pedido a este servicio (el resto sigue en gunicorn).
+Si no está desplegado, la misma ruta la atiende app.mesa_pedido() en forma síncrona.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+import asyncpg
+
+import app as facturador
+
+INTAKE_POOL_MIN = int(os.environ.get("INTAKE_POOL_MIN", 2))
+INTAKE_POOL_MAX = int(os.environ.get("INTAKE_POOL_MAX", 10))
+CUERPO_MAXIMO = 64 * 1024
+
+RUTA_PEDIDO = re.compile(r"^/mesa/([^/]+)/pedido$")
+
+# Cabecera y líneas en un solo round-trip; las líneas llegan como arrays paralelos
+INSERTAR_PEDIDO = """
+    WITH cab AS (
+        INSERT INTO pedidos (mesa, fecha_hora, estado, total)
+        VALUES ($1, $2, 'PENDIENTE', $3)
+        RETURNING id
+    ),
+    det AS (
+        INSERT INTO pedido_detalle (pedido_id, producto_id, producto, cantidad, precio, extras, observaciones)
+        SELECT cab.id, d.producto_id, d.producto, d.cantidad, d.precio, d.extras, d.observaciones
+        FROM cab, unnest($4::int[], $5::text[], $6::int[], $7::int[], $8::text[], $9::text[])
+             AS d(producto_id, producto, cantidad, precio, extras, observaciones)
+    )
+    SELECT id FROM cab
+"""
+
+
+class CatalogoAsync:
+    """Mismo catálogo que app.CatalogoCache, invalidado por el NOTIFY 'catalogo' sobre una conexión asyncpg"""
+
+    def __init__(self):
+        self.datos = None
+        self.verificado = 0.0
+        self.escuchando = False
+
+    def invalidar(self, *args):
+        self.datos = None
+
+    def sin_escucha(self, *args):
+        self.escuchando = False
+        self.datos = None
+
+    async def obtener(self, pool):
+        datos = self.datos
+        if datos is not None and (self.escuchando or time.monotonic() - self.verificado < facturador.CATALOGO_TTL):
+            return datos
+
+        async with pool.acquire() as con:
+            version = await con.fetchval("SELECT version FROM catalogo_version WHERE id=1")
+            if datos is None or datos["version"] != version:
+                filas = await con.fetch("SELECT * FROM productos ORDER BY categoria, nombre")
+                datos = facturador.armar_catalogo(version, filas)
+        self.datos = datos
+        self.verificado = time.monotonic()
+        return datos
+
+
+class Intake:
+    def __init__(self):
+        self.pool = None
+        self.escucha = None
+        self.catalogo = CatalogoAsync()
+
+    async def iniciar(self):
+        self.pool = await asyncpg.create_pool(facturador.DATABASE_URL,
+                                              min_size=INTAKE_POOL_MIN, max_size=INTAKE_POOL_MAX)
+        self.escucha = await asyncpg.connect(facturador.DATABASE_URL)
+        await self.escucha.add_listener("catalogo", self.catalogo.invalidar)
+        self.escucha.add_termination_listener(self.catalogo.sin_escucha)
+        self.catalogo.escuchando = True
+
+    async def cerrar(self):
+        if self.escucha is not None:
+            await self.escucha.close()
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        ruta = RUTA_PEDIDO.match(scope["path"])
+        if not ruta:
+            await responder(send, 404, {"error": "No encontrado"})
+            return
+        if scope["method"] != "POST":
+            await responder(send, 405, {"error": "Método no permitido"})
+            return
+
+        cuerpo = await leer_cuerpo(receive)
+        if cuerpo is None:
+            await responder(send, 413, {"error": "Pedido demasiado grande"})
+            return
+
+        try:
+            mesa = facturador.validar_mesa(ruta.group(1))
+            datos = json.loads(cuerpo or b"{}")
+            carrito = datos.get("items") if isinstance(datos, dict) else None
+            items = facturador.items_desde_carrito(await self.catalogo.obtener(self.pool), carrito)
+            total = facturador.total_items(items)
+            producto_id, producto, cantidad, precio, extras, observaciones = (list(c) for c in zip(*items))
+            pedido_id = await self.pool.fetchval(INSERTAR_PEDIDO, mesa, datetime.now(), total,
+                                                 producto_id, producto, cantidad, precio, extras, observaciones)
+        except ValueError as e:
+            await responder(send, 400, {"error": str(e)})
+            return
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError):
+            # Base caída, pool agotado o conexión cortada: el teléfono reintenta, no recibe un 500 sin cuerpo
+            await responder(send, 503, {"error": "No se pudo registrar el pedido, probá de nuevo en un momento"})
+            return
+        await responder(send, 201, {"pedido_id": pedido_id, "total": total})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "lifespan.startup":
+                try:
+                    await self.iniciar()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif mensaje["type"] == "lifespan.shutdown":
+                await self.cerrar()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def leer_cuerpo(receive):
+    """Cuerpo completo del request, o None si supera CUERPO_MAXIMO"""
+    partes = []
+    tamanio = 0
+    while True:
+        mensaje = await receive()
+        parte = mensaje.get("body", b"")
+        tamanio += len(parte)
+        if tamanio > CUERPO_MAXIMO:
+            return None
+        partes.append(parte)
+        if not mensaje.get("more_body"):
+            return b"".join(partes)
+
+
+async def responder(send, estado, datos):
+    cuerpo = json.dumps(datos).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": estado,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(cuerpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+app = Intake()
@@ -7,6 +7,7 @@ let mesaActual = null;
 let productos = [];
 let categorias = [];
 let carrito = [];
+let claveEnvio = null;
 
 // ===== ELEMENTOS DEL DOM =====
 const viewMesas = document.getElementById('viewMesas');
@@ -25,6 +26,8 @@ const modalMesa = document.getElementById('modalMesa');
 const modalTotal = document.getElementById('modalTotal');
 const btnNuevoPedido = document.getElementById('btnNuevoPedido');
 const loading = document.getElementById('loading');
+const modalTitulo = document.getElementById('modalTitulo');
+const pendientesBadge = document.getElementById('pendientesBadge');
 
 // ===== REGISTRO DEL SERVICE WORKER =====
 if ('serviceWorker' in navigator) {
@@ -33,6 +36,12 @@ if ('serviceWorker' in navigator) {
             .then(reg => console.log('✅ Service Worker registrado'))
             .catch(err => console.log('❌ Error al registrar SW:', err));
     });
+    // El service worker avisa cuando el reenvío en segundo plano tuvo pedidos rechazados
+    navigator.serviceWorker.addEventListener('message', event => {
+        if (event.data && event.data.tipo === 'pedidos-rechazados') {
+            mostrarRechazados();
+        }
+    });
 }
 
 // ===== INICIALIZACIÓN =====
@@ -40,6 +49,7 @@ document.addEventListener('DOMContentLoaded', () => {
     console.log('🚀 Iniciando PWA...');
     inicializarMesas();
     cargarProductos();
+    reenviarPendientes();
     
     btnVolver.addEventListener('click', volverAMesas);
     btnEnviar.addEventListener('click', enviarPedido);
@@ -357,39 +367,49 @@ function actualizarFooter() {
 }
 
 // ===== ENVIAR PEDIDO =====
+function nuevaClave() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+}
+
 async function enviarPedido() {
     if (carrito.length === 0 || !mesaActual) return;
     
     loading.classList.add('show');
     
+    // La clave identifica al pedido en la cola y en el servidor: un reintento no lo duplica
+    if (!claveEnvio) {
+        claveEnvio = nuevaClave();
+    }
+    
+    const pedido = {
+        clave: claveEnvio,
+        mesa: mesaActual,
+        creado: Date.now(),
+        total: carrito.reduce((sum, item) => sum + (item.precio * item.cantidad), 0),
+        items: carrito.map(item => ({
+            producto_id: parseInt(item.id),
+            cantidad: item.cantidad,
+            extras: (item.extras || []).join(', '),
+            obs: item.observaciones || ''
+        }))
+    };
+    
     try {
-        const formData = new FormData();
-        
-        productos.forEach(producto => {
-            const itemCarrito = carrito.find(item => item.id === producto.id);
-            const cantidad = itemCarrito ? itemCarrito.cantidad : 0;
-            formData.append(`prod_${producto.id}`, cantidad);
-            
-            if (itemCarrito && cantidad > 0) {
-                if (itemCarrito.extras && itemCarrito.extras.length > 0) {
-                    formData.append(`extras_${producto.id}`, itemCarrito.extras.join(', '));
-                }
-                
-                if (itemCarrito.observaciones) {
-                    formData.append(`obs_${producto.id}`, itemCarrito.observaciones);
-                }
-            }
-        });
+        await colaGuardar(pedido);
+        const resultado = await colaEnviar(pedido);
         
-        const response = await fetch(`${API_URL}/mesa/${mesaActual}`, {
-            method: 'POST',
-            body: formData
-        });
-        
-        if (response.ok) {
-            mostrarConfirmacion();
+        if (resultado.estado === 'enviado') {
+            mostrarConfirmacion(resultado.data.total);
+        } else if (resultado.estado === 'rechazado') {
+            await colaQuitar(pedido.clave);
+            alert(`El pedido fue rechazado: ${resultado.error}`);
         } else {
-            throw new Error('Error al enviar pedido');
+            // Sin red o muy lenta: queda en la cola y se envía solo al volver la conexión
+            programarReenvio();
+            mostrarConfirmacion(pedido.total, true);
         }
         
     } catch (error) {
@@ -397,12 +417,71 @@ async function enviarPedido() {
         alert('Error al enviar el pedido. Por favor, intenta de nuevo.');
     } finally {
         loading.classList.remove('show');
+        actualizarPendientes();
     }
 }
 
-function mostrarConfirmacion() {
-    const totalPrecio = carrito.reduce((sum, item) => sum + (item.precio * item.cantidad), 0);
-    
+// ===== REENVÍO DE PEDIDOS EN COLA =====
+function programarReenvio() {
+    if ('serviceWorker' in navigator && 'SyncManager' in window) {
+        navigator.serviceWorker.ready
+            .then(reg => reg.sync.register(COLA_SYNC_TAG))
+            .catch(err => console.log('Background Sync no disponible:', err));
+    }
+}
+
+let reenviando = false;
+async function reenviarPendientes() {
+    if (reenviando) return;
+    reenviando = true;
+    try {
+        await colaVaciar();
+    } catch (error) {
+        console.log('Error reenviando pedidos:', error);
+    } finally {
+        reenviando = false;
+        actualizarPendientes();
+        mostrarRechazados();
+    }
+}
+
+// Pedidos que el mozo vio "en cola" y el servidor rechazó (por ejemplo, un producto dado de baja).
+// Se borran de IndexedDB recién después de mostrarlos, así no se pierden si no había pantalla abierta
+let mostrandoRechazados = false;
+async function mostrarRechazados() {
+    if (mostrandoRechazados) return;
+    mostrandoRechazados = true;
+    try {
+        const rechazados = (await colaRechazados()).sort((a, b) => a.creado - b.creado);
+        for (const pedido of rechazados) {
+            const hora = new Date(pedido.creado).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+            alert(`⚠️ El pedido de Mesa ${pedido.mesa} (${hora}, $${pedido.total}) que quedó en cola fue rechazado: ` +
+                  `${pedido.error}\nHay que volver a cargarlo.`);
+            await colaQuitar(pedido.clave);
+        }
+    } catch (error) {
+        console.log('No se pudieron leer los pedidos rechazados:', error);
+    } finally {
+        mostrandoRechazados = false;
+    }
+}
+
+async function actualizarPendientes() {
+    try {
+        const pendientes = (await colaPendientes()).length;
+        pendientesBadge.textContent = `📶 ${pendientes} en cola`;
+        pendientesBadge.style.display = pendientes > 0 ? 'inline-block' : 'none';
+    } catch (error) {
+        console.log('No se pudo leer la cola:', error);
+    }
+}
+
+window.addEventListener('online', reenviarPendientes);
+// Respaldo para navegadores sin Background Sync
+setInterval(reenviarPendientes, 30000);
+
+function mostrarConfirmacion(totalPrecio, enCola) {
+    modalTitulo.textContent = enCola ? '📶 Pedido en cola' : '¡Pedido Enviado!';
     modalMesa.textContent = mesaActual;
     modalTotal.textContent = `$${totalPrecio}`;
     modalConfirmacion.classList.add('show');
@@ -427,6 +506,7 @@ function mostrarVista(vista) {
 function resetearApp() {
     mesaActual = null;
     carrito = [];
+    claveEnvio = null;
     mesaBadge.style.display = 'none';
     btnVolver.style.display = 'none';
     footerCarrito.style.display = 'none';
@@ -0,0 +1,97 @@
+// ===== COLA DE PEDIDOS OFFLINE =====
+// Compartida por la página (app.js) y el service worker (sw.js, vía importScripts).
+// Cada pedido se guarda en IndexedDB con su clave antes de enviarse; la clave viaja como
+// Idempotency-Key, así el servidor descarta los reenvíos de un pedido que ya recibió.
+const COLA_DB = 'lavespucio-pedidos';
+const COLA_STORE = 'pendientes';
+const COLA_SYNC_TAG = 'enviar-pedidos';
+const COLA_TIMEOUT_MS = 4000;
+
+function colaAbrir() {
+    return new Promise((resolve, reject) => {
+        const req = indexedDB.open(COLA_DB, 1);
+        req.onupgradeneeded = () => req.result.createObjectStore(COLA_STORE, { keyPath: 'clave' });
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => reject(req.error);
+    });
+}
+
+async function colaOperacion(modo, operacion) {
+    const db = await colaAbrir();
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(COLA_STORE, modo);
+        const req = operacion(tx.objectStore(COLA_STORE));
+        tx.oncomplete = () => { db.close(); resolve(req.result); };
+        tx.onerror = () => { db.close(); reject(tx.error); };
+    });
+}
+
+function colaGuardar(pedido) {
+    return colaOperacion('readwrite', store => store.put(pedido));
+}
+
+function colaQuitar(clave) {
+    return colaOperacion('readwrite', store => store.delete(clave));
+}
+
+function colaListar() {
+    return colaOperacion('readonly', store => store.getAll());
+}
+
+async function colaPendientes() {
+    return (await colaListar()).filter(p => !p.rechazado);
+}
+
+async function colaRechazados() {
+    return (await colaListar()).filter(p => p.rechazado);
+}
+
+// Devuelve {estado: 'enviado' | 'rechazado' | 'pendiente'}. Un 4xx es un pedido inválido y
+// reintentarlo trabaría a los que vienen detrás: sale de la cola pero queda guardado como
+// rechazado hasta que app.js se lo muestra al mozo (el reenvío puede correr en el service worker).
+async function colaEnviar(pedido, timeoutMs) {
+    const control = new AbortController();
+    const timer = setTimeout(() => control.abort(), timeoutMs || COLA_TIMEOUT_MS);
+    
+    try {
+        const response = await fetch('/api/pedidos', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Idempotency-Key': pedido.clave
+            },
+            body: JSON.stringify({ mesa: pedido.mesa, items: pedido.items }),
+            signal: control.signal
+        });
+        
+        if (response.ok) {
+            await colaQuitar(pedido.clave);
+            return { estado: 'enviado', data: await response.json() };
+        }
+        if (response.status < 500) {
+            const data = await response.json().catch(() => ({}));
+            const error = data.error || `HTTP ${response.status}`;
+            await colaGuardar({ ...pedido, rechazado: true, error });
+            return { estado: 'rechazado', error };
+        }
+        return { estado: 'pendiente' };
+        
+    } catch (error) {
+        return { estado: 'pendiente' };
+    } finally {
+        clearTimeout(timer);
+    }
+}
+
+// Reenvía en orden los pedidos guardados; corta en el primero que sigue sin red
+async function colaVaciar() {
+    const resultados = [];
+    const pendientes = (await colaPendientes()).sort((a, b) => a.creado - b.creado);
+    
+    for (const pedido of pendientes) {
+        const resultado = await colaEnviar(pedido, 10000);
+        if (resultado.estado === 'pendiente') break;
+        resultados.push({ pedido, ...resultado });
+    }
+    return resultados;
+}
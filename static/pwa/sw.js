@@ -1,10 +1,12 @@
-const CACHE_NAME = 'lavespucio-v1';
+importScripts('./cola.js');
+
+const CACHE_NAME = 'lavespucio-v3';
 const urlsToCache = [
-  '/',
-  '/index.html',
-  '/app.js',
-  '/manifest.json',
-  '/icon-192.png'
+  './',
+  './index.html',
+  './app.js',
+  './cola.js',
+  './manifest.json'
 ];
 
 // Instalación - cachear recursos
@@ -39,8 +41,36 @@ self.addEventListener('activate', event => {
   self.clients.claim();
 });
 
+// Background Sync - reenviar los pedidos que quedaron en la cola offline
+self.addEventListener('sync', event => {
+  if (event.tag === COLA_SYNC_TAG) {
+    event.waitUntil(
+      colaVaciar()
+        .then(async resultados => {
+          // Los rechazados quedan guardados; si hay una pestaña abierta se le avisa para mostrarlos ya
+          if (resultados.some(r => r.estado === 'rechazado')) {
+            const clientes = await self.clients.matchAll({ type: 'window' });
+            clientes.forEach(cliente => cliente.postMessage({ tipo: 'pedidos-rechazados' }));
+          }
+          return colaPendientes();
+        })
+        .then(pendientes => {
+          // Si sigue habiendo pedidos, fallar hace que el navegador reintente el sync más tarde
+          if (pendientes.length > 0) {
+            throw new Error(`${pendientes.length} pedidos siguen en cola`);
+          }
+        })
+    );
+  }
+});
+
 // Fetch - estrategia Network First con Cache Fallback
 self.addEventListener('fetch', event => {
+  // Los POST (pedidos) van directo a la red: la cola offline se encarga de los reintentos
+  if (event.request.method !== 'GET') {
+    return;
+  }
+
   event.respondWith(
     fetch(event.request)
       .then(response => {
@@ -0,0 +1,78 @@
+"""Piezas comunes de los tests: la app se importa sin base real (get_db se reemplaza por una
+conexión falsa que anota cada consulta) y un cliente ya logueado"""
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "postgresql://test/test")
+
+import app as aplicacion  # noqa: E402
+
+
+class CursorFalso:
+    """Guarda cada consulta (SQL en una línea, parámetros) y devuelve las filas que arme responder(sql, params)"""
+
+    def __init__(self, responder=None):
+        self.responder = responder or (lambda sql, params: [])
+        self.consultas = []
+        self.rowcount = 0
+        self._filas = []
+
+    def execute(self, query, vars=None):
+        sql = " ".join(query.split())
+        self.consultas.append((sql, vars))
+        self._filas = [dict(fila) for fila in self.responder(sql, vars) or []]
+        self.rowcount = len(self._filas)
+
+    def fetchall(self):
+        return self._filas
+
+    def fetchone(self):
+        return self._filas[0] if self._filas else None
+
+    def ejecutadas(self, fragmento):
+        return [(sql, params) for sql, params in self.consultas if fragmento in sql]
+
+
+class ConexionFalsa:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def base_falsa(monkeypatch):
+    """base_falsa(responder) reemplaza get_db por una conexión con un CursorFalso y devuelve el cursor"""
+    def instalar(responder=None):
+        cur = CursorFalso(responder)
+
+        @contextmanager
+        def get_db():
+            yield ConexionFalsa(cur)
+
+        monkeypatch.setattr(aplicacion, "get_db", get_db)
+        return cur
+    return instalar
+
+
+@pytest.fixture
+def cliente():
+    aplicacion.app.config["TESTING"] = True
+    with aplicacion.app.test_client() as cliente:
+        with cliente.session_transaction() as sesion:
+            sesion["user_id"] = 1
+            sesion["username"] = "test"
+            sesion["rol"] = "admin"
+        yield cliente
@@ -0,0 +1,91 @@
+"""Validación del menú a importar y cache de fragmentos del catálogo"""
+import sys
+
+import pytest
+from markupsafe import Markup
+
+import app as aplicacion
+
+
+def test_validar_menu_normaliza():
+    productos = aplicacion.validar_menu([
+        {"nombre": " Muzzarella ", "precio": "9000", "categoria": "Pizzas"},
+        {"id": "12", "nombre": "Coca", "precio": 2500, "categoria": "Bebidas", "tipo": "normal"},
+    ])
+    assert productos == [(None, "Muzzarella", 9000, "Pizzas", "normal"),
+                         (12, "Coca", 2500, "Bebidas", "normal")]
+
+
+@pytest.mark.parametrize("filas, mensaje", [
+    ([], "no vacía"),
+    ({"nombre": "Coca"}, "no vacía"),
+    (["Coca"], "Fila 1: se esperaba un producto"),
+    ([{"nombre": "Coca", "precio": "barato", "categoria": "Bebidas"}], "Fila 1: precio o id inválido"),
+    ([{"nombre": "Coca", "precio": 10, "categoria": "Bebidas", "id": "x"}], "Fila 1: precio o id inválido"),
+    ([{"nombre": "", "precio": 10, "categoria": "Bebidas"}], "Fila 1: faltan el nombre o la categoría"),
+    ([{"nombre": "Coca", "precio": -1, "categoria": "Bebidas"}], "Fila 1: precio negativo"),
+    ([{"nombre": "Coca", "precio": 10, "categoria": "Bebidas"},
+      {"nombre": "Coca", "precio": 12, "categoria": "Bebidas"}], "Fila 2: Coca está repetido"),
+    ([{"id": 3, "nombre": "Coca", "precio": 10, "categoria": "Bebidas"},
+      {"id": 3, "nombre": "Sprite", "precio": 10, "categoria": "Bebidas"}], "Fila 2: el id 3 está repetido"),
+])
+def test_validar_menu_rechaza(filas, mensaje):
+    with pytest.raises(ValueError, match=mensaje):
+        aplicacion.validar_menu(filas)
+
+
+def test_fragmentos_lru_por_bytes():
+    tamanio = sys.getsizeof(Markup("x" * 100))
+    cache = aplicacion.CacheFragmentos(max_bytes=2 * tamanio)
+    cache.obtener("a", lambda: "a" * 100)
+    cache.obtener("b", lambda: "b" * 100)
+    cache.obtener("a", lambda: "no se vuelve a renderizar")  # "a" pasa a ser el más reciente
+    cache.obtener("c", lambda: "c" * 100)                    # no entra: se descarta "b"
+
+    renderizados = []
+    assert cache.obtener("a", lambda: renderizados.append("a") or "") == "a" * 100
+    cache.obtener("b", lambda: renderizados.append("b") or "b" * 100)
+    assert renderizados == ["b"]
+
+    est = cache.estadisticas()
+    assert est["descartes"] == 2 and est["fragmentos"] == 2 and est["bytes"] <= est["max_bytes"]
+
+
+def test_fragmento_mas_grande_que_el_cache_no_se_guarda():
+    cache = aplicacion.CacheFragmentos(max_bytes=10)
+    assert cache.obtener("a", lambda: "x" * 100) == "x" * 100
+    assert cache.estadisticas()["fragmentos"] == 0
+
+
+def test_grilla_se_renderiza_una_vez_por_version(monkeypatch):
+    monkeypatch.setattr(aplicacion, "fragmentos", aplicacion.CacheFragmentos(max_bytes=1 << 20))
+    renders = []
+    monkeypatch.setattr(aplicacion, "render_template",
+                        lambda plantilla, **ctx: renders.append(ctx["categorias"]) or f"<div>{len(renders)}</div>")
+
+    v1 = {"version": 1, "menu": ["pizzas"]}
+    v2 = {"version": 2, "menu": ["pizzas", "empanadas"]}
+    primera = aplicacion.grilla_productos("fragmentos/grilla.html", v1, "menu")
+    assert aplicacion.grilla_productos("fragmentos/grilla.html", v1, "menu") == primera
+    # Versión nueva del catálogo: otra clave, se vuelve a renderizar sin invalidar nada
+    assert aplicacion.grilla_productos("fragmentos/grilla.html", v2, "menu") != primera
+    assert renders == [["pizzas"], ["pizzas", "empanadas"]]
+
+
+@pytest.mark.parametrize("existe", [True, False])
+def test_eliminar_producto_sube_version_solo_si_borro(cliente, base_falsa, monkeypatch, existe):
+    invalidaciones = []
+    monkeypatch.setattr(aplicacion.catalogo, "invalidar", lambda payload=None: invalidaciones.append(payload))
+
+    def responder(sql, params):
+        if sql.startswith("DELETE FROM productos"):
+            return [{}] if existe else []
+        if "catalogo_version" in sql:
+            return [{"version": 8}]
+        return []
+
+    cur = base_falsa(responder)
+    cliente.get("/eliminar_producto/3")
+
+    assert bool(cur.ejecutadas("pg_notify('catalogo'")) is existe
+    assert len(invalidaciones) == (1 if existe else 0)
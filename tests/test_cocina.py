@@ -0,0 +1,52 @@
+"""Ruteo de productos a las estaciones de cocina"""
+import app as aplicacion
+
+
+def test_estacion_por_categoria():
+    assert aplicacion.estacion_de({"categoria": "Pizzas", "tipo": "normal"}) == "horno"
+    assert aplicacion.estacion_de({"categoria": "Bebidas", "tipo": "normal"}) == "barra"
+
+
+def test_sin_regla_o_sin_producto_va_a_la_general():
+    assert aplicacion.estacion_de({"categoria": "Postres", "tipo": "normal"}) == aplicacion.COCINA_GENERAL
+    assert aplicacion.estacion_de(None) == aplicacion.COCINA_GENERAL
+
+
+def test_gana_la_primera_regla(monkeypatch):
+    monkeypatch.setattr(aplicacion, "COCINA_RUTAS", [
+        (None, "frio", "barra"),
+        ("Pizzas", None, "horno"),
+    ])
+    assert aplicacion.estacion_de({"categoria": "Pizzas", "tipo": "frio"}) == "barra"
+    assert aplicacion.estacion_de({"categoria": "Pizzas", "tipo": "normal"}) == "horno"
+
+
+def test_editar_venta_actualiza_la_cola(cliente, base_falsa, monkeypatch):
+    monkeypatch.setattr(aplicacion.catalogo, "obtener",
+                        lambda: {"productos": [{"id": 1, "nombre": "Muzza", "precio": 9000,
+                                                "categoria": "Pizzas", "tipo": "normal"}]})
+
+    def responder(sql, params):
+        if sql.startswith("SELECT * FROM ventas WHERE id=%s"):
+            return [{"id": 9, "estado": "OK", "turno_id": 3}]
+        if "RETURNING total" in sql:
+            return [{"total": 9000}]
+        return []
+
+    cur = base_falsa(responder)
+    cliente.post("/editar/9", data={"prod_1": "2"})
+
+    pasos = [sql for sql, _ in cur.consultas]
+    quitar = pasos.index(cur.ejecutadas("DELETE FROM comanda_items")[0][0])
+    comandar = pasos.index(cur.ejecutadas("INSERT INTO comanda_items")[0][0])
+    assert pasos.index(cur.ejecutadas("DELETE FROM detalle_venta")[0][0]) < quitar < comandar
+    assert cur.consultas[comandar][1]["venta"] == 9
+
+
+def test_editar_venta_eliminada_no_toca_la_cocina(cliente, base_falsa, monkeypatch):
+    monkeypatch.setattr(aplicacion.catalogo, "obtener", lambda: {"productos": []})
+    cur = base_falsa(lambda sql, params: [{"id": 9, "estado": "ELIMINADA", "turno_id": 3}]
+                     if sql.startswith("SELECT * FROM ventas") else [])
+    cliente.post("/editar/9", data={})
+
+    assert not cur.ejecutadas("comanda_items")
@@ -0,0 +1,49 @@
+"""Cantidad de consultas por request: las pantallas que listan pedidos o ventas con su detalle
+tienen que hacer siempre las mismas consultas, haya uno o muchos (sin N+1)"""
+from datetime import datetime
+
+import pytest
+
+
+def filas_de_ejemplo(cantidad):
+    """Responder para CursorFalso: `cantidad` pedidos o ventas, cada uno con tres líneas de detalle"""
+    ahora = datetime(2026, 1, 1, 21, 30)
+
+    def responder(sql, params):
+        if "pg_snapshot_xmin" in sql:
+            return [{"cursor": "1000"}]
+        if "FROM pedido_detalle" in sql or "FROM detalle_venta" in sql:
+            return [{"_padre": padre, "producto": "Pizza", "cantidad": 2, "precio": 100,
+                     "extras": "", "observaciones": ""}
+                    for padre in params[0] for _ in range(3)]
+        if "FROM pedidos" in sql:
+            return [{"id": i, "mesa": str(i), "total": 600, "fecha_hora": ahora}
+                    for i in range(1, cantidad + 1)]
+        if "total_pedidos" in sql:
+            return [{"total_pedidos": cantidad, "total_facturado": 0, "listos_enviar": 0,
+                     "salio": 0, "entregados": 0}]
+        if "FROM ventas" in sql:
+            return [{"id": i, "estado": "OK", "fecha_hora": ahora, "direccion_entrega": "Calle 123",
+                     "medio_pago": "efectivo", "estado_pago": "pendiente", "estado_delivery": "listo",
+                     "total": 600}
+                    for i in range(1, cantidad + 1)]
+        return []
+    return responder
+
+
+def consultas_de(cliente, base_falsa, ruta, cantidad):
+    cur = base_falsa(filas_de_ejemplo(cantidad))
+    respuesta = cliente.get(ruta)
+    assert respuesta.status_code == 200
+    return cur.consultas
+
+
+@pytest.mark.parametrize("ruta, esperadas", [
+    ("/pedidos", 2),
+    ("/api/pedidos/nuevos/detalle", 2),
+    ("/delivery", 5),
+    ("/api/delivery?since=1000", 5),
+])
+def test_consultas_constantes(cliente, base_falsa, ruta, esperadas):
+    assert len(consultas_de(cliente, base_falsa, ruta, 1)) == esperadas
+    assert len(consultas_de(cliente, base_falsa, ruta, 25)) == esperadas
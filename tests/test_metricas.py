@@ -0,0 +1,47 @@
+"""Histograma y texto de /metrics (formato Prometheus), y registro de requests que terminan en excepción"""
+import pytest
+
+import app as aplicacion
+
+
+def test_histograma_acumula_buckets():
+    hist = aplicacion.Histograma(buckets=(0.1, 1))
+    for valor in (0.05, 0.5, 0.7, 3):
+        hist.observar(valor)
+
+    lineas = list(hist.lineas("lat", 'ruta="/x"'))
+    assert lineas[:3] == ['lat_bucket{ruta="/x",le="0.1"} 1',
+                          'lat_bucket{ruta="/x",le="1"} 3',
+                          'lat_bucket{ruta="/x",le="+Inf"} 4']
+    assert lineas[3] == 'lat_sum{ruta="/x"} 4.250000'
+    assert lineas[4] == 'lat_count{ruta="/x"} 4'
+
+
+def test_texto_por_ruta_y_errores():
+    metricas = aplicacion.Metricas()
+    metricas.request(("/ventas", "POST"), 0.2, 3, 0.05, 200)
+    metricas.request(("/ventas", "POST"), 0.3, 2, 0.01, 500)
+    metricas.request(('/raro"ruta', "GET"), 0.1, 0, 0.0, 404)
+
+    texto = metricas.texto()
+    assert 'ruta="/ventas",metodo="POST"} 5' in texto  # facturador_db_queries_total
+    assert 'facturador_db_seconds_total{' in texto and 'metodo="POST"} 0.060000' in texto
+    errores = [l for l in texto.splitlines() if l.startswith("facturador_request_errors_total{")]
+    assert any(l.endswith('ruta="/ventas",metodo="POST"} 1') for l in errores)
+    assert any(l.endswith('ruta="/raro\\"ruta",metodo="GET"} 0') for l in errores)
+    assert 'facturador_request_duration_seconds_count{' in texto
+
+
+def test_request_con_excepcion_cuenta_como_500(cliente, monkeypatch):
+    metricas = aplicacion.Metricas()
+    monkeypatch.setattr(aplicacion, "metricas", metricas)
+
+    def get_db_roto():
+        raise RuntimeError("sin base")
+
+    monkeypatch.setattr(aplicacion, "get_db", get_db_roto)
+    with pytest.raises(RuntimeError):
+        cliente.get("/pedidos")
+
+    assert metricas._latencia[("/pedidos", "GET")].total == 1
+    assert metricas._errores[("/pedidos", "GET")] == 1
@@ -0,0 +1,68 @@
+"""API de pedidos de la PWA: reintentos con Idempotency-Key"""
+import pytest
+
+import app as aplicacion
+
+
+@pytest.fixture
+def pedidos_con_clave(base_falsa, monkeypatch):
+    """Base con el índice único de clave_idempotencia simulado: el segundo INSERT con la misma clave no entra"""
+    monkeypatch.setattr(aplicacion.catalogo, "obtener", lambda: {"por_id": {
+        1: {"id": 1, "nombre": "Muzza", "precio": 9000},
+        2: {"id": 2, "nombre": "Coca", "precio": 2500},
+    }})
+    guardados = {}
+
+    def responder(sql, params):
+        if "INSERT INTO pedidos" in sql:
+            mesa, _, _, total, clave, huella = params[:6]
+            if clave in guardados:
+                return []
+            guardados[clave] = {"id": len(guardados) + 1, "total": total, "huella_idempotencia": huella}
+            return [{"id": guardados[clave]["id"]}]
+        if "WHERE clave_idempotencia=%s" in sql:
+            return [guardados[params[0]]]
+        return []
+
+    base_falsa(responder)
+    return guardados
+
+
+def enviar(cliente, clave, mesa, items):
+    return cliente.post("/api/pedidos", json={"mesa": mesa, "items": items}, headers={"Idempotency-Key": clave})
+
+
+def test_reintento_devuelve_el_mismo_pedido(cliente, pedidos_con_clave):
+    items = [{"producto_id": 1, "cantidad": 2}]
+    primero = enviar(cliente, "abc", "4", items)
+    segundo = enviar(cliente, "abc", "4", items)
+
+    assert primero.status_code == 201
+    assert segundo.status_code == 200
+    assert segundo.get_json() == {"pedido_id": primero.get_json()["pedido_id"], "total": 18000, "repetido": True}
+
+
+@pytest.mark.parametrize("mesa, items", [
+    ("5", [{"producto_id": 1, "cantidad": 2}]),
+    ("4", [{"producto_id": 1, "cantidad": 3}]),
+    ("4", [{"producto_id": 1, "cantidad": 2}, {"producto_id": 2, "cantidad": 1}]),
+])
+def test_misma_clave_otro_pedido_es_422(cliente, pedidos_con_clave, mesa, items):
+    enviar(cliente, "abc", "4", [{"producto_id": 1, "cantidad": 2}])
+    respuesta = enviar(cliente, "abc", mesa, items)
+
+    assert respuesta.status_code == 422
+    assert respuesta.get_json()["pedido_id"] == 1
+
+
+def test_la_clave_en_el_cuerpo_no_cuenta(cliente, pedidos_con_clave):
+    cliente.post("/api/pedidos", json={"mesa": "4", "clave": "abc", "items": [{"producto_id": 1, "cantidad": 1}]})
+    assert None in pedidos_con_clave and "abc" not in pedidos_con_clave
+
+
+@pytest.mark.parametrize("mesa", ["x" * (aplicacion.PEDIDO_MAX_MESA + 1), "4\x00", "   "])
+def test_mesa_invalida_no_llega_a_la_base(cliente, pedidos_con_clave, mesa):
+    respuesta = cliente.post(f"/mesa/{mesa}/pedido", json={"items": [{"producto_id": 1, "cantidad": 1}]})
+
+    assert respuesta.status_code == 400
+    assert pedidos_con_clave == {}
@@ -0,0 +1,19 @@
+"""Tope de streams SSE por worker"""
+import threading
+
+import app as aplicacion
+
+
+def test_sin_cupo_responde_stream_vacio_con_retry(cliente, monkeypatch):
+    monkeypatch.setattr(aplicacion, "_cupos_sse", threading.BoundedSemaphore(1))
+    aplicacion._cupos_sse.acquire()
+
+    respuesta = cliente.get("/api/pedidos/stream")
+    cuerpo = respuesta.get_data(as_text=True)
+
+    # Un error HTTP cortaría la reconexión del EventSource para siempre
+    assert respuesta.status_code == 200
+    assert respuesta.mimetype == "text/event-stream"
+    assert cuerpo.startswith("retry: ")
+    assert int(cuerpo.split()[1]) >= aplicacion.SSE_REINTENTO_LLENO
+    assert "event:" not in cuerpo
@@ -0,0 +1,38 @@
+"""Cambios de estado con UPDATE condicional: quien pierde la carrera recibe 409 (fetch) o un aviso"""
+JSON = {"Accept": "application/json"}
+
+
+def cancelacion(aplicada):
+    def responder(sql, params):
+        if sql.startswith("UPDATE pedidos SET estado='CANCELADO'") and aplicada:
+            return [{"id": params[0]}]
+        return []
+    return responder
+
+
+def test_transicion_aplicada(cliente, base_falsa):
+    cur = base_falsa(cancelacion(True))
+    respuesta = cliente.get("/pedidos/cancelar/5", headers=JSON)
+
+    assert respuesta.status_code == 200
+    assert respuesta.get_json() == {"ok": True, "mensaje": "Pedido cancelado"}
+    assert cur.ejecutadas("DELETE FROM comanda_items")
+
+
+def test_carrera_perdida_devuelve_409(cliente, base_falsa):
+    cur = base_falsa(cancelacion(False))
+    respuesta = cliente.get("/pedidos/cancelar/5", headers=JSON)
+
+    assert respuesta.status_code == 409
+    assert respuesta.get_json()["ok"] is False
+    assert not cur.ejecutadas("DELETE FROM comanda_items")
+
+
+def test_carrera_perdida_sin_json_redirige(cliente, base_falsa):
+    base_falsa(cancelacion(False))
+    respuesta = cliente.get("/pedidos/cancelar/5")
+
+    assert respuesta.status_code == 302
+    assert respuesta.headers["Location"].endswith("/pedidos")
+    with cliente.session_transaction() as sesion:
+        assert sesion["_flashes"][0][0] == "warning"
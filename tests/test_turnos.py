@@ -0,0 +1,134 @@
+"""Cierre de turno y paginación por clave del historial de turnos"""
+from datetime import datetime, timedelta
+
+import app as aplicacion
+
+
+def test_cerrar_turno_guarda_snapshot(cliente, base_falsa):
+    def responder(sql, params):
+        if "FROM turnos WHERE estado='ABIERTO' FOR UPDATE" in sql:
+            return [{"id": 7, "estado": "ABIERTO"}]
+        if "RETURNING total" in sql:
+            return [{"total": 1500}]
+        if "MIN(fecha_hora)" in sql:
+            return [{"desde": None, "hasta": None}]
+        return []
+
+    cur = base_falsa(responder)
+    respuesta = cliente.get("/cerrar_turno")
+
+    assert respuesta.status_code == 302
+    assert respuesta.headers["Location"].endswith("/turnos/7/cierre")
+    assert cur.ejecutadas("SET estado='CERRADO'")[0][1] == (7,)
+    snapshot = cur.ejecutadas("INSERT INTO turno_resumen")
+    assert len(snapshot) == 1 and snapshot[0][1] == {"turno": 7}
+    # El snapshot se guarda después de marcar el turno cerrado, en la misma transacción
+    pasos = [sql for sql, _ in cur.consultas]
+    assert pasos.index(cur.ejecutadas("SET estado='CERRADO'")[0][0]) < pasos.index(snapshot[0][0])
+    assert cur.ejecutadas("pg_notify('turnos'")[0][1] == ("7",)
+
+
+def test_cerrar_turno_sin_turno_abierto(cliente, base_falsa):
+    cur = base_falsa()
+    respuesta = cliente.get("/cerrar_turno")
+
+    assert respuesta.headers["Location"].endswith("/turnos")
+    assert not cur.ejecutadas("INSERT INTO turno_resumen")
+
+
+def test_cierre_lee_el_snapshot(cliente, base_falsa, monkeypatch):
+    def responder(sql, params):
+        if sql.startswith("SELECT * FROM turnos WHERE id=%s"):
+            return [{"id": 7, "estado": "CERRADO", "total": 1500}]
+        if "FROM turno_resumen" in sql:
+            return [{"producto": "Pizza", "cantidad": 3, "total": 1500}]
+        return []
+
+    renderizados = []
+    monkeypatch.setattr(aplicacion, "render_template", lambda plantilla, **ctx: renderizados.append(ctx) or "")
+    cur = base_falsa(responder)
+    cliente.get("/turnos/7/cierre")
+
+    assert renderizados[0]["detalle"] == [{"producto": "Pizza", "cantidad": 3, "total": 1500}]
+    assert not cur.ejecutadas("FROM detalle_venta")
+
+
+def historial(cantidad):
+    """Responder con los turnos 1..cantidad que aplica el keyset como lo haría la base"""
+    ids = list(range(1, cantidad + 1))
+
+    def responder(sql, params):
+        if sql.startswith("SELECT * FROM turnos WHERE id > %s"):
+            despues, limite = params
+            elegidos = [i for i in ids if i > despues][:limite]
+        elif sql.startswith("SELECT * FROM turnos WHERE (%(antes)s IS NULL"):
+            antes, limite = params["antes"], params["limite"]
+            elegidos = [i for i in reversed(ids) if antes is None or i < antes][:limite]
+        else:
+            return []
+        return [{"id": i, "fecha": "2026-01-01", "estado": "CERRADO", "total": 0} for i in elegidos]
+    return responder
+
+
+def pagina_de_turnos(cliente, base_falsa, monkeypatch, consulta, cantidad=65):
+    renderizados = []
+    monkeypatch.setattr(aplicacion, "render_template", lambda plantilla, **ctx: renderizados.append(ctx) or "")
+    base_falsa(historial(cantidad))
+    cliente.get("/turnos" + consulta)
+    ctx = renderizados[0]
+    return [t["id"] for t in ctx["turnos"]], ctx["mas_recientes"], ctx["mas_antiguos"]
+
+
+def test_keyset_turnos_bordes(cliente, base_falsa, monkeypatch):
+    por_pagina = aplicacion.TURNOS_POR_PAGINA
+
+    ids, recientes, antiguos = pagina_de_turnos(cliente, base_falsa, monkeypatch, "")
+    assert ids == list(range(65, 65 - por_pagina, -1)) and not recientes and antiguos
+
+    ids, recientes, antiguos = pagina_de_turnos(cliente, base_falsa, monkeypatch, "?antes=36")
+    assert ids == list(range(35, 35 - por_pagina, -1)) and recientes and antiguos
+
+    # Última página: justo lo que queda, sin enlace a más antiguos
+    ids, recientes, antiguos = pagina_de_turnos(cliente, base_falsa, monkeypatch, "?antes=6")
+    assert ids == [5, 4, 3, 2, 1] and recientes and not antiguos
+
+    # Hacia adelante se muestra igual, del más nuevo al más viejo
+    ids, recientes, antiguos = pagina_de_turnos(cliente, base_falsa, monkeypatch, "?despues=5")
+    assert ids == list(range(5 + por_pagina, 5, -1)) and recientes and antiguos
+
+    # Exactamente una página hasta el más nuevo: no hay más recientes
+    ids, recientes, antiguos = pagina_de_turnos(cliente, base_falsa, monkeypatch, f"?despues={65 - por_pagina}")
+    assert ids == list(range(65, 65 - por_pagina, -1)) and not recientes and antiguos
+
+
+def test_keyset_ventas_eliminadas(cliente, base_falsa, monkeypatch):
+    por_pagina = aplicacion.ELIMINADAS_POR_PAGINA
+    inicio = datetime(2026, 1, 1, 20, 0)
+    # Dos ventas por minuto: el id desempata las que comparten fecha_hora
+    eliminadas = [{"id": i, "fecha_hora": inicio + timedelta(minutes=i // 2), "total": 0}
+                  for i in range(100, 0, -1)]
+
+    def responder(sql, params):
+        if "estado='ELIMINADA'" in sql:
+            desde = params["fecha"]
+            filas = [v for v in eliminadas if desde is None or (v["fecha_hora"], v["id"]) < (desde, params["id"])]
+            return filas[:params["limite"]]
+        return []
+
+    renderizados = []
+    monkeypatch.setattr(aplicacion, "render_template", lambda plantilla, **ctx: renderizados.append(ctx) or "")
+    with cliente.session_transaction() as sesion:
+        sesion["rol"] = "ADMIN"
+    cur = base_falsa(responder)
+
+    cliente.get("/turnos")
+    primera = renderizados[-1]
+    assert [v["id"] for v in primera["ventas_eliminadas"]] == list(range(100, 100 - por_pagina, -1))
+    siguiente = primera["eliminadas_siguiente"]
+    assert siguiente == {"elim_fecha": eliminadas[por_pagina - 1]["fecha_hora"].isoformat(),
+                         "elim_id": 100 - por_pagina + 1}
+
+    cliente.get(f"/turnos?elim_fecha={siguiente['elim_fecha']}&elim_id={siguiente['elim_id']}")
+    segunda = renderizados[-1]
+    assert [v["id"] for v in segunda["ventas_eliminadas"]][0] == 100 - por_pagina
+    assert cur.ejecutadas("estado='ELIMINADA'")[-1][1]["id"] == siguiente["elim_id"]